@@ -1,4 +1,4 @@
-from flask import current_app as app, url_for
+from flask import current_app as app, url_for, g
 
 from .validation import accounts as val
 from .routes.routing import hal, json_abort, api_url
@@ -60,7 +60,8 @@ def get_profile(access_token):
 
 def delete_access_token(access_token):
     # api
-    fnc = lambda: srv_acc.delete_access_token(access_token)
+    digest = g.access_token_digest
+    fnc = lambda: srv_acc.delete_access_token(access_token, digest)
     run_or_abort(fnc)
     return {}, 200, []
 
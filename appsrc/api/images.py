@@ -2,25 +2,56 @@ from .routes.routing import api_url, json_abort, hal
 from .utils import run_or_abort
 from ..service import images as img_srv
 
+# seconds a status request may wait for derivatives
+MAX_WAIT = 10
+
 def post_source_image(domain, image=None):
     # api
+    """
+    Store the upload and return, the derivatives are generated by a worker:
+    202 with the status resource to poll, or 200 if they already exist.
+    """
     try:
         source_file = image[0]
     except IndexError:
         json_abort(400, {'error': 'No file uploaded'})
     source_image_fnc = lambda: img_srv.save_source_image(domain.domain_id, source_file)
     source_image_record = run_or_abort(source_image_fnc)
-    main_image_fnc = lambda: img_srv.generate_main_copy(source_image_record)
-    main_image_record = run_or_abort(main_image_fnc)
+    status = run_or_abort(lambda: img_srv.queue_derivatives(source_image_record))
+    source_image_id = source_image_record.source_image_id
+    main_image_record = None
+    if status==img_srv.READY:
+        main_image_record = img_srv.get_main_image_record(source_image_record)
+    rv = _derivatives_resource(source_image_id, status, main_image_record)
+    status_url = api_url('api.get_source_image_status', image_id=source_image_id)
+    return rv.document, 200 if status==img_srv.READY else 202, [('Location', status_url)]
+
+def get_source_image_status(image_id, domain, params):
+    # api
+    """
+    With `wait=<seconds>`, answer once the derivatives aren't pending
+    anymore, or after that long (MAX_WAIT at most).
+    """
+    try:
+        wait = min(max(float(params.get('wait', 0)), 0), MAX_WAIT)
+    except (TypeError, ValueError):
+        json_abort(400, {'error': '"wait" must be a number of seconds'})
+    fnc = lambda: img_srv.wait_for_derivatives(image_id, domain.domain_id, wait)
+    status, main_image_record = run_or_abort(fnc)
+    rv = _derivatives_resource(image_id, status, main_image_record)
+    return rv.document, 200, []
+
+def _derivatives_resource(source_image_id, status, main_image_record):
+    # api
     rv = hal()
-    source_image_id = source_image_record.image_id
-    base_image_id = main_image_record.base_image_id
+    rv._l('self', api_url('api.get_source_image_status', image_id=source_image_id))
     rv._k('source_image_id', source_image_id)
-    #rv._l('source_image', api_url('api.get_source_image', image_id=image_id))
+    rv._k('status', status)
     if main_image_record:
+        base_image_id = main_image_record.base_image_id
         rv._k('image_id', base_image_id)
         rv._l('image', api_url('api.get_image', image_id=base_image_id))
-    return rv.document, 200, ()
+    return rv
 
 def get_images(domain, params):
     # api
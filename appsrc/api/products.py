@@ -7,7 +7,7 @@ from .routes.routing import hal, api_url
 from .utils import run_or_abort
 from .images import _image_resource
 from ..utils.uuid import clean_uuid
-from ..service import products as prod_srv
+from ..service import products as prod_srv, render_cache
 from ..db.schema import generic as product_schema
 
 def _delocalize_product_field(field, lang):
@@ -47,29 +47,74 @@ def _field_schema(f, lang):
 
 def get_products(params, domain, lang):
     # api
-    last_product_id = params.get('last_product')
+    cursor = params.get('next')
     search_query = params.get('q')
-    fnc = lambda: prod_srv.get_products(domain, lang, last_product_id, search_query)
+    fnc = lambda: prod_srv.get_products(domain, lang, cursor, search_query)
     result = run_or_abort(fnc)
     rv = hal()
     product_url = api_url('api.get_product', product_id='{product_id}')
     rv._l('self', api_url('api.get_products', **params))
+    if result['next']:
+        next_params = {k:v for k,v in params.items() if k!='next'}
+        rv._l('next', api_url('api.get_products', next=result['next'], **next_params))
     rv._l(f'{app.config.API_NAMESPACE}:product', product_url, unquote=True, templated=True)
     rv._k('product_ids', result['product_ids'])
     rv._k('last_product', result['last_product'])
     rv._k('has_more', result['has_more'])
+    rv._k('next', result['next'])
     return rv.document, 200, []
 
+def product_version(domain, params, product_id, **kw):
+    # api
+    """
+    Version of a product resource, for conditional requests: the version its
+    cached documents are keyed by.
+    """
+    return prod_srv.get_product_version(product_id, domain.domain_id)
+
+def product_resources_version(domain, params, **kw):
+    # api
+    """
+    Version of a collection of product resources (`pid` params), for
+    conditional requests: the versions their cached documents are keyed by.
+    """
+    versions = prod_srv.get_product_versions(params.getlist('pid'), domain.domain_id)
+    return ','.join(f'{clean_uuid(pid)}:{version}' for pid, version in versions)
+
+def _cached_product_resources(product_ids, domain_id, lang, audience, render):
+    # api
+    """
+    Rendered documents of products, only (re)rendering those that are not
+    found in the render cache for their current version.
+    """
+    fnc = lambda: prod_srv.get_product_versions(product_ids, domain_id)
+    versions = run_or_abort(fnc)
+    load = lambda ids: run_or_abort(
+        lambda: prod_srv.get_product_by_ids(ids, domain_id, lang))
+    return render_cache.cached_resources(
+        domain_id, versions, lang, audience, load, lambda p: render(p, lang))
+
+def _cached_product_resource(product, lang, audience, render):
+    # api
+    domain_id = product.domain_id
+    version = prod_srv.document_version(product.updated_ts, product.render_version)
+    document = render_cache.get(
+        domain_id, product.product_id, version, lang, audience)
+    if document is None:
+        document = render_cache.set(
+            domain_id, product.product_id, version, lang, audience,
+            render(product, lang))
+    return document
+
 def get_product_resources(params, domain, lang):
     # api
     product_ids = params.getlist('pid')
-    domain_id = domain.domain_id
-    fnc = lambda: prod_srv.get_product_by_ids(product_ids, domain_id, lang)
-    products = run_or_abort(fnc)
+    products = _cached_product_resources(
+        product_ids, domain.domain_id, lang, render_cache.ADMIN, _get_product_resource)
     rv = hal()
     rv._l('self', api_url('api.get_product_resources'))
-    rv._k('product_ids', [p.product_id for p in products])
-    rv._embed('products', [_get_product_resource(p, lang) for p in products])
+    rv._k('product_ids', [p['product_id'] for p in products])
+    rv._embed('products', products)
     return rv.document, 200, []
 
 def get_product_schema(lang):
@@ -99,7 +144,8 @@ def get_product(product_id, domain, params, lang):
     partial = int(params.get('partial', False))
     fnc = lambda: prod_srv.get_product(product_id, domain.domain_id)
     product = run_or_abort(fnc)
-    document = _get_product_resource(product, lang)
+    document = _cached_product_resource(
+        product, lang, render_cache.ADMIN, _get_product_resource)
     return document, 200, []
 
 def _get_product_resource(product, lang):
@@ -161,8 +207,9 @@ def put_product(product_id, data, domain, lang):
     domain_id = domain.domain_id
     update_product = lambda: prod_srv.update_product(product_id, data, domain_id, lang)
     product = run_or_abort(update_product)
-    update_search_index = lambda: prod_srv.update_search_index(product, lang)
-    run_or_abort(update_search_index)
+    if not app.config.SEARCH_INDEX_TRIGGER:
+        update_search_index = lambda: prod_srv.update_search_index(product, lang)
+        run_or_abort(update_search_index)
     return {}, 200, []
 
 def put_product_groups(product_id, data, domain):
@@ -175,12 +222,14 @@ def put_product_groups(product_id, data, domain):
 
 def get_product_details(domain, lang, params):
     # api
-    fnc = lambda: prod_srv.product_details(domain, params)
-    products = run_or_abort(fnc)
+    product_ids = params.getlist('pid')
     #TODO: validate params
+    products = _cached_product_resources(
+        product_ids, domain.domain_id, lang, render_cache.ADMIN,
+        _get_product_resource) if product_ids else []
     rv = hal()
     rv._l('self', api_url('api.get_product_details'))
-    rv._embed('products', [_get_product_resource(p, lang) for p in products])
+    rv._embed('products', products)
     return rv.document, 200, []
 
 def patch_product(product_id, data, domain, lang):
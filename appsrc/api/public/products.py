@@ -7,9 +7,13 @@ from ..utils import run_or_abort
 from ..products import (
     _delocalize_product_field,
     _get_product_groups_dict,
-    _get_product_groups_list)
+    _get_product_groups_list,
+    _cached_product_resource,
+    _cached_product_resources,
+    product_version,
+    product_resources_version)
 from ..images import _image_resource
-from ...service import groups as grp_srv, products as prd_srv
+from ...service import groups as grp_srv, products as prd_srv, render_cache
 from ...utils.uuid import clean_uuid
 
 #from .validation.products import (add_product, edit_product)
@@ -52,30 +56,39 @@ def _get_group_resource(group, lang):
 def get_public_products(domain, params):
     # api
     domain_id = domain.domain_id
+    cursor = params.get('next')
     # groups are passed as url quoted json string
     # TODO: validate that this is a list of objects with format
     # {'options': [...]}
     groups = json.loads(parse.unquote(params['groups'])) if params.get('groups') else None
-    fnc = lambda: prd_srv.get_products_filtered_by_group(domain_id, groups)
-    products = run_or_abort(fnc)
+    fnc = lambda: prd_srv.get_products_filtered_by_group(domain_id, groups, cursor)
+    result = run_or_abort(fnc)
+    counts = run_or_abort(lambda: prd_srv.get_group_option_counts(domain_id, groups))
     product_url = api_url('api.get_public_product', product_id='{product_id}')
     rv = hal()
     rv._l('self', api_url('api.get_public_products', **params))
+    if result['next']:
+        next_params = {k:v for k,v in params.items() if k!='next'}
+        rv._l('next', api_url(
+            'api.get_public_products', next=result['next'], **next_params))
     rv._l(f'{app.config.API_NAMESPACE}:product', product_url, unquote=True,
           templated=True)
-    rv._k('products', [p.product_id for p in products])
+    rv._k('products', result['product_ids'])
+    rv._k('option_counts', counts)
+    rv._k('has_more', result['has_more'])
+    rv._k('next', result['next'])
     return rv.document, 200, []
 
 def get_public_product_resources(params, domain, lang):
     # api
     product_ids = params.getlist('pid')
-    domain_id = domain.domain_id
-    fnc = lambda: prd_srv.get_product_by_ids(product_ids, domain_id, lang)
-    products = run_or_abort(fnc)
+    products = _cached_product_resources(
+        product_ids, domain.domain_id, lang, render_cache.PUBLIC,
+        _get_product_resource)
     rv = hal()
     rv._l('self', api_url('api.get_product_resources'))
-    rv._k('product_ids', [p.product_id for p in products])
-    rv._embed('products', [_get_product_resource(p, lang) for p in products])
+    rv._k('product_ids', [p['product_id'] for p in products])
+    rv._embed('products', products)
     return rv.document, 200, []
 
 #def _get_product_resource(product):
@@ -119,7 +132,8 @@ def get_public_product(product_id, domain, params, lang):
     # api
     # in the meantime, while waiting for validation
     product = run_or_abort(lambda: prd_srv.get_product(product_id, domain.domain_id))
-    document = _get_product_resource(product, lang)
+    document = _cached_product_resource(
+        product, lang, render_cache.PUBLIC, _get_product_resource)
     return document, 200, []
 
 # ------------------------ Product Schema ------------------------ #
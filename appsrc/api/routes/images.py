@@ -6,6 +6,8 @@ r('/source-images', img.post_source_image, methods=['POST'], expects_files=['ima
 r('images', img.get_images, expects_domain=True, expects_params=True,
        authorize=domain_owner_authz)
 #r('/source-images/<image_id>', img.get_source_image, expects_domain=True)
+r('/source-images/<image_id>/status', img.get_source_image_status, expects_domain=True,
+       expects_params=True, authorize=domain_owner_authz)
 r('/images/<image_id>', img.get_image, expects_domain=True)
 r('/products/<product_id>/images', img.get_product_images, expects_domain=True,
        authorize=domain_owner_authz, expects_params=True)
@@ -3,17 +3,21 @@ from ..routing import (explicit_route as r, domain_member_authorization as domai
 from ...public import products as prd
 
 r('/public/groups/<group_id>', prd.get_public_group, expects_domain=True,
-  expects_lang=True, authenticate=privacy_control, authorize=domain_member)
+  expects_lang=True, authenticate=privacy_control, authorize=domain_member,
+  cacheable=True, if_none_match=True)
 r('/public/groups', prd.get_public_groups, expects_domain=True, expects_lang=True,
-  authenticate=privacy_control, authorize=domain_member)
+  authenticate=privacy_control, authorize=domain_member, cacheable=True,
+  if_none_match=True)
 r('/public/products', prd.get_public_products, expects_params=True, expects_domain=True,
-  authenticate=privacy_control, authorize=domain_member,)
+  authenticate=privacy_control, authorize=domain_member, cacheable=True,
+  if_none_match=True)
 r('/public/product-resources', prd.get_public_product_resources, expects_params=True,
   expects_lang=True, expects_domain=True, authenticate=privacy_control,
-  authorize=domain_member)
+  authorize=domain_member, cacheable=True,
+  if_none_match=prd.product_resources_version)
 r('/public/products/<product_id>', prd.get_public_product, expects_domain=True,
   expects_params=True, authenticate=privacy_control, authorize=domain_member,
-  expects_lang=True)
+  expects_lang=True, cacheable=True, if_none_match=prd.product_version)
 
 # --------------
 # Product Schema
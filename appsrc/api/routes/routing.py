@@ -1,26 +1,27 @@
 import re
 import jwt
+import hashlib
 import functools
 
 import requests
 from flask import g, request, url_for, current_app as app, jsonify, abort
 from werkzeug import exceptions as werk_exc, Response
 from werkzeug.datastructures import MultiDict
-from sqlalchemy.orm import exc as orm_exc
 
 from .. import blueprint as bp
 from ...db import db
-from ...db.models.accounts import Account
-from ...db.models.domains import Domain, DomainAccount
+from ...db.models.domains import DomainAccount
 from ...utils.jsontools import json_response
 from ...utils.hal import Resource as Hal
-from ...service import accounts as srv_acc, domains as srv_dom
+from ...service import (
+    accounts as srv_acc, domains as srv_dom, domain_cache, auth_cache,
+    errors as srv_err)
 
 def _check_domain_ownership(domain_name, **kw):
     account = srv_acc.get_account(g.access_token['account_id'])
     try:
-        domain = Domain.query.filter_by(name=domain_name).one()
-    except (orm_exc.NoResultFound, orm_exc.MultipleResultsFound):
+        domain = domain_cache.get(domain_name)
+    except srv_err.NotFound:
         json_abort(404, {'error': 'Domain not found.'})
     domain_account = srv_dom.get_domain_account(
         domain_id=domain.domain_id, account_id=g.access_token['account_id'])
@@ -45,11 +46,12 @@ def id_token_authentication(**kw):
     scheme, credentials = request.headers['authorization'].split(' ')
     if scheme.lower()!='bearer':
         return False
-    try:
-        g.current_account = Account.query.filter_by(id_token=credentials).one()
-        return True
-    except (orm_exc.NoResultFound, orm_exc.MultipleResultsFound):
+    # an account snapshot, see `service.auth_cache`
+    account = auth_cache.get_id_token_account(credentials)
+    if account is None:
         return False
+    g.current_account = account
+    return True
 
 #TODO: id_token_authentication sets g.current_account to an object, whereas
 # access_token_authentication sets it to a dict. Some consistency would be
@@ -62,8 +64,9 @@ def domain_extractor(endpoint, values):
         return
     domain_name = values.pop('domain')
     try:
-        domain = Domain.query.filter_by(name=domain_name).one()
-    except:
+        # a snapshot, see `service.domain_cache`
+        domain = domain_cache.get(domain_name)
+    except srv_err.NotFound:
         raise werk_exc.NotFound('API Not Found')
     g.domain = domain
 
@@ -99,8 +102,8 @@ def corsify(response):
     response.headers[
         'Access-Control-Allow-Headers'] = (
             'Authorization, Content-Type, Cache-Control, X-Requested-With, '
-            'Location, access-token, Access-Token, Origin')
-    response.headers['Access-Control-Expose-Headers'] = 'Location'
+            'Location, access-token, Access-Token, Origin, If-Match, If-None-Match')
+    response.headers['Access-Control-Expose-Headers'] = 'Location, ETag'
     response.headers['Access-Control-Allow-Credentials'] = 'true'
     return response
 
@@ -211,15 +214,24 @@ def access_token_authentication():
     if not token:
         return
     try:
-        secret = app.config['SECRET_KEY']
-        #TODO: move the algo in the config
-        payload = jwt.decode(token, secret, algorithms=['HS256'])
-    except (jwt.DecodeError, jwt.ExpiredSignatureError):
+        # verified once per worker, see `service.auth_cache`
+        access_token = auth_cache.verify_access_token(token)
+    except jwt.InvalidTokenError:
         json_abort(400, {'error': 'Invalid token'})
-    g.access_token = payload
-    g.current_account = payload
+    g.access_token = access_token.claims
+    g.current_account = access_token.claims
+    g.access_token_digest = auth_cache.token_digest(token)
+    g.token_role = (access_token.domain, access_token.role)
     return True
 
+def token_role(domain_name):
+    """
+    Role granted by the access token on the domain, None if the token was
+    issued for another domain.
+    """
+    domain, role = g.token_role
+    return role if domain==domain_name else None
+
 #def access_token_cookie_setter(fnc):
 #    @functools.wraps(fnc)
 #    def wrapper(*a, **kw):
@@ -260,8 +272,8 @@ def access_token_authentication():
 #        pass
 
 def domain_privacy_control(**kw):
-    # make privacy level 'private' by default
-    if g.domain.meta.get('privacy', 'private')=='public':
+    # privacy level is 'private' by default
+    if g.domain.privacy=='public':
         return True
     try:
         return access_token_authentication()
@@ -297,18 +309,16 @@ def authentication(fnc, processor):
 # if a resource must go through authorization an access_token should
 # be present in g.
 def domain_owner_authorization(**kw):
-    domain_member = g.access_token['domain']==g.domain.name
-    return domain_member and g.access_token['role']=='admin'
+    return token_role(g.domain.name)=='admin'
 
 def account_owner_authorization(**kw):
     return g.access_token['account_id']==kw.get('account_id')
 
 def domain_member_authorization(**kw):
-    # make privacy level 'private' by default
-    if g.domain.meta.get('privacy', 'private')=='public':
+    # privacy level is 'private' by default
+    if g.domain.privacy=='public':
         return True
-    member = g.access_token['domain']==g.domain.name
-    return member and g.access_token['role'] in ['admin', 'user']
+    return token_role(g.domain.name) in ['admin', 'user']
 
 def authorization(fnc, processor):
     @functools.wraps(fnc)
@@ -421,20 +431,89 @@ def passthrough_view(fnc, passthrough_url):
     return wrapper
 
 # TODO: temporary until we involve cache, then use jsontools version
+def make_json_response(data):
+    if data is None:
+        raise TypeError("'NoneType' object returned from view")
+    # views that already produced a response (e.g. `conditional_wrapper`)
+    if isinstance(data, Response):
+        return data
+    try:
+        data, status, headers = data
+    except ValueError as e: # (too many|need more) values to unpack
+        status, headers = 200, []
+    # we'll assume that only one value was provided
+    return json_response(data, status=status, headers=headers)
+
 def json_response_wrapper(fnc):
     @functools.wraps(fnc)
     def wrapper(*a, **kw):
-        data = fnc(*a, **kw)
-        if data is None:
-            raise TypeError("'NoneType' object returned from view")
-        try:
-            data, status, headers = data
-        except ValueError as e: # (too many|need more) values to unpack
-            status, headers = 200, []
-        # we'll assume that only one value was provided
-        return json_response(data, status=status, headers=headers)
+        return make_json_response(fnc(*a, **kw))
     return wrapper
 
+""" conditional requests """
+def version_etag(version):
+    """
+    Strong ETag of a representation, from the version of the entities it's
+    rendered from (e.g. `products.updated_ts`). The path and lang are part of
+    it, other params must be accounted for by the version itself.
+    """
+    key = '\n'.join([request.path, getattr(g, 'lang', None) or '', str(version)])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def resource_version(version, **kw):
+    return version(domain=getattr(g, 'domain', None), params=request.args, **kw)
+
+def cache_headers(response, etag=None, cacheable=False):
+    if etag:
+        response.set_etag(etag)
+    if cacheable:
+        # `True` means clients may store the response but must revalidate it
+        # each time, a number of seconds that it may be reused as is.
+        freshness = 'no-cache' if cacheable is True else f'max-age={int(cacheable)}'
+        response.headers['Cache-Control'] = f'private, {freshness}'
+        response.vary.update(['Authorization', 'Origin'])
+    return response
+
+def not_modified(etag, cacheable):
+    return cache_headers(Response(status=304), etag, cacheable)
+
+def conditional_wrapper(fnc, cacheable=False, if_match=None, if_none_match=None):
+    """
+    - `if_match`: a version function (see below). Requests with an If-Match
+    header that doesn't match the resource's current ETag get a 412 before
+    the view is called.
+    - `if_none_match`: a version function, or True. With a version function
+    the ETag is known before the view is called, and requests with a matching
+    If-None-Match get a 304 without the view being called at all. With True
+    (or when the version is unknown), the ETag is a hash of the response body.
+    - `cacheable`: adds Cache-Control and Vary headers to the response.
+
+    Version functions are called with the domain, the request params and the
+    url values, e.g. `product_version(domain, params, product_id)`, and return
+    the current version of the resource, or None if it's unknown.
+    """
+    @functools.wraps(fnc)
+    def wrapper(*a, **kw):
+        if callable(if_match) and request.if_match:
+            version = resource_version(if_match, **kw)
+            if version is None or not request.if_match.contains(version_etag(version)):
+                json_abort(412, {'error': 'Precondition failed: resource has changed.'})
+        etag = None
+        if callable(if_none_match):
+            version = resource_version(if_none_match, **kw)
+            if version is not None:
+                etag = version_etag(version)
+                if request.if_none_match.contains_weak(etag):
+                    return not_modified(etag, cacheable)
+        response = make_json_response(fnc(*a, **kw))
+        if response.status_code!=200:
+            return response
+        if if_none_match and etag is None:
+            etag = hashlib.sha1(response.get_data()).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag, cacheable)
+        return cache_headers(response, etag, cacheable)
+    return wrapper
 
 api_actions = {}
 
@@ -455,9 +534,13 @@ def route(
         _domained = domained
         _methods = methods
         _authenticate = authenticate
+        # readonly routes get an ETag, from the response body by default.
+        _if_none_match = if_none_match or readonly
         api_actions[_endpoint] = dict(
             fnc=fnc,
             cacheable=cacheable,
+            if_match=if_match,
+            if_none_match=_if_none_match,
             methods=_methods,
             domained=_domained,
             expects_account=expects_account,
@@ -468,8 +551,6 @@ def route(
             expects_lang=expects_lang,
             readonly=readonly,
         )
-        #if cacheable:
-        #    fnc = cache_wrapper(fnc, cache)
         # expects_data and expects_files are mutually exclusive
         # having precedence
         #if passthrough:
@@ -523,6 +604,12 @@ def route(
             # cannot pass auth without authentication
             _authenticate = _authenticate or True
             fnc = auth_injector(fnc)
+        if cacheable or if_match or _if_none_match:
+            # within authorization: a 304 or 412 must not leak anything
+            # to unauthorized clients.
+            fnc = conditional_wrapper(
+                fnc, cacheable=cacheable, if_match=if_match,
+                if_none_match=_if_none_match)
         if authorize:
             # cannot have authz without authn
             _authenticate = _authenticate or True
@@ -1,5 +1,13 @@
 import dramatiq
 
+# Queues, by priority. Workers are started per queue (scripts/dramatiq.sh), so
+# that a backlog of bulk emails doesn't hold passcodes back; within a worker
+# consuming several queues, messages of lower `priority` actors go first.
+PASSCODES = 'passcodes'
+IMAGES = 'images'
+INQUIRIES = 'inquiries'
+MAINTENANCE = 'maintenance'
+PRIORITIES = {PASSCODES: 0, IMAGES: 5, INQUIRIES: 10, MAINTENANCE: 100}
 
 def set_broker(broker, host):
     if broker=='redis':
@@ -14,14 +14,50 @@ DATA_FILES = os.path.join(APP_PATH, 'data')
 ALLOWED_ORIGINS_REGEX = env.string('ALLOWED_ORIGINS_REGEX')
 
 THUMBOR_SERVER = env.string('THUMBOR_SERVER')
+# 'thumbor' renders image variants on demand, 'local' pre-renders them with
+# Pillow into IMAGE['DUMP']/variants, served as static files under
+# IMAGE_VARIANTS_URL.
+IMAGE_RENDER_MODE = env.string('IMAGE_RENDER_MODE', default='thumbor', required=False)
+IMAGE_VARIANTS_URL = env.string('IMAGE_VARIANTS_URL', default='/variants/', required=False)
+# processes rendering the variants of an image, per images worker process
+# (IMAGE_PROCESSES, see scripts/dramatiq.sh): 1 renders in the worker itself
+IMAGE_RENDER_PROCESSES = env.num('IMAGE_RENDER_PROCESSES', default=1, required=False)
 MAIL_PROVIDER = env.string('MAIL_PROVIDER')
 MAILER = mailer.select(MAIL_PROVIDER)
+# SMTP connections kept open per worker process, and seconds after which an
+# idle one is checked with NOOP before reuse.
+MAIL_POOL_SIZE = env.num('MAIL_POOL_SIZE', default=4, required=False)
+MAIL_KEEPALIVE = env.num('MAIL_KEEPALIVE', default=30, required=False)
+# Bulk emails (inquiry notifications) sent per minute, all workers included.
+# Keep it under the provider's cap, with room for passcodes.
+MAIL_RATE_LIMIT = env.num('MAIL_RATE_LIMIT', default=100, required=False)
+# Inquiry notification jobs running at once, all workers included.
+INQUIRY_CONCURRENCY = env.num('INQUIRY_CONCURRENCY', default=1, required=False)
+# Seconds a scheduler replica holds the leader lease without renewing it,
+# i.e. how long standbys wait before taking over.
+SCHEDULER_LEASE_TTL = env.num('SCHEDULER_LEASE_TTL', default=10, required=False)
 
 # I18N and L10N
 LOCALES = env.json('LOCALES')
 LOCALE = env.string('LOCALE')                   #'fr_CA.UTF-8'
 DEFAULT_LANG = env.string('DEFAULT_LANG')       #'en'
 AVAILABLE_LANGS = env.json('AVAILABLE_LANGS')   # ['en', 'fr']
+# Let the database trigger maintain `product_search` instead of indexing from
+# the API after each product write. Enable once `flask setup-search-index` has
+# installed the trigger and the search languages.
+SEARCH_INDEX_TRIGGER = env.boolean('SEARCH_INDEX_TRIGGER', default=False, required=False)
+# Rendered product documents are cached in-process and in Redis (REDIS_HOST).
+RENDER_CACHE = env.boolean('RENDER_CACHE', default=True, required=False)
+# Seconds a worker may keep a domain snapshot, in case an invalidation over
+# Redis pub/sub is missed.
+DOMAIN_CACHE_TTL = env.num('DOMAIN_CACHE_TTL', default=60, required=False)
+# Seconds a worker may keep the account of an id token. Access tokens are kept
+# until they expire.
+AUTH_CACHE_TTL = env.num('AUTH_CACHE_TTL', default=300, required=False)
+# bcrypt cost factor of new password hashes. Older hashes are upgraded on login.
+BCRYPT_ROUNDS = env.num('BCRYPT_ROUNDS', default=12, required=False)
+# Maximum number of concurrent password hashes per process.
+BCRYPT_THREADS = env.num('BCRYPT_THREADS', default=4, required=False)
 
 #BABEL_DOMAIN = 'messages'
 #BABEL_TRANSLATION_DIRECTORIES = 'translations'
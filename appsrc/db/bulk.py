@@ -0,0 +1,65 @@
+"""
+Set-based synchronisation of a table column with a list of values.
+
+    deleted, inserted = sync_values(CommonWord.word, words)
+
+The values are staged in a temporary table, with COPY when the driver
+supports it (psycopg2), with a multi-row INSERT otherwise. The table is then
+brought in line with two statements, whatever the number of values: one
+DELETE of the rows that aren't staged, one INSERT of the staged values that
+aren't in the table.
+"""
+import io
+
+from .models import db
+
+def _copy_line(value):
+    # COPY's text format
+    for char, escaped in (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r')):
+        value = value.replace(char, escaped)
+    return value + '\n'
+
+def stage_values(connection, staging, values):
+    """
+    Load `values` in the `value` column of the `staging` table.
+    """
+    cursor = connection.connection.cursor()
+    try:
+        copy = cursor.copy_expert
+    except AttributeError:
+        copy = None
+    try:
+        if copy is not None:
+            data = io.StringIO(''.join(_copy_line(v) for v in values))
+            copy(f'COPY {staging} (value) FROM STDIN', data)
+            return
+    finally:
+        cursor.close()
+    if values:
+        connection.execute(
+            db.text(f'insert into {staging} (value) values (:value)'),
+            [{'value': v} for v in values])
+
+def sync_values(column, values):
+    """
+    Make `column` (e.g. `CommonWord.word`) hold exactly `values`, one row per
+    value, in the current transaction. Return the (deleted, inserted) counts.
+    """
+    table, name = column.table.name, column.name
+    # qualified, so that a permanent table of the same name is never touched
+    staging = f'pg_temp.{table}_staging'
+    values = sorted(set(values))
+    connection = db.session.connection()
+    connection.execute(db.text(f'drop table if exists {staging}'))
+    connection.execute(db.text(
+        f'create temporary table {staging} (value text primary key) '
+        f'on commit drop'))
+    stage_values(connection, staging, values)
+    deleted = connection.execute(db.text(
+        f'delete from {table} t where not exists ('
+        f'select 1 from {staging} s where s.value=t.{name})'))
+    inserted = connection.execute(db.text(
+        f'insert into {table} ({name}) select s.value from {staging} s '
+        f'where not exists (select 1 from {table} t where t.{name}=s.value)'))
+    connection.execute(db.text(f'drop table {staging}'))
+    return deleted.rowcount, inserted.rowcount
@@ -1,9 +1,12 @@
 import simplejson as json
 import stripe
 
-from .. import db
+from .. import db, bulk
 from ..models.billing import Plan
 from ..models.security import CommonWord, ReservedWord
+from ..models.reserved_words import reserved_words
+from ..models.products import (
+    LAST_PRIORITY, SearchLanguage, product_search_procedure, product_search_trigger)
 
 def run(app):
     with app.app_context():
@@ -22,6 +25,48 @@ def create_db(app):
     if app.config.FORCE_DROP_DB_SCHEMA:
         db.drop_all()
     db.create_all()
+    upgrade_schema(app)
+    setup_search_index(app)
+
+def upgrade_schema(app):
+    """
+    bring a database created by an earlier `create_all` up to date with the
+    models: tables are only created by `create_all`, columns added to
+    existing tables are added here. Safe to run any number of times.
+    """
+    connection = db.session.connection()
+    # signins created before `creation_date` existed count from their passcode
+    connection.execute(db.text(
+        'alter table signins add column if not exists creation_date timestamp'))
+    connection.execute(db.text(
+        "update signins set creation_date=coalesce("
+        "passcode_timestamp, now() at time zone 'utc') "
+        "where creation_date is null"))
+    connection.execute(db.text(
+        'alter table products add column if not exists '
+        'render_version integer not null default 0'))
+    create_listing_index(app)
+
+def create_listing_index(app):
+    """
+    create the index product listings seek on (see `Product.__table_args__`)
+    without locking products against writes. Commits the session first: the
+    build waits for every open transaction, this one included.
+    """
+    db.session.commit()
+    engine = db.session.get_bind()
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        # an interrupted build leaves an invalid index behind, build it again
+        invalid = connection.execute(db.text(
+            "select 1 from pg_index where not indisvalid "
+            "and indexrelid=to_regclass('products_listing_idx')")).first()
+        if invalid:
+            connection.execute(db.text(
+                'drop index concurrently products_listing_idx'))
+        connection.execute(db.text(
+            'create index concurrently if not exists products_listing_idx '
+            'on products (domain_id, (-coalesce(priority, {last_priority})), '
+            'updated_ts, product_id)'.format(last_priority=int(LAST_PRIORITY))))
 
 def sync_stripe_plans(app):
     db_plans = {p.data['id']:p for p in Plan.query.all()}
@@ -45,37 +90,47 @@ def sync_common_words(app):
     """
     populate common_words db table to check against obvious passwords.
     """
-    db_words =  {w.word:w for w in CommonWord.query.all()}
-    cw_file = app.config.COMMON_WORDS_FILE
-    wordset = set([])
-    with open(cw_file) as f:
+    with open(app.config.COMMON_WORDS_FILE) as f:
         wordset = set(json.loads(f.read()))
-
-    # delete from db
-    for w in set(db_words).difference(wordset):
-        db.session.delete(db_words[w])
-
-    # insert into db
-    for w in wordset.difference(db_words):
-        db.session.add(CommonWord(word=w))
-    db.session.flush()
+    bulk.sync_values(CommonWord.word, wordset)
 
 def sync_reserved_words(app):
     """
     populate reserved_words db table to avoid potentially problematic
     catalog registration.
     """
-    db_words =  {w.word:w for w in ReservedWord.query.all()}
-    rw_file = app.config.RESERVED_WORDS_FILE
-    wordset = set([])
-    with open(rw_file) as f:
-        wordset = set(json.loads(f.read()))
+    # the list the domain name checks are compiled from
+    bulk.sync_values(ReservedWord.word, reserved_words)
+
+def sync_search_languages(app):
+    """
+    populate search_languages db table with the text search configuration of
+    each available language, used by the `product_search` trigger.
+    """
+    db_langs = {l.lang:l for l in SearchLanguage.query.all()}
+    locales = app.config.LOCALES or {}
+    languages = {lang: locales.get(lang, {}).get('language', 'simple')
+                 for lang in app.config.AVAILABLE_LANGS}
 
     # delete from db
-    for w in set(db_words).difference(wordset):
-        db.session.delete(db_words[w])
+    for lang in set(db_langs).difference(languages):
+        db.session.delete(db_langs[lang])
 
-    # insert into db
-    for w in wordset.difference(db_words):
-        db.session.add(ReservedWord(word=w))
+    # insert into or update db
+    for lang, language in languages.items():
+        if lang in db_langs:
+            db_langs[lang].language = language
+        else:
+            db.session.add(SearchLanguage(lang=lang, language=language))
     db.session.flush()
+
+def setup_search_index(app):
+    """
+    install, or replace, the procedure and trigger maintaining
+    `product_search`, along with the languages it indexes. Safe to run on an
+    existing database, any number of times.
+    """
+    sync_search_languages(app)
+    connection = db.session.connection()
+    connection.execute(product_search_procedure)
+    connection.execute(product_search_trigger)
@@ -51,6 +51,7 @@ from . import (
     images,
     accounts,
     inquiries,
+    outbox,
     #quotations,
     meta,
     security,
@@ -3,7 +3,7 @@ from uuid import uuid4
 import bcrypt
 from sqlalchemy.ext.hybrid import hybrid_property
 from datetime import datetime as dtm
-from ...utils.password import match_passwords, encrypt_password
+from ...utils.password import match_passwords, encrypt_password, needs_rehash
 
 """
 - Each user has a single account.
@@ -40,9 +40,13 @@ class Account(db.Model):
     def authenticate(self, password):
         # password must be an unicode object
         try:
-            return match_passwords(self.password, password)
-        except AttributeError:
+            authenticated = match_passwords(self.password, password)
+        except (AttributeError, ValueError):
             return False
+        if authenticated and needs_rehash(self.password):
+            # upgrade to the current cost factor while we have the password
+            self.password = password
+        return authenticated
 
     def authorize(self, domain, action, **kw):
         if action is True: # basic authz
@@ -135,6 +139,7 @@ class Signin(db.Model):
     passcode_timestamp = db.Column(db.DateTime)
     sent = db.Column(db.Boolean, default=False)
     fail_count = db.Column(db.Integer)
+    creation_date = db.Column(db.DateTime, default=dtm.utcnow)
 
     #def authenticate(self, passcode):
     #    if not self.passcode==passcode:
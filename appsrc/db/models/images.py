@@ -1,9 +1,12 @@
-from PIL import Image as pilimage
+from PIL import Image as pilimage, ImageOps
 from uuid import uuid4
+from collections import namedtuple
 import io
-import contextlib
 import os
 import hashlib
+import itertools
+import shutil
+import tempfile
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy.sql.expression import case, ClauseElement
 from sqlalchemy.ext.compiler import compiles
@@ -73,7 +76,12 @@ class BaseImage(db.DomainMixin, db.Model):
                 "AxB": "0x5, "CxD": "300x305",
                 "AxB:CxD": "0x5:300x305",
             },
-        ]
+        ],
+        "thumbor": {
+            "version": <key version>,
+            "urls": {"1:1": {"thumb": <signed path>, ...}, ...},
+        },
+        "variants": {"1:1": {"thumb": <pre-rendered path>, ...}, ...},
     } """
 
     __table_args__ = (
@@ -125,39 +133,173 @@ class ProductImage(db.DomainMixin, db.Model):
     image = db.relationship('BaseImage', backref="products", viewonly=True)
     product = db.relationship('Product', backref="images")
 
+# EXIF orientation tag, and the orientations of images stored on their side
+ORIENTATION = 0x0112
+SIDEWAYS = {5, 6, 7, 8}
+# color modes that derivatives can be made from
+SUPPORTED_MODES = {'1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'CMYK', 'YCbCr'}
+# bytes read to probe an image header, doubled until it's found
+PROBE_SIZE = 64 * 1024
+MAX_PROBE_SIZE = 1024 * 1024
+
+class ImageFormatError(ValueError):
+    """
+    The file isn't an image that can be stored.
+    """
+
+# errors of the file itself, as opposed to the system's: retrying won't help
+FORMAT_ERRORS = (ImageFormatError, TypeError, pilimage.UnidentifiedImageError,
+                 pilimage.DecompressionBombError)
+
+class ImageProbe(namedtuple('ImageProbe', 'format width height orientation mode')):
+    """
+    What an image header tells, before any pixel is decoded.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_image(cls, image):
+        try:
+            orientation = image.getexif().get(ORIENTATION, 1)
+        except Exception:
+            orientation = 1
+        return cls(image.format, image.width, image.height, orientation, image.mode)
+
+    @property
+    def size(self):
+        """
+        Size of the image as displayed, i.e. once oriented.
+        """
+        if self.orientation in SIDEWAYS:
+            return self.height, self.width
+        return self.width, self.height
+
+def probe_image(stream):
+    """
+    Read the header of the image in `stream`, return (ImageProbe, the bytes
+    read). Only as many bytes as the header needs are read, from PROBE_SIZE
+    up to MAX_PROBE_SIZE (e.g. large EXIF blocks before a JPEG frame).
+    """
+    head = stream.read(PROBE_SIZE)
+    while True:
+        try:
+            # PIL reads the header only, the pixels are decoded on load
+            return ImageProbe.from_image(pilimage.open(io.BytesIO(head))), head
+        except Exception:
+            more = stream.read(len(head)) if len(head) < MAX_PROBE_SIZE else b''
+            if not more:
+                raise ImageFormatError('unrecognized image format')
+            head += more
+
 class ImageUtil:
     """ Unify file and PIL.Image.Image interfaces and provide additional
     validating functions.
+
+    The header is probed first (`probe_image`), so that unsupported files are
+    rejected before anything is stored or decoded. Uploads are then streamed
+    once, in chunks, through the hasher into a temporary
+    file of the context's directory in the DUMP tree, and `save()` renames
+    that file to its content-addressed path. An upload is never held in
+    memory; call `discard()` (or use the instance as a context manager) to
+    remove the temporary file of an image that isn't saved.
     """
+    CHUNK_SIZE = 64 * 1024
 
     def __init__(self, image_file, config, context=None):
         self.config = config
         if context is None:
             context = ''
         self.context = context
+        self.staged = False
 
-        if isinstance(image_file, pilimage.Image):
-            self._from_image(image_file)
-        else:
-            self._from_file(image_file)
-
-        self.validate_format()
-        self.validate_aspect_ratio()
+        try:
+            if isinstance(image_file, pilimage.Image):
+                self._from_image(image_file)
+            else:
+                self._from_file(image_file)
+        except:
+            self.discard()
+            raise
+
+    @classmethod
+    def load_from_file(cls, image_file, config, context=None):
+        return cls(image_file, config, context=context)
+
+    @classmethod
+    def load_from_filepath(cls, filepath, config):
+        """
+        Load an image stored in the DUMP tree, in the context of its path.
+        """
+        return cls(filepath, config, context=cls._infer_context(filepath, config))
+
+    @staticmethod
+    def _infer_context(filepath, config):
+        # DUMP/<context>/<ab>/<cd>/<filename>
+        relpath = os.path.relpath(os.path.dirname(filepath), config['DUMP'])
+        return os.path.dirname(os.path.dirname(relpath))
+
+    def _stage(self):
+        # temporary file next to its final location, so that it can be renamed
+        staging = os.path.join(self.config['DUMP'], self.context)
+        os.makedirs(staging, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=staging, prefix='.ingest-')
+        self.staged = True
+        # mkstemp's default is private to this user, images are served
+        os.chmod(self.path, 0o644)
+        return os.fdopen(fd, 'wb')
 
     def _from_image(self, image):
-        self.image = i = image
-        self.image_file = image_file = io.BytesIO()
-        i.save(image_file, format=i.format)
+        self.image_file = None
+        self.probe = ImageProbe.from_image(image)
+        self.validate()
+        with self._stage() as f:
+            image.save(f, format=image.format)
+        self._hash_file()
+        self.image = image
 
     def _from_file(self, image_file):
-        if isinstance(image_file, str):
-            image_file = open(image_file, 'rb')
         self.image_file = image_file
+        if isinstance(image_file, str):
+            self.path = image_file
+            with open(self.path, 'rb') as f:
+                self.probe, head = probe_image(f)
+            self.validate()
+        else:
+            stream = getattr(image_file, 'stream', image_file)
+            self.probe, head = probe_image(stream)
+            self.validate()
+            self._ingest(stream, head)
         try:
-            self.image = pilimage.open(image_file)
-        except IOError as e:
+            # reads the header only, which is all that's kept: the file is
+            # closed right away, `thumbnail` opens it again to decode it
+            with pilimage.open(self.path) as image:
+                self.image = image
+        except pilimage.UnidentifiedImageError as e:
             # TODO: make this part of validation
-            raise Exception('unrecognized image format')
+            raise ImageFormatError('unrecognized image format')
+
+    def _ingest(self, stream, head=b''):
+        max_filesize = self.config.get('MAX_FILESIZE')
+        signature, size = hashlib.sha1(), 0
+        chunks = iter(lambda: stream.read(self.CHUNK_SIZE), b'')
+        with self._stage() as f:
+            for chunk in itertools.chain([head], chunks):
+                size += len(chunk)
+                if max_filesize and size > max_filesize:
+                    raise ImageFormatError('image file too large')
+                signature.update(chunk)
+                f.write(chunk)
+        self._signature = signature.hexdigest()
+        self._filesize = size
+
+    def _hash_file(self):
+        signature, size = hashlib.sha1(), 0
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                size += len(chunk)
+                signature.update(chunk)
+        self._signature = signature.hexdigest()
+        self._filesize = size
 
     @property
     def original_name(self):
@@ -178,9 +320,7 @@ class ImageUtil:
     @property
     def filesize(self):
         if not getattr(self, '_filesize', None):
-            with self.initfile(self.image_file) as f:
-                f.seek(0, os.SEEK_END)
-                self._filesize = f.tell()
+            self._filesize = os.path.getsize(self.path)
         return self._filesize
 
     @property
@@ -190,15 +330,14 @@ class ImageUtil:
                 self._extension = self.config[
                     'SUPPORTED_FORMATS'][self.image.format]
             except KeyError:
-                raise Exception('unrecognized image format')
+                raise ImageFormatError('unrecognized image format')
         return self._extension
 
     @property
     def blob_signature(self):
         # an identifier based on the file's contents
         if not getattr(self, '_signature', None):
-            content = self.read()
-            self._signature = hashlib.sha1(content).hexdigest()
+            self._hash_file()
         return self._signature
 
     @property
@@ -240,20 +379,32 @@ class ImageUtil:
             )
         return self._data
 
+    def validate(self):
+        """
+        Reject the image from its header only.
+        """
+        self.validate_format()
+        self.validate_mode()
+        self.validate_aspect_ratio()
+
     def validate_format(self):
-        if not self.image.format in self.config['SUPPORTED_FORMATS']:
+        if not self.probe.format in self.config['SUPPORTED_FORMATS']:
             raise TypeError('unsupported image format')
 
+    def validate_mode(self):
+        if not self.probe.mode in SUPPORTED_MODES:
+            raise TypeError('unsupported color mode')
+
     def validate_aspect_ratio(self):
-        width, height = self.image.size
+        width, height = self.probe.size
         aspect_ratio  = self.config['ASPECT_RATIO']
         if not (aspect_ratio[0] <= width/height <= aspect_ratio[1]):
-            raise Exception('unsupported aspect ratio')
+            raise ImageFormatError('unsupported aspect ratio')
 
     # TODO: should be applied at web server or middleware level
     def validate_filesize(self):
         if not self.filesize <= self.config['MAX_FILESIZE']:
-            raise('image file too large')
+            raise ImageFormatError('image file too large')
 
     def thumbnail(self, max_length=None, config=None, context=None):
         if max_length is None:
@@ -263,29 +414,49 @@ class ImageUtil:
         if context is None:
             context = self.context
 
-        source = self.image
-        web_size = min(max_length, max(source.width, source.height))
-        web_image = source.copy()
-        # we must set the format ourselves, PIL doesn't do it for image
-        # it creates.
-        web_image.format = source.format
-        web_image.thumbnail((web_size, web_size))
+        web_size = min(max_length, max(self.probe.width, self.probe.height))
+        # pixels are decoded here only, from a fresh, not yet loaded, image
+        with pilimage.open(self.path) as source:
+            # JPEG: decode at the smallest of 1/2, 1/4, 1/8 of the resolution
+            # that still covers web_size. No-op for other formats.
+            source.draft(None, (web_size, web_size))
+            # upright, since EXIF isn't kept on the copy
+            web_image = ImageOps.exif_transpose(source)
+            # we must set the format ourselves, PIL doesn't do it for image
+            # it creates.
+            web_image.format = source.format
+        # resamples from reduce()'d pixels when far larger than web_size
+        web_image.thumbnail((web_size, web_size), reducing_gap=2.0)
         return ImageUtil(web_image, config=config, context=context)
 
-    def read(self):
-        f = self.image_file
-        with self.initfile(self.image_file) as f:
-            rv = f.read()
-        return rv
-
     def save(self):
+        """
+        Move the staged file to its content-addressed path, or copy the
+        loaded file there. Either way the file appears there whole.
+        """
         os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
-        with open(self.filepath, 'wb') as f:
-            f.write(self.read())
-
-    @contextlib.contextmanager
-    def initfile(self, f):
-        pos = f.tell()
-        f.seek(0)
-        yield f
-        f.seek(pos)
+        if not self.staged:
+            if os.path.abspath(self.path)==os.path.abspath(self.filepath):
+                return
+            with open(self.path, 'rb') as source, self._stage() as f:
+                shutil.copyfileobj(source, f, self.CHUNK_SIZE)
+        os.replace(self.path, self.filepath)
+        self.path = self.filepath
+        self.staged = False
+
+    def discard(self):
+        """
+        Remove the staged file of an image that isn't saved.
+        """
+        if self.staged:
+            self.staged = False
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.discard()
@@ -0,0 +1,30 @@
+from uuid import uuid4
+from datetime import datetime
+
+from . import db
+
+class OutboxEmail(db.Model):
+    """
+    An email to send, written in the same transaction as the record it is
+    about (`kind` and `ref_id`: a signin, an inquiry), and claimed by the
+    workers with FOR UPDATE SKIP LOCKED, see `service.outbox`.
+    """
+    __tablename__ = 'email_outbox'
+
+    outbox_id = db.Column(db.UUID, primary_key=True, default=uuid4)
+    kind = db.Column(db.Unicode, nullable=False)
+    ref_id = db.Column(db.UUID, nullable=False)
+    domain_id = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.Unicode, nullable=False, default='pending') # sent, failed, dropped
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Unicode, nullable=True)
+    creation_date = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_date = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # workers only ever scan pending rows, whatever the size of the history
+        db.Index('email_outbox_pending_idx', kind, next_attempt,
+                 postgresql_where=db.text("status='pending'")),
+        db.Index('email_outbox_ref_idx', ref_id),
+    )
@@ -42,6 +42,9 @@ class ProductSchema(db.Model, db.DomainMixin):
     product_schema_id = db.Column(db.UUID, primary_key=True, default=uuid4)
     data = db.Column(db.JSONB, default=dict)
 
+# priority that products without one are listed with, i.e. last
+LAST_PRIORITY = 2147483647
+
 class Product(db.Model, db.DomainMixin):
     __tablename__ = 'products'
 
@@ -51,6 +54,9 @@ class Product(db.Model, db.DomainMixin):
     #    logs: updated_by
     created_ts = db.Column(db.DateTime, default=dtm.utcnow, nullable=False)
     updated_ts = db.Column(db.DateTime, default=dtm.utcnow, nullable=False)
+    # bumped by changes to the product's relations (groups, images), which
+    # change its rendered documents but not `updated_ts`.
+    render_version = db.Column(db.Integer, default=0, nullable=False)
     priority = db.Column(db.Integer, default=10)
     fields = db.Column(db.JSONB, default=dict)
     """
@@ -68,6 +74,13 @@ class Product(db.Model, db.DomainMixin):
                                 ['product_families.product_family_id',
                                  'product_families.domain_id'],
                                'products_product_family_id_fkey'),
+        # Keyset pagination of product listings seeks on
+        # (-coalesce(priority, LAST_PRIORITY), updated_ts, product_id), see
+        # `service.products`. Existing databases get it from
+        # `db.init.create_listing_index`.
+        db.Index('products_listing_idx', 'domain_id',
+                 -db.func.coalesce(priority, LAST_PRIORITY), updated_ts,
+                 product_id),
     )
 
 class ProductFamily(db.Model, db.DomainMixin):
@@ -120,3 +133,57 @@ class ProductSearch(db.Model, db.DomainMixin):
                                 ['products.product_id', 'products.domain_id']),
         db.Index(None, search, postgresql_using='gin')
     )
+
+class SearchLanguage(db.Model):
+    """
+    Text search configuration used for each indexed language. Mirrors the
+    `LOCALES` setting so that the database can maintain `product_search` on
+    its own (see `db.init.sync_search_languages`).
+    """
+    __tablename__ = 'search_languages'
+
+    lang = db.Column(db.Unicode, primary_key=True)
+    language = db.Column(db.Unicode, nullable=False, default='simple')
+
+# Derive the per-language tsvectors of a product from its `fields` whenever
+# they change. A field contributes to the index if it's flagged `searchable`;
+# `localized` fields contribute their value in the indexed language. Products
+# are indexed in the languages of their domain, or in every available one if
+# it has none, like `service.products.search_index_languages` does.
+product_search_procedure = TriggerProcedure('products_update_search', """
+    IF TG_OP = 'UPDATE' AND NEW.fields IS NOT DISTINCT FROM OLD.fields THEN
+        RETURN NULL;
+    END IF;
+    WITH domain_langs AS (
+        SELECT jsonb_array_elements_text(d.meta->'languages') lang
+        FROM domains d
+        WHERE d.domain_id = NEW.domain_id
+            AND jsonb_typeof(d.meta->'languages') = 'array')
+    INSERT INTO product_search (domain_id, product_id, lang, search)
+    SELECT NEW.domain_id, NEW.product_id, sl.lang, to_tsvector(
+        sl.language::regconfig, coalesce((
+            SELECT string_agg(
+                CASE WHEN f.field->>'localized' = 'true'
+                    THEN coalesce(f.field->'value'->>sl.lang, '')
+                    ELSE coalesce(f.field->>'value', '')
+                END, ' ' ORDER BY f.position)
+            FROM jsonb_array_elements(
+                CASE WHEN jsonb_typeof(NEW.fields->'fields') = 'array'
+                    THEN NEW.fields->'fields'
+                    ELSE '[]'::jsonb
+                END) WITH ORDINALITY AS f(field, position)
+            WHERE f.field->>'searchable' = 'true'), ''))
+    FROM search_languages sl
+    WHERE sl.lang IN (SELECT lang FROM domain_langs)
+        OR NOT EXISTS (SELECT 1 FROM domain_langs)
+    ON CONFLICT (domain_id, product_id, lang)
+    DO UPDATE SET search = EXCLUDED.search;
+    RETURN NULL;
+""")
+product_search_trigger = Trigger(
+    'products_update_search_trigger', Product, product_search_procedure,
+    events=['INSERT', 'UPDATE'], when='AFTER')
+# The procedure writes to `product_search`, so it's installed once that table
+# exists. Existing databases get both from `db.init.setup_search_index`.
+event.listen(ProductSearch.__table__, 'after_create', product_search_procedure)
+event.listen(ProductSearch.__table__, 'after_create', product_search_trigger)
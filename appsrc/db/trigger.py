@@ -12,7 +12,7 @@ class TriggerProcedure(DDLElement):
         self.trigger_type = trigger_type
 
 @compiles(TriggerProcedure, 'postgresql')
-def render_trigger_procedure(element, compiler):
+def render_trigger_procedure(element, compiler, **kw):
     template = """
     CREATE OR REPLACE FUNCTION {name}() RETURNS {trigger_type} AS 
     $script$
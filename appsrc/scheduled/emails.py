@@ -1,86 +1,261 @@
 import os
+import logging
+import smtplib
+import threading
 from datetime import datetime
 
+import redis
 from jinja2 import Environment, FileSystemLoader, select_autoescape
+from sqlalchemy.orm import selectinload
 import dramatiq
+from dramatiq.rate_limits import ConcurrentRateLimiter, WindowRateLimiter
+from dramatiq.rate_limits.backends import RedisBackend
 
 from appsrc import make_app
 from appsrc.config import config
+from appsrc.config.dramatiq import PASSCODES, INQUIRIES, MAINTENANCE, PRIORITIES
 from appsrc.db import db
-from appsrc.db.models.accounts import Signin
+from appsrc.db.models.accounts import Account, Signin
+from appsrc.db.models.domains import DomainAccount
 from appsrc.db.models.inquiries import Inquiry
+from appsrc.db.models.products import Product
+from appsrc.scheduled.metrics import Instrumentation
+from appsrc.service import outbox
+from appsrc.utils.mailer import SMTPPool
+from appsrc.utils.metrics import MetricsStore
 from appsrc.utils.uuid import clean_uuid
 
 dramatiq.flask_app = make_app(config)
+logger = logging.getLogger(__name__)
+
+# Shared by the workers of every replica. Bulk emails are held to
+# MAIL_RATE_LIMIT a minute, which leaves room under the provider's cap for
+# passcodes, and to INQUIRY_CONCURRENCY runs at once. Careful with units:
+# dramatiq takes windows in seconds, but ttls in milliseconds.
+rate_backend = RedisBackend(host=config.REDIS_HOST)
+bulk_mail_rate = WindowRateLimiter(
+    rate_backend, 'bulk-mail', limit=config.MAIL_RATE_LIMIT, window=60)
+inquiry_concurrency = ConcurrentRateLimiter(
+    rate_backend, 'send-inquiries', limit=config.INQUIRY_CONCURRENCY,
+    ttl=10 * 60_000)
+
+dramatiq.get_broker().add_middleware(Instrumentation(MetricsStore(redis.Redis(
+    host=config.REDIS_HOST, socket_timeout=0.5, socket_connect_timeout=0.5))))
 
 dn = os.path.dirname
 template_path = os.path.join(dn(dn(__file__)), 'scheduled/templates')
 env = Environment(
     loader=FileSystemLoader(template_path),
-    autoescape=select_autoescape('html'),)
+    autoescape=select_autoescape('html'),
+    auto_reload=False,)
+# compiled once per worker process
+inquiry_template = env.get_template('inquiry.html')
 
-def send(subject, to, content=None, html_content=None):
-    #TODO: make a single reusable instance of mailer
+_pool = None
+_pool_lock = threading.Lock()
+
+def mail_pool():
+    """
+    The SMTP connections of this worker process, shared by its threads.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = dramatiq.flask_app.config
+                _pool = SMTPPool(
+                    config['MAILER'], config['MAIL_LOGIN'], config['MAIL_PASSWORD'],
+                    size=config.get('MAIL_POOL_SIZE', 4),
+                    keepalive=config.get('MAIL_KEEPALIVE', 30),)
+    return _pool
+
+def message(subject, to, content=None, html_content=None):
     config = dramatiq.flask_app.config
     Mailer = config['MAILER']
-    login = config['MAIL_LOGIN']
-    password = config['MAIL_PASSWORD']
-    m = Mailer(login, password, subject=subject, to=to,
-               content=content, html_content=html_content,)
-    return m.send()
+    return Mailer(config['MAIL_LOGIN'], config['MAIL_PASSWORD'], subject=subject,
+                  to=to, content=content, html_content=html_content,)
+
+def send(subject, to, content=None, html_content=None):
+    mail_pool().send(message(subject, to, content=content, html_content=html_content))
+
+class _NoSlot(Exception):
+    pass
+
+class NotYet(Exception):
+    """
+    Raised by a `render` function when an email can't be sent for now, e.g.
+    no one to send it to: it's retried with the outbox's backoff.
+    """
+
+def _take_slot(limiter):
+    if limiter is None:
+        return True
+    with limiter.acquire(raise_on_failure=False) as acquired:
+        return acquired
+
+def deliver(entries, render, limiter=None):
+    """
+    Send the claimed outbox `entries` over one pooled SMTP session, record
+    the outcome of each and commit, which releases the claim. `render(entry)`
+    returns the message of an entry, None if its record is gone, or raises
+    NotYet; what it changes is rolled back if the message can't be sent.
+
+    With a `limiter` (a dramatiq rate limiter), each message sent takes a
+    slot, and the entries left when it runs out stay pending. Return False
+    then.
+    """
+    try:
+        with mail_pool().session() as session:
+            for entry in entries:
+                try:
+                    with db.session.begin_nested():
+                        msg = render(entry)
+                        if msg is not None:
+                            # dropped entries don't use up the rate limit
+                            if not _take_slot(limiter):
+                                raise _NoSlot()
+                            session.send(msg)
+                except _NoSlot:
+                    db.session.commit()
+                    return False
+                except (NotYet, smtplib.SMTPException, OSError) as e:
+                    logger.warning('Could not send %s email %s: %s',
+                                   entry.kind, entry.ref_id, e)
+                    outbox.mark_failed(entry, e)
+                    continue
+                if msg is None:
+                    logger.info('Dropped %s email %s: record gone',
+                                entry.kind, entry.ref_id)
+                    outbox.mark_dropped(entry)
+                else:
+                    outbox.mark_sent(entry)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+    return True
 
-@dramatiq.actor
+def passcode_renderer(entries):
+    """
+    Load the signins of the claimed `entries` at once, return the `render`
+    function of `deliver`.
+    """
+    config = dramatiq.flask_app.config
+    ids = [e.ref_id for e in entries]
+    signins = {s.signin_id: s for s in
+               Signin.query.filter(Signin.signin_id.in_(ids))} if ids else {}
+    def render(entry):
+        signin = signins.get(entry.ref_id)
+        if signin is None:
+            return None
+        signin.passcode_timestamp = datetime.utcnow()
+        signin.sent = True
+        lang = 'en'
+        url = config.PASSCODE_SIGNIN_URL.format(
+            passcode=signin.passcode, lang=lang,
+            signin_id=clean_uuid(signin.signin_id))
+        content = f"One-time access code: {url}"
+        return message(subject="One-time access code", content=content,
+                       to=signin.email)
+    return render
+
+@dramatiq.actor(queue_name=PASSCODES, priority=PRIORITIES[PASSCODES])
+def send_signin(signin_id):
+    """
+    Send the passcode of a new signin, enqueued by `service.auth.create_signin`
+    once the signin is committed.
+    """
+    app = dramatiq.flask_app
+    with app.app_context():
+        # nothing to claim if it's sent, or being sent by another worker
+        entries = outbox.claim('signin', ref_id=signin_id)
+        deliver(entries, passcode_renderer(entries))
+
+@dramatiq.actor(queue_name=MAINTENANCE, priority=PRIORITIES[MAINTENANCE])
 def send_passcode():
+    """
+    Sweeper: send the passcodes whose `send_signin` message was lost, e.g.
+    while the broker was unreachable, and retry failed ones.
+    """
     app = dramatiq.flask_app
-    config = app.config
     with app.app_context():
-        signins = Signin.query.filter_by(sent=False).all()
-        for s in signins:
-            s.passcode_timestamp = datetime.utcnow()
-            lang = 'en'
-            url_template = app.config.PASSCODE_SIGNIN_URL
-            url = url_template.format(
-                passcode=s.passcode, lang=lang, signin_id=clean_uuid(s.signin_id))
-            content = f"One-time access code: {url}"
-            to = s.email
-            try:
-                send(subject="One-time access code", content=content, to=to)
-                s.sent = True
-                db.session.commit()
-            except:
-                db.session.rollback()
-                raise
-
-@dramatiq.actor
+        while deliver_batch('signin', passcode_renderer):
+            pass
+
+def inquiry_renderer(entries):
+    """
+    Load the inquiries of the claimed `entries`, with their products,
+    accounts, domain admins and product fields, in a fixed number of
+    queries. Return the `render` function of `deliver`.
+    """
+    ids = [e.ref_id for e in entries]
+    inquiries = {i.inquiry_id: i for i in Inquiry.query
+                 .filter(Inquiry.inquiry_id.in_(ids))
+                 .options(selectinload(Inquiry.products),
+                          selectinload(Inquiry.account))} if ids else {}
+    domain_ids = {i.domain_id for i in inquiries.values()}
+    product_ids = {p.product_id for i in inquiries.values() for p in i.products}
+    admins = {}
+    if domain_ids:
+        rows = (db.session.query(DomainAccount.domain_id, Account.email)
+                .join(Account, Account.account_id==DomainAccount.account_id)
+                .filter(DomainAccount.domain_id.in_(domain_ids),
+                        DomainAccount.role=='admin'))
+        for domain_id, email in rows:
+            admins.setdefault(domain_id, email)
+    fields = {}
+    if product_ids:
+        rows = (db.session.query(Product.product_id, Product.fields)
+                .filter(Product.product_id.in_(product_ids)))
+        fields = {product_id: field_map(f) for product_id, f in rows}
+    def render(entry):
+        i = inquiries.get(entry.ref_id)
+        if i is None:
+            return None
+        # TODO: ensure that there's always at least one admin
+        if i.domain_id not in admins:
+            raise NotYet('no admin')
+        html_content = inquiry_template.render(**prep_inquiry_data(i, fields))
+        i.data = dict(i.data, email={
+            'sent': True,
+            'timestamp': datetime.utcnow().timestamp()
+        })
+        return message(subject="New inquiry from your Productlist",
+                       html_content=html_content, to=admins[i.domain_id])
+    return render
+
+@dramatiq.actor(queue_name=INQUIRIES, priority=PRIORITIES[INQUIRIES])
 def send_inquiries():
     app = dramatiq.flask_app
     with app.app_context():
-        unsent = {'email': {'sent':False}}
-        inquiries = Inquiry.query.filter(Inquiry.data.comparator.contains(unsent))
-        for i in inquiries:
-            admin = i.domain.admins[0]
-            inquiry = prep_inquiry_data(i)
-            # TODO: ensure that there's always at least one admin
-            html_content = load_inquiry_template(inquiry)
-            to = admin.email
-            try:
-                send(subject="New inquiry from your Productlist",
-                    html_content=html_content, to=to)
-                i.data['email'] = {
-                    'sent': True,
-                    'timestamp': datetime.utcnow().timestamp()
-                }
-                db.session.commit()
-            except:
-                db.session.rollback()
-                raise
-
-def prep_inquiry_data(inquiry):
+        # the batches left to other runs are picked up by the next tick
+        with inquiry_concurrency.acquire(raise_on_failure=False) as acquired:
+            while acquired and deliver_batch(
+                    'inquiry', inquiry_renderer, limiter=bulk_mail_rate):
+                pass
+
+def deliver_batch(kind, renderer, limiter=None):
+    """
+    Claim and send one batch of due emails of `kind`, rendered by
+    `renderer(entries)`. Return the batch size, 0 if `limiter` ran out.
+    """
+    entries = outbox.claim(kind)
+    if entries and not deliver(entries, renderer(entries), limiter=limiter):
+        return 0
+    return len(entries)
+
+def prep_inquiry_data(inquiry, fields):
+    """
+    Template context of an inquiry, `fields` being the field maps of its
+    products by product_id.
+    """
+    lang = inquiry.data['lang']
     products = []
-    for p in  inquiry.products:
+    for p in inquiry.products:
+        product_fields = fields.get(p.product_id, {})
         products.append({
-            'name': get_field(p.product, 'name', inquiry.data['lang']),
-            'number': get_field(p.product, 'number', inquiry.data['lang']),
+            'name': field_value(product_fields, 'name', lang),
+            'number': field_value(product_fields, 'number', lang),
             'url': 'https://someplaceholder.com/url',
             'admin_url': 'https://someplaceholder.com/admin_url',
             'quantity': p.quantity,
@@ -90,17 +265,19 @@ def prep_inquiry_data(inquiry):
     comments = inquiry.data.get('messages', [{}])[0].get('comments', '') or ''
     return dict(account=inquiry.account, products=products, comments=comments)
 
-def load_inquiry_template(inquiry):
-    t = env.get_template('inquiry.html')
-    return t.render(**inquiry)
-
-def get_field(record, name, lang):
-    for f in record.fields.get('fields', []):
-        if f.get('name')==name:
-            if f.get('localized'):
-                return f.get('value', {}).get(lang)
-            else:
-                return f.get('value')
+def field_map(fields):
+    """
+    Fields of a product record by name.
+    """
+    return {f.get('name'): f for f in (fields or {}).get('fields', [])}
+
+def field_value(field_map, name, lang):
+    f = field_map.get(name)
+    if f is None:
+        return None
+    if f.get('localized'):
+        return f.get('value', {}).get(lang)
+    return f.get('value')
 
 #@dramatiq.actor
 #def send_activation_email():
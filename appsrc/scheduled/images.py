@@ -0,0 +1,71 @@
+"""
+Derivatives of uploaded images, generated off the request that uploads them
+(see `service.images.queue_derivatives`).
+"""
+import logging
+
+from dramatiq.middleware import CurrentMessage
+
+from appsrc.config.dramatiq import IMAGES, MAINTENANCE, PRIORITIES
+from appsrc.db import db
+from appsrc.scheduled.emails import dramatiq
+from appsrc.service import errors as err, images as img_srv
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 3
+
+dramatiq.get_broker().add_middleware(CurrentMessage())
+
+def _last_attempt():
+    message = CurrentMessage.get_current_message()
+    return message is None or message.options.get('retries', 0) >= MAX_RETRIES
+
+def _fail(domain_id, source_image_id, error):
+    source_record = img_srv.get_source_image_record(source_image_id, domain_id)
+    img_srv.set_derivatives_status(source_record, img_srv.FAILED, error)
+    db.session.commit()
+
+@dramatiq.actor(queue_name=IMAGES, priority=PRIORITIES[IMAGES],
+                max_retries=MAX_RETRIES)
+def generate_derivatives(domain_id, source_image_id):
+    app = dramatiq.flask_app
+    with app.app_context():
+        try:
+            source_record = img_srv.get_source_image_record(source_image_id, domain_id)
+        except err.NotFound:
+            # deleted since
+            return
+        try:
+            main_record = img_srv.generate_main_copy(source_record)
+            img_srv.render_variants(main_record)
+            img_srv.set_derivatives_status(source_record, img_srv.READY)
+            db.session.commit()
+        except err.ServiceError as e:
+            # generate_main_copy rolled back, the record is reloaded
+            logger.warning('Could not generate derivatives of %s: %s',
+                           source_image_id, e.message)
+            _fail(domain_id, source_image_id, e.message)
+        except Exception:
+            db.session.rollback()
+            # retried, unless it was the last attempt: don't leave it pending
+            if _last_attempt():
+                logger.exception('Giving up on the derivatives of %s',
+                                 source_image_id)
+                _fail(domain_id, source_image_id, 'Could not generate derivatives')
+            raise
+
+@dramatiq.actor(queue_name=MAINTENANCE, priority=PRIORITIES[MAINTENANCE])
+def sweep_derivatives():
+    """
+    Sweeper: queue again the derivatives whose message was lost, fail those
+    that stay pending.
+    """
+    app = dramatiq.flask_app
+    with app.app_context():
+        try:
+            img_srv.sweep_derivatives()
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
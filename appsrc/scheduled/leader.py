@@ -0,0 +1,136 @@
+"""
+Leader lease over Redis, so that one scheduler replica out of many enqueues
+the periodic jobs.
+
+    lease = LeaderLease(redis_client, 'scheduler', ttl=10)
+    lease.refresh()          # every few seconds, from every replica
+    if lease.held(): ...
+
+Every replica calls `refresh()`: the leader extends its lease, the others
+(hot standbys) take it over once it expires, i.e. `ttl` seconds at most
+after the leader stops refreshing it.
+
+Each new lease gets a fencing token, from a counter that only goes up.
+`run_once(tick, fnc)` runs `fnc` only if this replica's token is still the
+current one and `tick` wasn't run yet, in a single atomic step on Redis: a
+leader that was paused past its lease (GC, network partition) can't run a
+tick its successor runs.
+"""
+import logging
+import os
+import socket
+import time
+from uuid import uuid4
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# KEYS: lease, counter. ARGV: holder, ttl (ms).
+# Returns the fencing token of the holder, or nil.
+_ACQUIRE = """
+local current = redis.call('get', KEYS[1])
+if not current then
+    local token = redis.call('incr', KEYS[2])
+    redis.call('set', KEYS[1], ARGV[1] .. ' ' .. token, 'px', ARGV[2])
+    return token
+end
+local sep = string.find(current, ' ', 1, true)
+if string.sub(current, 1, sep - 1) == ARGV[1] then
+    redis.call('pexpire', KEYS[1], ARGV[2])
+    return tonumber(string.sub(current, sep + 1))
+end
+return nil
+"""
+
+# KEYS: lease, tick. ARGV: holder and token, tick ttl (ms).
+_FENCE = """
+if redis.call('get', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if redis.call('set', KEYS[2], ARGV[1], 'nx', 'px', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+# KEYS: lease. ARGV: holder and token.
+_RELEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+class LeaderLease:
+
+    def __init__(self, client, name, ttl=10):
+        self.client = client
+        self.key = f'leader:{name}'
+        self.counter_key = f'leader:{name}:token'
+        self.ttl = ttl
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}'
+        self.token = None
+        # monotonic time until which the lease is surely held
+        self.expires = 0
+        self._acquire = client.register_script(_ACQUIRE)
+        self._fence = client.register_script(_FENCE)
+        self._release = client.register_script(_RELEASE)
+
+    @property
+    def value(self):
+        return f'{self.holder} {self.token}'
+
+    def refresh(self):
+        """
+        Acquire or extend the lease. Return True if this replica holds it.
+        """
+        started = time.monotonic()
+        try:
+            token = self._acquire(keys=[self.key, self.counter_key],
+                                  args=[self.holder, int(self.ttl * 1000)])
+        except redis.RedisError as e:
+            logger.warning('Could not refresh the %s lease: %s', self.key, e)
+            token = None
+        if token is None:
+            if self.token is not None:
+                logger.info('Lost the %s lease', self.key)
+            self.token, self.expires = None, 0
+            return False
+        if token!=self.token:
+            logger.info('Acquired the %s lease, token %s', self.key, token)
+        self.token = token
+        # measured from before the call, the lease can't have expired sooner
+        self.expires = started + self.ttl
+        return True
+
+    def held(self):
+        return self.token is not None and time.monotonic() < self.expires
+
+    def run_once(self, tick, fnc, tick_ttl=3600):
+        """
+        Run `fnc` if this replica is the leader, with the current fencing
+        token, and if no replica ran `tick` (e.g. 'send_inquiries:29123456')
+        in the past `tick_ttl` seconds. Return True if `fnc` ran.
+        """
+        if not self.held():
+            return False
+        try:
+            fenced = self._fence(keys=[self.key, f'{self.key}:tick:{tick}'],
+                                 args=[self.value, int(tick_ttl * 1000)])
+        except redis.RedisError as e:
+            logger.warning('Could not check the %s lease: %s', self.key, e)
+            return False
+        if not fenced:
+            return False
+        fnc()
+        return True
+
+    def release(self):
+        if self.token is None:
+            return
+        try:
+            self._release(keys=[self.key], args=[self.value])
+        except redis.RedisError as e:
+            logger.warning('Could not release the %s lease: %s', self.key, e)
+        self.token, self.expires = None, 0
@@ -0,0 +1,49 @@
+"""
+Dramatiq middleware recording, per actor, into `utils.metrics.MetricsStore`:
+
+    dramatiq_queue_lag_seconds      enqueue (or retry) to start of processing
+    dramatiq_execution_seconds      processing time
+    dramatiq_messages_total         processed messages, by outcome
+    dramatiq_retries_total          messages processed again after a failure
+
+`flask metrics` prints them, `flask queue-depth` shows the broker's backlog.
+"""
+import threading
+import time
+
+import dramatiq
+
+class Instrumentation(dramatiq.Middleware):
+
+    def __init__(self, store):
+        self.store = store
+        self.local = threading.local()
+
+    def _started(self):
+        if not hasattr(self.local, 'started'):
+            self.local.started = {}
+        return self.local.started
+
+    def before_process_message(self, broker, message):
+        now = time.time()
+        labels = dict(actor=message.actor_name, queue=message.queue_name)
+        # eta: when a retried or delayed message was due
+        due = message.options.get('eta', message.message_timestamp) / 1000
+        self.store.observe('dramatiq_queue_lag_seconds', max(now - due, 0), **labels)
+        if message.options.get('retries'):
+            self.store.inc('dramatiq_retries_total', **labels)
+        self._started()[message.message_id] = time.monotonic()
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        started = self._started().pop(message.message_id, None)
+        labels = dict(actor=message.actor_name, queue=message.queue_name)
+        if started is not None:
+            self.store.observe('dramatiq_execution_seconds',
+                               time.monotonic() - started, **labels)
+        outcome = 'ok' if exception is None else 'failed'
+        self.store.inc('dramatiq_messages_total', outcome=outcome, **labels)
+
+    def after_skip_message(self, broker, message):
+        self._started().pop(message.message_id, None)
+        self.store.inc('dramatiq_messages_total', outcome='skipped',
+                       actor=message.actor_name, queue=message.queue_name)
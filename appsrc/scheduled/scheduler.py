@@ -1,15 +1,48 @@
+import time
+
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+def job_name(job):
+    # dramatiq's `actor.send` is the same method for every actor
+    actor = getattr(job, '__self__', None)
+    return getattr(actor, 'actor_name', None) or getattr(job, '__qualname__', repr(job))
 
 class Cron:
-    def __init__(self):
+    """
+    Periodic jobs. With a `lease` (see `leader.LeaderLease`), any number of
+    replicas can run: only the leader runs the jobs, once per tick.
+    """
+    def __init__(self, lease=None):
         self.scheduler = BlockingScheduler()
-        
-    def crontab(self, job, crontab='* * * * *'): 
-        self.scheduler.add_job(job, CronTrigger.from_crontab(crontab))
+        self.lease = lease
+
+    def crontab(self, job, crontab='* * * * *'):
+        self.scheduler.add_job(
+            self._fenced(job), CronTrigger.from_crontab(crontab), name=job_name(job))
+
+    def _fenced(self, job):
+        if self.lease is None:
+            return job
+        name = job_name(job)
+        def run():
+            # crontabs are minute-granular
+            tick = f'{name}:{int(time.time() // 60)}'
+            self.lease.run_once(tick, job)
+        return run
 
     def start(self):
+        if self.lease is not None:
+            self.lease.refresh()
+            # standbys take over within ttl + ttl/3 seconds
+            self.scheduler.add_job(
+                self.lease.refresh, IntervalTrigger(seconds=self.lease.ttl / 3),
+                name='leader lease', max_instances=1, coalesce=True)
         try:
             self.scheduler.start()
-        except KeyboardInterrupt as e:
+        except (KeyboardInterrupt, SystemExit) as e:
             self.scheduler.shutdown()
+        finally:
+            if self.lease is not None:
+                self.lease.release()
@@ -1,4 +1,5 @@
 import jwt
+import redis
 import secrets
 import stripe
 from flask import current_app as app
@@ -8,10 +9,9 @@ from datetime import datetime, timedelta
 #import json
 #from urllib import parse
 
-from . import errors as err
+from . import errors as err, domain_cache, auth_cache
 from .utils import localize_data, api_url
 from ..db.models.accounts import Account, AccountEmail, Signin
-from ..db.models.domains import Domain
 from ..db import db
 from ..utils.uuid import clean_uuid
 
@@ -72,9 +72,8 @@ def generate_access_token(account, domain_name):
     # is user making claim on a domain
     if domain_name:
         try:
-            # TODO: Use service from the domains module instead
-            domain = Domain.query.filter_by(name=domain_name).one()
-        except (orm_exc.NoResultFound, orm_exc.MultipleResultsFound):
+            domain = domain_cache.get(domain_name)
+        except err.NotFound:
             raise err.FormatError('Invalid domain')
         try:
             # TODO Move to global space
@@ -93,11 +92,17 @@ def generate_access_token(account, domain_name):
     rv = generate_token(payload)
     return rv
 
-def delete_access_token(access_token):
+def delete_access_token(access_token, digest):
     # service
-    # TODO: should delete from access_tokens table rather than deleting token object.
-    db.session.delete(access_token)
-    db.session.flush()
+    """
+    Revoke an access token (by digest, see `auth_cache.token_digest`) until it
+    expires.
+    """
+    try:
+        auth_cache.revoke(digest, access_token.get('exp'))
+    except redis.RedisError as e:
+        app.logger.error(f'Could not revoke access token: {e}')
+        raise err.ServiceError(503, 'Could not revoke access token')
 
 def _get_email_registration_data(data):
     # service
@@ -1,11 +1,19 @@
+from datetime import timedelta
+
 from sqlalchemy import exc as sql_exc
 
 #from .validation import signins as val
-from . import errors as err
+from . import errors as err, outbox, tasks
+from ..config.dramatiq import PASSCODES
 from ..utils.randomstr import randomstr
+from ..utils.uuid import clean_uuid
 from ..db import db
 from ..db.models.accounts import Account, Signin
 
+# new signins are sent by the `send_signin` task, the sweeper only picks up
+# the ones still pending after this long
+SWEEP_DELAY = timedelta(minutes=1)
+
 def create_signin(data):
     # TODO: validation
     # data = val.new_signin.validate(data)
@@ -15,7 +23,7 @@ def create_signin(data):
     if not account:
         raise err.NotFound('No account associated with this e-mail.')
     # if account has been created create a Signin record.
-    # A task queue will send an email to the address with an access code.
+    # Once committed, a task sends an email to the address with an access code.
     # When access code is used, account will be confirmed if it isn't yet.
     try:
         # first delete possible past signings with this email
@@ -31,4 +39,7 @@ def create_signin(data):
     except sql_exc.IntegrityError as e:
         db.session.rollback()
         raise err.FormatError('Could not create sign-in record.')
+    outbox.queue_email('signin', signin.signin_id, delay=SWEEP_DELAY)
+    tasks.enqueue_after_commit('send_signin', clean_uuid(signin.signin_id),
+                               queue_name=PASSCODES)
     return signin
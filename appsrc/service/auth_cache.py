@@ -0,0 +1,140 @@
+"""
+Cache of verified authentication tokens.
+
+Verifying a token (a JWT signature, or an id_token lookup) is done once per
+worker and token; the result is kept under a digest of the token:
+
+- access tokens: their verified claims, until the token's `exp`;
+- id tokens: a snapshot of their account, for `AUTH_CACHE_TTL` seconds.
+
+Revoked tokens are rejected until they'd have expired anyway. Revocations
+are stored in Redis, as `auth:revoked:<digest>` keys expiring with the token,
+which workers consult when verifying a token and then at most every
+`REVOCATION_CHECK` seconds per token. They are also broadcast to every worker
+(see `service.pubsub`), so that they apply right away.
+"""
+import hashlib
+import math
+import time
+from collections import namedtuple
+
+import jwt
+import redis
+from flask import current_app as app
+
+from . import pubsub
+from .utils import redis_client
+from ..db.models.accounts import Account
+from ..utils.cache import LRUCache
+from ..utils.uuid import clean_uuid
+
+CHANNEL = 'auth:revoke'
+CACHE_SIZE = 10000
+# default lifetime of an id token's account snapshot, in seconds
+AUTH_CACHE_TTL = 300
+ALGORITHMS = ['HS256']
+# seconds a token is accepted for without checking Redis for its revocation
+REVOCATION_CHECK = 10
+
+AccessToken = namedtuple('AccessToken', 'claims domain role')
+AccountSnapshot = namedtuple('AccountSnapshot', 'account_id email name lang confirmed')
+
+_tokens = LRUCache(maxsize=CACHE_SIZE)
+_revoked = LRUCache(maxsize=CACHE_SIZE)
+# digests checked against Redis lately
+_checked = LRUCache(maxsize=CACHE_SIZE, ttl=REVOCATION_CHECK)
+
+def token_digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def _revoked_key(digest):
+    return f'auth:revoked:{digest}'
+
+def is_revoked(digest):
+    # service
+    """
+    Whether the token with that digest was revoked, as known by this worker
+    or, at most every REVOCATION_CHECK seconds, by Redis.
+    """
+    pubsub.ensure_listening()
+    if _revoked.get(digest):
+        return True
+    if _checked.get(digest):
+        return False
+    _checked.set(digest, True)
+    try:
+        ttl = redis_client().pttl(_revoked_key(digest))
+    except redis.RedisError as e:
+        app.logger.warning(f'Token revocations unavailable: {e}')
+        return False
+    if ttl is None or ttl < 0:
+        # -2: no such key
+        return False
+    _revoke(f'{digest}:{time.time() + ttl / 1000}')
+    return True
+
+def _ttl():
+    return app.config.get('AUTH_CACHE_TTL', AUTH_CACHE_TTL)
+
+def verify_access_token(token):
+    # service
+    """
+    Verified claims of an access token, with its domain and role claims
+    resolved, as an `AccessToken`. Raise jwt.InvalidTokenError.
+    """
+    digest = token_digest(token)
+    if is_revoked(digest):
+        raise jwt.InvalidTokenError('Revoked token')
+    rv = _tokens.get(('access', digest))
+    if rv is None:
+        claims = jwt.decode(token, app.config['SECRET_KEY'], algorithms=ALGORITHMS)
+        rv = AccessToken(claims, claims.get('domain'), claims.get('role'))
+        # tokens without expiration are verified at most once per TTL
+        ttl = claims['exp'] - time.time() if 'exp' in claims else _ttl()
+        _tokens.set(('access', digest), rv, ttl=ttl)
+    return rv._replace(claims=dict(rv.claims))
+
+def get_id_token_account(token):
+    # service
+    """
+    Snapshot of the account an id token belongs to, or None.
+    """
+    digest = token_digest(token)
+    if is_revoked(digest):
+        return None
+    rv = _tokens.get(('id', digest))
+    if rv is None:
+        account = Account.query.filter_by(id_token=token).one_or_none()
+        if account is None:
+            return None
+        rv = AccountSnapshot(
+            clean_uuid(account.account_id), account.email, account.name,
+            account.lang, account.confirmed)
+        _tokens.set(('id', digest), rv, ttl=_ttl())
+    return rv
+
+def _revoke(message):
+    digest, expires = message.split(':')
+    ttl = float(expires) - time.time()
+    if ttl > 0:
+        _revoked.set(digest, True, ttl=ttl)
+    _tokens.delete(('access', digest))
+    _tokens.delete(('id', digest))
+
+pubsub.subscribe(CHANNEL, _revoke)
+
+def revoke(digest, expires=None):
+    # service
+    """
+    Reject the token with that digest, in every worker, until `expires` (a
+    timestamp, e.g. the `exp` claim). Tokens that don't expire are rejected
+    for AUTH_CACHE_TTL, long enough for cached snapshots to be dropped.
+    Raise redis.RedisError if the revocation can't be stored.
+    """
+    if expires is None:
+        expires = time.time() + _ttl()
+    message = f'{digest}:{float(expires)}'
+    _revoke(message)
+    if expires > time.time():
+        redis_client().set(_revoked_key(digest), 1, exat=math.ceil(expires))
+    pubsub.publish(CHANNEL, message)
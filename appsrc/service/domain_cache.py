@@ -0,0 +1,112 @@
+"""
+Per-worker cache of domains, by name.
+
+Nearly every request resolves its domain from the url, so each worker keeps
+an immutable snapshot of the domains it has seen (`DomainSnapshot`), for
+`DOMAIN_CACHE_TTL` seconds at most. Unknown names are cached as well, so
+that bogus urls don't each cost a query.
+
+Changes to a domain (`update_domain`, `create_domain`) are announced to every
+worker once their transaction commits (see `service.pubsub`), so that all of
+them drop the stale snapshot. The TTL bounds the staleness if Redis isn't
+reachable.
+"""
+import copy
+from collections import namedtuple
+
+from flask import current_app as app
+from sqlalchemy import event
+
+from . import errors as err, pubsub
+from ..db import db
+from ..db.models.domains import Domain
+from ..utils.cache import LRUCache
+
+CHANNEL = 'domains:invalidate'
+# default lifetime of a snapshot, in seconds
+DOMAIN_CACHE_TTL = 60
+CACHE_SIZE = 4096
+
+_fields = ['domain_id', 'name', 'active', 'creation_date', 'data', 'meta']
+
+class DomainSnapshot(namedtuple('DomainSnapshot', _fields)):
+    """
+    Read-only stand-in for a `Domain` record. `data` and `meta` are copied
+    on the way out of the cache, so that requests can't alter the snapshot.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_record(cls, domain):
+        return cls(**{f: copy.deepcopy(getattr(domain, f)) for f in _fields})
+
+    @property
+    def privacy(self):
+        return (self.meta or {}).get('privacy', 'private')
+
+    @property
+    def languages(self):
+        return (self.meta or {}).get('languages') or app.config['AVAILABLE_LANGS']
+
+    def copy(self):
+        return self._replace(data=copy.deepcopy(self.data),
+                             meta=copy.deepcopy(self.meta))
+
+missing = object()
+_cache = None
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        ttl = app.config.get('DOMAIN_CACHE_TTL', DOMAIN_CACHE_TTL)
+        _cache = LRUCache(maxsize=CACHE_SIZE, ttl=ttl)
+    return _cache
+
+def get(domain_name):
+    # service
+    """
+    Snapshot of the domain named `domain_name`. Raise NotFound.
+    """
+    pubsub.ensure_listening()
+    cache = _get_cache()
+    rv = cache.get(domain_name, missing)
+    if rv is missing:
+        domain = Domain.query.filter_by(name=domain_name).one_or_none()
+        rv = None if domain is None else DomainSnapshot.from_record(domain)
+        cache.set(domain_name, rv)
+    if rv is None:
+        raise err.NotFound(f'Domain {domain_name} not found')
+    return rv.copy()
+
+def invalidate(domain_name=None):
+    # service
+    """
+    Drop a domain from this worker's cache, or all of them.
+    """
+    if _cache is None:
+        return
+    if domain_name is None:
+        _cache.clear()
+    else:
+        _cache.delete(domain_name)
+
+pubsub.subscribe(CHANNEL, invalidate)
+
+def queue_invalidation(domain_name):
+    # service
+    """
+    Invalidate the domain in every worker once the current transaction
+    commits.
+    """
+    db.session.info.setdefault('domain_invalidations', set()).add(domain_name)
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_invalidations(session):
+    for domain_name in session.info.pop('domain_invalidations', ()):
+        invalidate(domain_name)
+        pubsub.publish(CHANNEL, domain_name)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_invalidations(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('domain_invalidations', None)
@@ -3,7 +3,7 @@ from flask import current_app as app
 from sqlalchemy.orm import exc as orm_exc
 from sqlalchemy import exc as sql_exc
 
-from . import errors as err
+from . import errors as err, domain_cache
 from .utils import localize_data, delocalize_data, StripeContext
 from .accounts import get_account
 from ..db.models.domains import Domain, DomainAccount, DomainAccessRequest
@@ -88,6 +88,8 @@ def create_domain(data, access_token, lang):
             db.session.flush()
     except err.Conflict: raise
     except: raise err.FormatError()
+    # the name may have been cached as unknown
+    domain_cache.queue_invalidation(domain.name)
     return domain
 
 def get_domains(access_token, lang):
@@ -137,17 +139,19 @@ def update_domain(domain_name, data, lang):
         db.session.flush()
     except:
         raise err.FormatError('Could not apply changes to domain')
+    domain_cache.queue_invalidation(domain.name)
 
 def check_domain_name(domain_name):
     """
     Raise error if domain doesn't exist or is in list of reserved words raise.
-    Otherwise return domain.
+    Otherwise return domain (a snapshot, see `domain_cache`).
     """
     if domain_name in reserved_words:
         raise err.NotAuthorized('Unavailable domain name')
     try:
-        return Domain.query.filter(Domain.name==domain_name).one()
-    except orm_exc.NoResultFound as e:
+        # called as users type, unknown names are cached too
+        return domain_cache.get(domain_name)
+    except err.NotFound as e:
         raise err.NotFound('Domain not found')
 
 def get_domain_account(domain_id, account_id):
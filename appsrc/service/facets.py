@@ -0,0 +1,293 @@
+"""
+In-memory facet index of products by group option.
+
+Each domain gets a `FacetIndex` that assigns every product an ordinal and
+keeps, for every `GroupOption`, a bitset (a Python int) of the ordinals of the
+products tagged with it. Filtering by group options and counting the
+products remaining for each option then come down to bitwise AND/OR instead
+of one SQL join per group.
+
+Filters follow the storefront's semantics: options of the same group are
+OR'ed, groups are AND'ed.
+
+    [{'options': [<group_option_id>, ...]}, {'options': [...]}, ...]
+
+The index also keeps the listing sort key of every product, so that a page
+of matching products is picked in memory and only its rows are queried.
+
+Indexes are built lazily per worker. Changes made by this worker are applied
+incrementally, once the transaction that made them is committed (see
+`queue_update`); other workers are told to drop their index for the domain
+(see `service.pubsub`), and rebuild it after `FACETS_TTL` seconds anyway if
+Redis isn't reachable.
+"""
+import heapq
+import threading
+import time
+from datetime import datetime as dtm
+from uuid import uuid4
+
+from flask import current_app as app
+from sqlalchemy import event
+
+from . import pubsub
+from ..db import db
+from ..db.models.products import LAST_PRIORITY
+from ..utils.uuid import clean_uuid
+
+CHANNEL = 'facets:invalidate'
+# tells this worker's own invalidations apart from the others'
+WORKER_ID = uuid4().hex
+
+# default lifetime of a domain's index, in seconds
+FACETS_TTL = 300
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+class FacetIndex:
+
+    def __init__(self, domain_id):
+        self.domain_id = domain_id
+        self.loaded_at = time.monotonic()
+        self.lock = threading.RLock()
+        # product_id -> ordinal, and its reverse
+        self.ordinals = {}
+        self.product_ids = []
+        # ordinals of existing (i.e. not deleted) products
+        self.all = 0
+        # group_option_id -> bitset of product ordinals
+        self.options = {}
+        # group_option_id -> group_id
+        self.option_groups = {}
+        # ordinal -> (priority, updated_ts), see `page`
+        self.sort_keys = {}
+
+    def ordinal(self, product_id):
+        product_id = clean_uuid(product_id)
+        try:
+            return self.ordinals[product_id]
+        except KeyError:
+            ordinal = self.ordinals[product_id] = len(self.product_ids)
+            self.product_ids.append(product_id)
+            self.all |= 1 << ordinal
+            return ordinal
+
+    def add_product(self, product_id, priority=None, updated_ts=None):
+        with self.lock:
+            self.set_sort_key(product_id, priority, updated_ts)
+
+    def set_sort_key(self, product_id, priority, updated_ts):
+        with self.lock:
+            self.sort_keys[self.ordinal(product_id)] = (
+                LAST_PRIORITY if priority is None else priority,
+                updated_ts or dtm.min)
+
+    def remove_product(self, product_id):
+        with self.lock:
+            ordinal = self.ordinals.get(clean_uuid(product_id))
+            if ordinal is None:
+                return
+            mask = ~(1 << ordinal)
+            self.all &= mask
+            for option_id in self.options:
+                self.options[option_id] &= mask
+
+    def add_option(self, group_option_id, group_id):
+        with self.lock:
+            group_option_id = clean_uuid(group_option_id)
+            self.options.setdefault(group_option_id, 0)
+            self.option_groups[group_option_id] = clean_uuid(group_id)
+
+    def remove_options(self, group_option_ids):
+        with self.lock:
+            for option_id in group_option_ids:
+                option_id = clean_uuid(option_id)
+                self.options.pop(option_id, None)
+                self.option_groups.pop(option_id, None)
+
+    def set_product_options(self, product_id, options):
+        """
+        Replace a product's options. `options` maps group_option_id to group_id.
+        """
+        with self.lock:
+            bit = 1 << self.ordinal(product_id)
+            for option_id in self.options:
+                self.options[option_id] &= ~bit
+            for option_id, group_id in options.items():
+                self.add_option(option_id, group_id)
+                self.options[clean_uuid(option_id)] |= bit
+
+    def set_option_products(self, group_option_id, group_id, product_ids):
+        """
+        Replace the products tagged with an option.
+        """
+        with self.lock:
+            self.add_option(group_option_id, group_id)
+            bits = 0
+            for product_id in product_ids:
+                bits |= 1 << self.ordinal(product_id)
+            self.options[clean_uuid(group_option_id)] = bits
+
+    def _group_bits(self, options):
+        bits = 0
+        for option_id in options:
+            bits |= self.options.get(clean_uuid(option_id), 0)
+        return bits
+
+    def match(self, groups=None):
+        """
+        Bitset of the products matching all groups of options.
+        """
+        with self.lock:
+            bits = self.all
+            for g in groups or []:
+                bits &= self._group_bits(g['options'])
+            return bits
+
+    def counts(self, groups=None):
+        """
+        Number of products remaining for each option, if it were added to the
+        current selection. An option's own group is left out of the filter, so
+        that sibling options keep meaningful counts.
+        """
+        with self.lock:
+            selected = {}
+            for g in groups or []:
+                group_ids = {self.option_groups.get(clean_uuid(o)) for o in g['options']}
+                bits = self._group_bits(g['options'])
+                for group_id in group_ids:
+                    selected[group_id] = selected.get(group_id, self.all) & bits
+            rv = {}
+            for option_id, option_bits in self.options.items():
+                bits = self.all & option_bits
+                for group_id, group_bits in selected.items():
+                    if group_id!=self.option_groups.get(option_id):
+                        bits &= group_bits
+                rv[option_id] = popcount(bits)
+            return rv
+
+    @staticmethod
+    def ordinals_of(bits):
+        """
+        Set bits of a bitset, in increasing order. Linear in its size: the
+        bitset is converted once instead of being shifted bit by bit.
+        """
+        digits = bin(bits)[:1:-1]
+        ordinal = digits.find('1')
+        while ordinal!=-1:
+            yield ordinal
+            ordinal = digits.find('1', ordinal + 1)
+
+    def products(self, bits):
+        """
+        Product ids of a bitset, in ordinal order.
+        """
+        return [self.product_ids[o] for o in self.ordinals_of(bits)]
+
+    def page(self, bits, limit, after=None):
+        """
+        Ids of the first `limit` products of a bitset in listing order
+        (priority asc, updated_ts desc, product_id desc), past the
+        (priority, updated_ts, product_id) key `after`.
+        """
+        default = (LAST_PRIORITY, dtm.min)
+        def listing_key(ordinal):
+            priority, updated_ts = self.sort_keys.get(ordinal, default)
+            return (-priority, updated_ts, self.product_ids[ordinal])
+        with self.lock:
+            keys = map(listing_key, self.ordinals_of(bits))
+            if after is not None:
+                priority, updated_ts, product_id = after
+                seek = (-priority, updated_ts, clean_uuid(product_id))
+                keys = (k for k in keys if k < seek)
+            return [k[2] for k in heapq.nlargest(limit, keys)]
+
+    @classmethod
+    def load(cls, domain_id):
+        rv = cls(domain_id)
+        params = {'domain_id': domain_id}
+        products = db.session.execute(db.text(
+            'select product_id, priority, updated_ts from products '
+            'where domain_id=:domain_id order by product_id'), params)
+        for row in products:
+            rv.set_sort_key(row.product_id, row.priority, row.updated_ts)
+        options = db.session.execute(db.text(
+            'select group_option_id, group_id from group_options '
+            'where domain_id=:domain_id'), params)
+        for row in options:
+            rv.add_option(row.group_option_id, row.group_id)
+        tags = db.session.execute(db.text(
+            'select group_option_id, product_id from products_group_options '
+            'where domain_id=:domain_id'), params)
+        for row in tags:
+            option_id = clean_uuid(row.group_option_id)
+            rv.options[option_id] = (
+                rv.options.get(option_id, 0) | 1 << rv.ordinal(row.product_id))
+        return rv
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(domain_id):
+    # service
+    ttl = app.config.get('FACETS_TTL', FACETS_TTL)
+    index = _indexes.get(domain_id)
+    if index is None or time.monotonic() - index.loaded_at > ttl:
+        index = FacetIndex.load(domain_id)
+        with _indexes_lock:
+            _indexes[domain_id] = index
+    return index
+
+def invalidate(domain_id=None):
+    # service
+    with _indexes_lock:
+        if domain_id is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(domain_id, None)
+
+def _invalidate_message(message):
+    domain_id, worker_id = message.split(':', 1)
+    # this worker's index is already up to date
+    if worker_id!=WORKER_ID:
+        invalidate(int(domain_id))
+
+pubsub.subscribe(CHANNEL, _invalidate_message)
+
+def queue_update(domain_id, method, *a, **kw):
+    # service
+    """
+    Apply `FacetIndex.<method>(*a, **kw)` to the domain's index once the
+    current transaction commits. Nothing is applied if it's rolled back, or if
+    the index isn't loaded in this worker yet.
+    """
+    db.session.info.setdefault('facet_updates', []).append(
+        (domain_id, method, a, kw))
+
+def queue_invalidation(domain_id):
+    # service
+    """
+    Drop the domain's index in every worker once the current transaction
+    commits, for changes too broad to apply incrementally.
+    """
+    db.session.info.setdefault('facet_updates', []).append(
+        (domain_id, None, (), {}))
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_updates(session):
+    updated = set()
+    for domain_id, method, a, kw in session.info.pop('facet_updates', []):
+        updated.add(domain_id)
+        index = _indexes.get(domain_id)
+        if method is None:
+            invalidate(domain_id)
+        elif index is not None:
+            getattr(index, method)(*a, **kw)
+    for domain_id in updated:
+        pubsub.publish(CHANNEL, f'{domain_id}:{WORKER_ID}')
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_updates(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('facet_updates', None)
@@ -4,7 +4,8 @@ from ..utils.uuid import clean_uuid
 #from ..db.data_utils.products import _localize_data, _merge_localized_data
 from .product_utils import _localize_data, _merge_localized_data
 
-from . import errors as err
+from . import errors as err, facets
+from .products import touch_products
 
 def get_group(group_id, domain_id, active=None):
     # service
@@ -60,9 +61,11 @@ def _sync_options(grp, options, lang, domain_id):
         clause = db.text(
             'delete from products_group_options '
             'where domain_id=:domain_id '
-            'and group_option_id in :optionlist')
+            'and group_option_id in :optionlist '
+            'returning product_id')
         delete_product_options = clause.bindparams(domain_id=domain_id, optionlist=deleted)
-        db.session.execute(delete_product_options)
+        unlinked = db.session.execute(delete_product_options).fetchall()
+        touch_products([row.product_id for row in unlinked], domain_id)
         # delete options
         clause = db.text(
             'delete from group_options '
@@ -70,6 +73,7 @@ def _sync_options(grp, options, lang, domain_id):
             'and group_option_id in :optionlist')
         delete_options = clause.bindparams(domain_id=domain_id, optionlist=deleted)
         db.session.execute(delete_options)
+        facets.queue_update(domain_id, 'remove_options', deleted)
     # update the remaining existing options
     for position,o in enumerate(options):
         # if the option has an id it needs to be updated
@@ -120,11 +124,24 @@ def update_group(group_id, domain_id, data, lang):
 def delete_group(group_id, domain_id):
     # service
     try:
+        # the relations would go with the group's options, but the products
+        # showing them must be told
+        unlinked = db.session.execute(db.text(
+            'DELETE FROM products_group_options pgo USING group_options go '
+            'WHERE go.domain_id=pgo.domain_id '
+            'AND go.group_option_id=pgo.group_option_id '
+            'AND go.domain_id=:domain_id AND go.group_id=:group_id '
+            'RETURNING pgo.product_id'),
+            {'domain_id':domain_id, 'group_id':group_id,}).fetchall()
         db.session.execute(db.text(
             'DELETE FROM groups WHERE domain_id=:domain_id AND group_id=:group_id '),
             {'domain_id':domain_id, 'group_id':group_id,})
     except:
         db.session.rollback()
+        return
+    touch_products([row.product_id for row in unlinked], domain_id)
+    # the group's options are gone with it, simply reload the facets
+    facets.queue_invalidation(domain_id)
 
 def create_group_option(group_id, domain_id, data, lang):
     # service
@@ -165,6 +182,16 @@ def update_group_option(group_id, group_option_id, domain_id, data, lang):
 def delete_group_option(group_id, group_option_id, domain_id):
     # service
     try:
+        unlinked = db.session.execute(db.text(
+            'DELETE FROM products_group_options pgo USING group_options go '
+            'WHERE go.domain_id=pgo.domain_id '
+            'AND go.group_option_id=pgo.group_option_id '
+            'AND go.domain_id=:domain_id AND go.group_id=:group_id '
+            'AND go.group_option_id=:group_option_id '
+            'RETURNING pgo.product_id'), {
+                'domain_id':domain_id,
+                'group_id':group_id,
+                'group_option_id':group_option_id }).fetchall()
         db.session.execute(db.text(
             'DELETE FROM group_options WHERE domain_id=:domain_id AND group_id=:group_id '
             'AND group_option_id=:group_option_id'), {
@@ -173,6 +200,9 @@ def delete_group_option(group_id, group_option_id, domain_id):
                 'group_option_id':group_option_id })
     except:
         db.session.rollback()
+        return
+    touch_products([row.product_id for row in unlinked], domain_id)
+    facets.queue_update(domain_id, 'remove_options', [group_option_id])
 
 def update_group_option_products(group_id, group_option_id, domain_id, data):
     # service
@@ -180,8 +210,10 @@ def update_group_option_products(group_id, group_option_id, domain_id, data):
     try:
         q = db.text(
             'DELETE FROM products_group_options WHERE domain_id=:domain_id '
-            'AND group_option_id=:group_option_id')
-        db.session.execute(q, {'domain_id':domain_id, 'group_option_id':group_option_id})
+            'AND group_option_id=:group_option_id '
+            'RETURNING product_id')
+        unlinked = db.session.execute(
+            q, {'domain_id':domain_id, 'group_option_id':group_option_id}).fetchall()
     except:
         db.session.rollback()
         raise err.FormatError('Bad format')
@@ -199,4 +231,11 @@ def update_group_option_products(group_id, group_option_id, domain_id, data):
     except:
         db.session.rollback()
         raise err.FormatError('Could not associate group option with products')
+    # products that gained or lost the option
+    touch_products(
+        set(clean_uuid(row.product_id) for row in unlinked).symmetric_difference(
+            clean_uuid(n['product_id']) for n in new), domain_id)
+    facets.queue_update(
+        domain_id, 'set_option_products', group_option_id, group_id,
+        [n['product_id'] for n in new])
     return g_o
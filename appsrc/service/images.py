@@ -1,14 +1,21 @@
+import functools
 import hashlib
+import hmac
 import os
+import time
+from datetime import datetime, timedelta
 from flask import current_app as app
 from sqlalchemy.orm import exc as orm_exc
 from werkzeug.utils import secure_filename
 from libthumbor import CryptoURL
 
-from . import errors as err
+from . import errors as err, tasks
+from .products import touch_product, touch_image_products
 from .validation import images as vld
+from ..config.dramatiq import IMAGES
 from ..db import db
 from ..db.models import images as img
+from ..utils import variants
 
 imgcnf = lambda: app.config.IMAGE
 
@@ -54,22 +61,27 @@ def generate_main_copy(source_record):
     except:
         # Whatever the problem delete that record if it exists.
         if main_record: delete_image_record(main_record)
-    # No existing copy. Generate one.
+    # No existing copy. Generate one. Only problems with the file itself are
+    # format errors, others (a missing file, a full disk, the database) are
+    # left to the caller to retry.
     try:
-        source_image = load_image_from_filepath(source_record.meta.get('filepath'), config)
-        main_copy = source_image.thumbnail(config['WEB_MAX_LENGTH'], context='web')
-        main_copy.save()
-        main_record = img.BaseImage(
-            domain_id = source_record.domain_id,
-            base_image_id = main_copy.blob_signature,
-            meta = {**main_copy.datadict},
-            source=source_record, )
-        set_aspect_ratios(main_record)
-        db.session.add(main_record)
-        db.session.flush()
-    except:
+        source_image = img.ImageUtil.load_from_filepath(
+            source_record.meta.get('filepath'), config)
+        with source_image.thumbnail(config['WEB_MAX_LENGTH'], context='web') as main_copy:
+            main_copy.save()
+    except img.FORMAT_ERRORS:
         db.session.rollback()
         raise err.FormatError('Could not copy source image')
+    main_record = img.BaseImage(
+        domain_id = source_record.domain_id,
+        base_image_id = main_copy.blob_signature,
+        meta = {**main_copy.datadict},
+        source=source_record, )
+    set_aspect_ratios(main_record)
+    sign_thumbor_urls(main_record)
+    db.session.add(main_record)
+    db.session.flush()
+    touch_image_products(main_record.domain_id, [main_record.base_image_id])
     return main_record
 
 def _file_basename(file):
@@ -88,29 +100,130 @@ def save_source_image(domain_id, source_file):
     # service
     config = imgcnf()
     try:
+        # streamed once to a temporary file, hashed on the way
         source_image = img.ImageUtil.load_from_file(source_file, config, context='source')
     except:
         raise err.FormatError('Could not load image file')
+    with source_image:
+        try:
+            # First, try returning existing image record.
+            image_id = source_image.blob_signature
+            return get_source_image_record(image_id, domain_id)
+        except err.NotFound as e:
+            pass
+        try:
+            # No existing record. Create one.
+            meta = {**source_image.datadict}
+            meta['original_name'] = _file_basename(source_file)
+            source_image.save()
+            source_record = img.SourceImage(
+                source_image_id=image_id,
+                domain_id=domain_id,
+                meta=meta, )
+            db.session.add(source_record)
+            db.session.flush()
+        except:
+            db.session.rollback()
+            raise err.FormatError('Could not save image file')
+    return source_record
+
+# derivatives: main copy (and variants) of a source image
+PENDING, READY, FAILED = 'pending', 'ready', 'failed'
+# seconds between checks of `wait_for_derivatives`
+POLL_INTERVAL = 0.5
+# derivatives pending for longer are swept up by `sweep_derivatives`: queued
+# again up to MAX_SWEEPS times, then failed
+STALE_AFTER = timedelta(minutes=10)
+MAX_SWEEPS = 2
+
+def set_derivatives_status(source_record, status, error=None, sweeps=0):
+    # service
+    derivatives = {
+        'status': status,
+        'updated': datetime.utcnow().isoformat(timespec='seconds')}
+    if error is not None:
+        derivatives['error'] = error
+    if sweeps:
+        derivatives['sweeps'] = sweeps
+    source_record.meta = {**(source_record.meta or {}), 'derivatives': derivatives}
+
+def queue_derivatives(source_record, sweeps=0):
+    # service
+    """
+    Have the derivatives of a source image generated by a worker once the
+    current transaction commits, unless they exist. Return the status.
+    """
     try:
-        # First, try returning existing image record.
-        image_id = source_image.blob_signature
-        return get_source_image_record(image_id, domain_id)
-    except err.NotFound as e:
+        get_main_image_record(source_record)
+        return READY
+    except err.NotFound:
         pass
+    set_derivatives_status(source_record, PENDING, sweeps=sweeps)
+    db.session.flush()
+    tasks.enqueue_after_commit(
+        'generate_derivatives', source_record.domain_id,
+        source_record.source_image_id, queue_name=IMAGES)
+    return PENDING
+
+def sweep_derivatives(stale_after=STALE_AFTER, max_sweeps=MAX_SWEEPS):
+    # service
+    """
+    Settle the derivatives pending for longer than `stale_after`, e.g.
+    because their message was lost while the broker was unreachable: queue
+    them again, or fail them once they were swept `max_sweeps` times. Return
+    the number of source images swept.
+    """
+    derivatives = img.SourceImage.meta['derivatives']
+    cutoff = (datetime.utcnow() - stale_after).isoformat(timespec='seconds')
+    stale = (img.SourceImage.query
+             .filter(derivatives['status'].astext==PENDING)
+             .filter(db.or_(derivatives['updated'].astext.is_(None),
+                            derivatives['updated'].astext < cutoff))
+             .with_for_update(skip_locked=True)
+             .all())
+    for source_record in stale:
+        sweeps = source_record.meta['derivatives'].get('sweeps', 0)
+        if sweeps < max_sweeps:
+            if queue_derivatives(source_record, sweeps=sweeps + 1)==READY:
+                set_derivatives_status(source_record, READY)
+        else:
+            set_derivatives_status(source_record, FAILED, 'Timed out')
+    db.session.flush()
+    return len(stale)
+
+def get_derivatives_status(image_id, domain_id):
+    # service
+    """
+    Return (status, main image record or None) of a source image, as last
+    committed.
+    """
     try:
-        # No existing record. Create one.
-        meta = {**source_image.datadict}
-        meta['original_name'] = _file_basename(source_file)
-        source_image.save()
-        source_record = img.SourceImage(
-            source_image_id=image_id,
-            domain_id=domain_id,
-            meta=meta, )
-        db.session.add(source_record)
-        db.session.flush()
-    except:
+        record = img.SourceImage.query.filter_by(
+            source_image_id=image_id, domain_id=domain_id
+        ).populate_existing().one()
+    except orm_exc.NoResultFound as e:
+        raise err.NotFound('Image not found')
+    main_record = img.BaseImage.query.filter_by(
+        source_image_id=image_id, domain_id=domain_id, name='main').first()
+    if main_record is not None:
+        return READY, main_record
+    status = (record.meta or {}).get('derivatives', {}).get('status', PENDING)
+    return status, None
+
+def wait_for_derivatives(image_id, domain_id, timeout=0):
+    # service
+    """
+    `get_derivatives_status`, once the derivatives are no longer pending
+    or after `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        status, main_record = get_derivatives_status(image_id, domain_id)
+        if status!=PENDING or time.monotonic() + POLL_INTERVAL > deadline:
+            return status, main_record
+        # don't hold a transaction open while waiting
         db.session.rollback()
-    return source_record
+        time.sleep(POLL_INTERVAL)
 
 def get_images(domain_id):
     # service
@@ -134,14 +247,16 @@ def _filter_aspect_ratios(original_aspect_ratios, original_sizes, params):
         rv[1] = tuple(s for s in rv[1] if s[0] in valid_sizes)
     return rv
 
-def get_aspect_ratios(image, filter_params=None):
+# (name, length of the largest side), 0 meaning as large as the copy
+IMAGE_SIZES = (('large',0), ('medium',700), ('small',300), ('thumb',100))
+
+def variant_options(img_meta, filter_params=None):
     # service
-    img_meta = image.meta
-    # TODO: get this from config
-    crypto = CryptoURL(key='MY_SECURE_KEY')
-    # TODO: get this from config
-    img_sizes = tuple(
-        s for s in (('large',0), ('medium',700), ('small',300), ('thumb',100)))
+    """
+    Yield (aspect ratio, size, options) of the variants of an image, the
+    options being Thumbor's (`crop`, `width` or `height`).
+    """
+    img_sizes = IMAGE_SIZES
     # add '0:0' to image's stored aspect ratios
     img_aspect_ratios = tuple(
         ar for ar in [{'name':'0:0'}]+ img_meta.get( 'aspect_ratios', []))
@@ -150,29 +265,139 @@ def get_aspect_ratios(image, filter_params=None):
             img_aspect_ratios, img_sizes, filter_params)
     # determine the widest side
     largest = 'width' if img_meta.get('width', 0)>=img_meta.get('height', 0) else 'height'
-    thumbor_base = app.config['THUMBOR_SERVER']
-    base_options = {"image_url": img_meta['filename']}
-    rv = {}
     for a_r in img_aspect_ratios:
         crop = None
         if a_r['name']!='0:0':
             ab = (a_r['A'], a_r['B'])
             cd = (a_r['C'], a_r['D'])
             crop = ab, cd
-        #for size_name, size in valid_sizes():
         for size_name, size in img_sizes:
-            b_o = {**base_options}
+            options = {}
             # If a_r is not 0:0 (i.e. original size) it means there's some cropping to do.
             if crop:
-                b_o['crop'] = crop
+                options['crop'] = crop
             if size:
-                b_o[largest] = min(size, a_r.get(largest, img_meta[largest]))
+                options[largest] = min(size, a_r.get(largest, img_meta[largest]))
+            yield a_r['name'], size_name, options
+
+def render_variants(base_image):
+    # service
+    """
+    Pre-render every variant of an image with Pillow, when IMAGE_RENDER_MODE
+    is 'local', and record their paths in its meta.
+    """
+    if app.config.get('IMAGE_RENDER_MODE', 'thumbor')!='local':
+        return
+    meta = base_image.meta
+    paths, jobs = {}, []
+    for a_r, size_name, options in variant_options(meta):
+        path = variants.variant_path(
+            base_image.base_image_id, a_r, size_name, meta['extension'])
+        paths.setdefault(a_r, {})[size_name] = path
+        jobs.append((path, options))
+    variants.render_variants(
+        meta['filepath'], os.path.join(imgcnf()['DUMP'], 'variants'), jobs,
+        processes=app.config.get('IMAGE_RENDER_PROCESSES', 1))
+    base_image.meta = {**meta, 'variants': paths}
+    touch_image_products(base_image.domain_id, [base_image.base_image_id])
+
+@functools.lru_cache(maxsize=4)
+def _crypto_url(key):
+    return CryptoURL(key=key)
+
+@functools.lru_cache(maxsize=4)
+def _key_version(key, presets):
+    return hmac.new(key.encode('utf-8'), presets.encode('utf-8'),
+                    hashlib.sha256).hexdigest()[:16]
+
+def thumbor_key_version():
+    # service
+    """
+    Version of the Thumbor key and of the size presets, an HMAC of the
+    presets keyed by the secret: signed URLs stored with another version are
+    stale.
+    """
+    return _key_version(app.config['THUMBOR_SECURITY_KEY'], repr(IMAGE_SIZES))
+
+def sign_thumbor_urls(base_image):
+    # service
+    """
+    Sign the Thumbor URLs of every variant of an image, once, and store them
+    in its meta, as {'version': ..., 'urls': {aspect ratio: {size: path}}}.
+    Paths are relative to THUMBOR_SERVER.
+    """
+    meta = base_image.meta
+    crypto = _crypto_url(app.config['THUMBOR_SECURITY_KEY'])
+    urls = {}
+    for a_r, size_name, options in variant_options(meta):
+        urls.setdefault(a_r, {})[size_name] = crypto.generate(
+            image_url=meta['filename'], **options)
+    base_image.meta = {
+        **meta, 'thumbor': {'version': thumbor_key_version(), 'urls': urls}}
+
+def sign_all_images(chunk_size=500, force=False):
+    # service
+    """
+    Sign again the Thumbor URLs of every image whose URLs are stale (all of
+    them with `force`), e.g. after rotating the Thumbor key or changing the
+    size presets. Images are streamed in chunks of `chunk_size`.
+
+    Yields the number of images signed after each chunk, letting the caller
+    commit between chunks.
+    """
+    version = thumbor_key_version()
+    q = img.BaseImage.query.order_by(
+        img.BaseImage.domain_id, img.BaseImage.base_image_id)
+    if not force:
+        q = q.filter(db.or_(
+            img.BaseImage.meta['thumbor']['version'].astext.is_(None),
+            img.BaseImage.meta['thumbor']['version'].astext!=version))
+    last = None
+    while True:
+        chunk_q = q
+        if last is not None:
+            chunk_q = chunk_q.filter(db.tuple_(
+                img.BaseImage.domain_id, img.BaseImage.base_image_id) > last)
+        images = chunk_q.limit(chunk_size).all()
+        if not images:
+            return
+        for image in images:
+            sign_thumbor_urls(image)
+        # products are left alone: the key version is part of their
+        # documents' version already (see `products.document_version`)
+        db.session.flush()
+        last = (images[-1].domain_id, images[-1].base_image_id)
+        yield len(images)
+
+def get_aspect_ratios(image, filter_params=None):
+    # service
+    img_meta = image.meta
+    thumbor_base = app.config['THUMBOR_SERVER']
+    # pre-rendered variants, served as static files
+    rendered = img_meta.get('variants', {})
+    if app.config.get('IMAGE_RENDER_MODE', 'thumbor')!='local':
+        rendered = {}
+    variants_base = app.config.get('IMAGE_VARIANTS_URL')
+    # URLs signed when the image was stored, unless stale
+    signed = img_meta.get('thumbor', {})
+    signed = signed.get('urls', {}) if signed.get('version')==thumbor_key_version() else {}
+    rv = {}
+    for a_r, size_name, options in variant_options(img_meta, filter_params):
+        path = rendered.get(a_r, {}).get(size_name)
+        signed_path = signed.get(a_r, {}).get(size_name)
+        if path:
+            url = f'{variants_base}{path}'
+        elif signed_path:
+            url = f'{thumbor_base}{signed_path}'
+        else:
             try:
-                url = crypto.generate(**b_o)
+                crypto = _crypto_url(app.config['THUMBOR_SECURITY_KEY'])
+                url = thumbor_base + crypto.generate(
+                    image_url=img_meta['filename'], **options)
             except Exception as e:
                 # TODO: log problem and set url to placeholder image
-                url = ""
-            rv.setdefault(a_r['name'], {})[size_name] = f'{thumbor_base}{url}'
+                url = thumbor_base
+        rv.setdefault(a_r, {})[size_name] = url
     return rv
 
 def get_image(image_id, domain_id, params):
@@ -206,6 +431,7 @@ def update_product_images(product_id, domain_id, data):
             base_image_id=image_id,
             data={'position':position}))
     db.session.flush()
+    touch_product(product_id, domain_id)
 
 # NOTE: might not be useful
 def save_source_image_data(data):
@@ -2,7 +2,7 @@ from sqlalchemy.orm import exc as orm_exc
 from sqlalchemy import exc as sql_exc
 from datetime import datetime
 
-from . import errors as err
+from . import errors as err, outbox
 from ..db import db
 from ..db.models.inquiries import Inquiry, InquiryProduct
 from ..utils.uuid import clean_uuid
@@ -33,6 +33,7 @@ def save_inquiry(domain_id, account_id, data, lang):
     except:
         db.session.rollback()
         raise err.FormatError('Could not save inquiry')
+    outbox.queue_email('inquiry', inq.inquiry_id, domain_id=domain_id)
     return inq
 
 def _inquiry_products(data, account_id):
@@ -0,0 +1,110 @@
+"""
+Transactional outbox of emails.
+
+Services queue an email in the transaction that creates its subject, so that
+it exists if and only if the subject was committed. Workers claim pending
+rows in batches with FOR UPDATE SKIP LOCKED: concurrent workers never get
+the same row, and the rows stay locked until the claiming transaction
+commits the outcome.
+
+    for entry in outbox.claim('inquiry'):
+        ...
+        outbox.mark_sent(entry)   # or mark_failed(entry, error)
+    db.session.commit()
+
+A failed email is retried with exponential backoff, up to MAX_ATTEMPTS.
+"""
+from datetime import datetime, timedelta
+
+from ..db import db
+from ..db.models.accounts import Signin
+from ..db.models.inquiries import Inquiry
+from ..db.models.outbox import OutboxEmail
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 8
+# delay before the first retry, doubled after each failure
+RETRY_DELAY = timedelta(seconds=30)
+MAX_RETRY_DELAY = timedelta(hours=6)
+
+def queue_email(kind, ref_id, domain_id=None, delay=None):
+    # service
+    """
+    Queue an email about the record `ref_id`, e.g. ('inquiry', inquiry_id).
+    It isn't claimed by `claim` before `delay` has passed.
+    """
+    entry = OutboxEmail(kind=kind, ref_id=ref_id, domain_id=domain_id,
+                        next_attempt=datetime.utcnow() + (delay or timedelta()))
+    db.session.add(entry)
+    return entry
+
+def claim(kind, batch_size=BATCH_SIZE, ref_id=None):
+    # service
+    """
+    Lock and return up to `batch_size` pending emails of `kind` that are due,
+    oldest first, skipping the ones other workers hold. With `ref_id`, the
+    pending emails of that record, due or not.
+    """
+    query = OutboxEmail.query.filter_by(kind=kind, status='pending')
+    if ref_id is None:
+        query = query.filter(OutboxEmail.next_attempt<=datetime.utcnow())
+    else:
+        query = query.filter_by(ref_id=ref_id)
+    return (query.order_by(OutboxEmail.next_attempt)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .all())
+
+def retry_delay(attempts):
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+def mark_sent(entry):
+    # service
+    entry.attempts += 1
+    entry.status = 'sent'
+    entry.sent_date = datetime.utcnow()
+
+def mark_failed(entry, error):
+    # service
+    entry.attempts += 1
+    entry.last_error = str(error)[:1000]
+    if entry.attempts >= MAX_ATTEMPTS:
+        entry.status = 'failed'
+    else:
+        entry.next_attempt = datetime.utcnow() + retry_delay(entry.attempts)
+
+def mark_dropped(entry):
+    # service
+    """
+    The record the email is about is gone, e.g. a signin replaced by a newer
+    one.
+    """
+    entry.status = 'dropped'
+
+def _unqueued(kind, ref_id):
+    return ~db.exists().where(
+        (OutboxEmail.kind==kind) & (OutboxEmail.ref_id==ref_id))
+
+def backfill():
+    # service
+    """
+    Queue the emails of the records left unsent before the outbox existed:
+    inquiries flagged `data.email.sent == False` and unsent signins. Records
+    that already have an email queued are skipped, so it's safe to run again.
+    Return the number of (inquiry, signin) emails queued.
+    """
+    unsent = {'email': {'sent': False}}
+    inquiries = (db.session.query(Inquiry.inquiry_id, Inquiry.domain_id)
+                 .filter(Inquiry.data.comparator.contains(unsent))
+                 .filter(_unqueued('inquiry', Inquiry.inquiry_id))
+                 .all())
+    for inquiry_id, domain_id in inquiries:
+        queue_email('inquiry', inquiry_id, domain_id=domain_id)
+    signins = (db.session.query(Signin.signin_id)
+               .filter(Signin.sent==False)
+               .filter(_unqueued('signin', Signin.signin_id))
+               .all())
+    for signin_id, in signins:
+        queue_email('signin', signin_id)
+    db.session.flush()
+    return len(inquiries), len(signins)
@@ -1,63 +1,128 @@
 import copy
+import uuid
 from datetime import datetime as dtm
 
 from flask import current_app as app
-from sqlalchemy.orm import exc as orm_exc
+from sqlalchemy.orm import exc as orm_exc, selectinload
 from sqlalchemy import exc as sql_exc
+from sqlalchemy.dialects.postgresql import insert as pg_insert, REGCONFIG
 from vino import errors as vno_err
 
-from . import errors as err
+from . import errors as err, facets, render_cache
 from ..db import db
-from ..db.models.products import Product, ProductSchema
+from ..db.models.products import Product, ProductSchema, ProductSearch, LAST_PRIORITY
 from ..db.models.groups import GroupOption, ProductGroupOption
+from ..db.models.images import ProductImage
+from ..utils import cursors
 from ..utils.uuid import clean_uuid
 from .product_utils import patch_record, Mismatch
 from .validation.products import (add_product, edit_product, edit_product_members)
 
-def update_search_index(product, lang):
+def searchable_text(fields, lang):
     # service
-    language = app.config['LOCALES'].get(lang,{}).get('language', 'simple')
-    searchable = (f for f in product.fields.get('fields', []) if f.get('searchable'))
+    """
+    Concatenate the values of searchable fields in a given language.
+    """
+    searchable = (f for f in fields.get('fields', []) if f.get('searchable'))
     search = []
     for f in searchable:
         value = f.get('value') or ''
         if f.get('localized'):
             try:
                 value = f['value'][lang] or ''
-            except (AttributeError, KeyError) as e:
+            except (AttributeError, KeyError, TypeError) as e:
                 value = ''
-        search.append(value)
+        search.append(str(value))
+    return ' '.join(search)
+
+def search_language(lang):
+    # service
+    return app.config['LOCALES'].get(lang,{}).get('language', 'simple')
+
+def upsert_search_rows(rows):
+    # service
+    """
+    Write search rows with a single multi-row upsert statement.
+    Each row is a dict of `domain_id`, `product_id`, `lang` and `search` (text).
+    """
+    if not rows:
+        return
+    values = [{
+        'domain_id': r['domain_id'],
+        'product_id': r['product_id'],
+        'lang': r['lang'],
+        'search': db.func.to_tsvector(
+            db.cast(search_language(r['lang']), REGCONFIG), r['search']),
+    } for r in rows]
+    statement = pg_insert(ProductSearch.__table__).values(values)
+    statement = statement.on_conflict_do_update(
+        index_elements=['domain_id', 'product_id', 'lang'],
+        set_={'search': statement.excluded.search})
+    db.session.execute(statement)
+
+def search_rows(products, langs):
+    # service
+    """
+    Build search rows for each product and language. `products` only needs
+    `domain_id`, `product_id` and `fields` attributes.
+    """
+    return [{
+        'domain_id': p.domain_id,
+        'product_id': p.product_id,
+        'lang': lang,
+        'search': searchable_text(p.fields or {}, lang),
+    } for p in products for lang in langs]
+
+def update_search_index(product, lang):
+    # service
     try:
-        statement = '''
-        insert into product_search (domain_id, product_id, lang, search)
-        values (:domain_id, :product_id, :lang, to_tsvector(:language, :search))
-        '''
-        nested = db.session.begin_nested()
-        db.session.execute(db.text(statement), {
-            'domain_id':product.domain_id,
-            'lang':lang,
-            'product_id':product.product_id,
-            'search': ' '.join(search),
-            'language': language, })
+        upsert_search_rows(search_rows([product], [lang]))
         db.session.flush()
-    except sql_exc.IntegrityError as e:
-        nested.rollback()
-        statement = '''
-        update product_search
-        set search = to_tsvector(:language, coalesce(:search))
-        where product_id=:product_id and domain_id=:domain_id and lang=:lang
-        '''
+    except sql_exc.SQLAlchemyError:
+        db.session.rollback()
+        raise err.ServiceError('Could not update data for product search')
+
+def search_index_languages(domain):
+    # service
+    """
+    Languages the products of a domain are indexed in: those of the domain
+    that are available, or every available one. The `product_search` trigger
+    uses the same rule.
+    """
+    available = app.config['AVAILABLE_LANGS']
+    langs = [l for l in (domain.meta or {}).get('languages') or [] if l in available]
+    return langs or list(available)
+
+def reindex_products(domain, chunk_size=500):
+    # service
+    """
+    Rebuild the search index of every product in a domain, for every language
+    enabled on it. Products are streamed in `product_id` order, in chunks of
+    `chunk_size`, each chunk written with a single upsert statement.
+
+    Yields the number of products indexed after each chunk, letting the
+    caller commit (or report progress) between chunks.
+    """
+    langs = search_index_languages(domain)
+    q = (db.session.query(Product.domain_id, Product.product_id, Product.fields)
+         .filter(Product.domain_id==domain.domain_id)
+         .order_by(Product.product_id))
+    last_product_id = None
+    while True:
+        chunk_q = q
+        if last_product_id is not None:
+            chunk_q = chunk_q.filter(Product.product_id > last_product_id)
+        products = chunk_q.limit(chunk_size).all()
+        if not products:
+            return
         try:
-            db.session.execute(db.text(statement), {
-                'domain_id':product.domain_id,
-                'lang':lang,
-                'product_id':product.product_id,
-                'language': language,
-                'search': ' '.join(search)})
+            upsert_search_rows(search_rows(products, langs))
             db.session.flush()
-        except:
+        except sql_exc.SQLAlchemyError:
             db.session.rollback()
             raise err.ServiceError('Could not update data for product search')
+        last_product_id = products[-1].product_id
+        yield len(products)
 
 def localized_product_fields(fields, lang):
     # service
@@ -75,98 +140,133 @@ def localized_product_fields(fields, lang):
         rv.append(new_f)
     return rv
 
-def recent_products(domain, lang, last_product_id=None):
+PAGE_SIZE = 100
+
+def _cursor_secret():
+    return app.config['SECRET_KEY']
+
+def _listing_cursor(row):
+    # service
+    values = (row.priority, row.updated_ts.isoformat(), clean_uuid(row.product_id))
+    return cursors.encode(cursors.LISTING, values, _cursor_secret())
+
+def _listing_seek(cursor):
     # service
-    limit = 100
-    #q = db.session.query(Product.product_id).filter_by(domain_id=domain_id)
-    #q = q.order_by(Product.priority.asc()).order_by(Product.updated_ts.desc())
+    """
+    Decode a listing cursor into its (priority, updated_ts, product_id) key.
+    """
+    try:
+        priority, updated_ts, product_id = cursors.decode(
+            cursor, cursors.LISTING, _cursor_secret())
+        return int(priority), dtm.fromisoformat(updated_ts), uuid.UUID(product_id).hex
+    except (cursors.InvalidCursor, ValueError, TypeError, AttributeError):
+        raise err.FormatError('Invalid cursor')
+
+def _search_cursor(search):
+    # service
+    scope = cursors.scope_digest(search)
+    def cursor_key(row):
+        values = (row.rank, clean_uuid(row.product_id))
+        return cursors.encode(cursors.SEARCH, values, _cursor_secret(), scope=scope)
+    return cursor_key
+
+def _search_seek(cursor, search):
+    # service
+    """
+    Decode a search cursor into its (rank, product_id) key. The cursor is only
+    valid for the search terms that produced it.
+    """
+    scope = cursors.scope_digest(search)
+    try:
+        rank, product_id = cursors.decode(
+            cursor, cursors.SEARCH, _cursor_secret(), scope=scope)
+        return float(rank), uuid.UUID(product_id).hex
+    except (cursors.InvalidCursor, ValueError, TypeError, AttributeError):
+        raise err.FormatError('Invalid cursor')
+
+def recent_products(domain, lang, cursor=None):
+    # service
+    # Listing order is (priority asc, updated_ts desc, product_id desc). Negating
+    # the priority turns it into a single descending key that can be sought with
+    # one row-value comparison, served by the `products_listing_idx` index.
+    # Products without a priority are listed last.
     query = '''
-    select p.product_id
+    select p.product_id, coalesce(p.priority, :last_priority) priority, p.updated_ts
     from products p
-    {lastproduct_subquery}
     where p.domain_id=:domain_id
-    {lastproduct_filter}
-    order by p.priority asc, p.updated_ts desc, p.product_id desc
+    {seek_filter}
+    order by -coalesce(p.priority, :last_priority) desc, p.updated_ts desc,
+        p.product_id desc
     limit :limit
     '''
     qparams = dict(
-        limit=limit,
+        limit=PAGE_SIZE,
+        last_priority=LAST_PRIORITY,
         domain_id=domain.domain_id,)
-    lastproduct_filter = lastproduct_subquery = ''
-    if last_product_id:
-        qparams['last_product_id'] = last_product_id
-        lastproduct_subquery = ''', (
-        select product_id, updated_ts, priority
-        from products
-        where domain_id=:domain_id
-            and product_id = :last_product_id
-        ) lastproduct
-        '''
-        lastproduct_filter = ('''
-        and ( p.priority > lastproduct.priority or
-                (p.priority = lastproduct.priority and
-                    p.updated_ts < lastproduct.updated_ts) or
-                (p.priority = lastproduct.priority and
-                    p.updated_ts = lastproduct.updated_ts and
-                    p.product_id < lastproduct.product_id))''')
-    query = query.format(
-        lastproduct_subquery=lastproduct_subquery,
-        lastproduct_filter=lastproduct_filter,)
-    return execute_product_query(query=db.text(query), params=qparams)
-
-def search_products(domain, lang, last_product_id=None, search_query=''):
-    # service
-    limit = 100
+    seek_filter = ''
+    if cursor:
+        qparams['priority'], qparams['updated_ts'], qparams['product_id'] = (
+            _listing_seek(cursor))
+        seek_filter = ('''
+        and (-coalesce(p.priority, :last_priority), p.updated_ts, p.product_id) < (
+            -cast(:priority as integer),
+            cast(:updated_ts as timestamp),
+            cast(:product_id as uuid))''')
+    query = query.format(seek_filter=seek_filter)
+    return execute_product_query(
+        query=db.text(query), params=qparams, cursor_key=_listing_cursor)
+
+def search_products(domain, lang, cursor=None, search_query=''):
+    # service
     language = app.config['LOCALES'].get(lang,{}).get('language', 'simple')
+    search = '|'.join(s.strip() for s in search_query.split(' ') if s.strip())
     qparams = dict(
         domain_id=domain.domain_id,
         language=language,
-        limit=limit,)
+        search=search,
+        limit=PAGE_SIZE,)
+    # The rank is computed once in the inner query, then sought past directly
+    # using the (rank, product_id) carried by the cursor.
     statement = """
-    select ps.product_id, ts_rank(search, query) rank
-    from product_search ps,
-        to_tsquery(:language, :search) query
-        {lastproduct_subquery}
-    where domain_id=:domain_id
-        {lastproduct_filter}
-        and search @@ query
+    select product_id, rank
+    from (
+        select ps.product_id, ts_rank(ps.search, query) rank
+        from product_search ps,
+            to_tsquery(:language, :search) query
+        where ps.domain_id=:domain_id
+            and ps.search @@ query
+    ) ranked
+    {seek_filter}
     order by rank desc, product_id desc
     limit :limit
     """
-    #order by ts_rank(search, to_tsquery(:language, :search)) desc, product_id desc
-    lastproduct_filter = lastproduct_subquery = ''
-    if last_product_id:
-        lastproduct_subquery = '''
-        , (select product_id, ts_rank(search, to_tsquery(:language, :search)) rank
-        from product_search
-        where domain_id=:domain_id and product_id = :last_product_id
-        ) lastproduct
-        '''
-        lastproduct_filter = (
-            'and (lastproduct.rank, lastproduct.product_id) > (rank, ps.product_id)')
-        qparams['last_product_id'] = last_product_id
-    statement = statement.format(
-        lastproduct_subquery=lastproduct_subquery,
-        lastproduct_filter=lastproduct_filter,)
-    qparams['search'] = '|'.join(
-        s.strip() for s in search_query.split(' ') if s.strip())
-    return execute_product_query(query=db.text(statement), params=qparams)
-
-def execute_product_query(query, params):
+    seek_filter = ''
+    if cursor:
+        qparams['rank'], qparams['product_id'] = _search_seek(cursor, search)
+        seek_filter = (
+            'where (rank, product_id) < '
+            '(cast(:rank as real), cast(:product_id as uuid))')
+    statement = statement.format(seek_filter=seek_filter)
+    return execute_product_query(
+        query=db.text(statement), params=qparams, cursor_key=_search_cursor(search))
+
+def execute_product_query(query, params, cursor_key):
     # service
     # Fetch one more item just to test if we've reached end of list.
-    limit = params['limit'] + 1 if params.get('limit') else None
-    rows = db.session.execute(query, params).fetchall()
-    has_more = False
-    if limit and len(rows) > limit:
-        # If it's possible to fetch the extra item,
-        # it means that there may be more rows.
-        has_more = True
-        rows.pop(-1)
+    limit = params['limit']
+    rows = db.session.execute(query, {**params, 'limit': limit + 1}).fetchall()
+    return product_page(rows, limit, cursor_key)
+
+def product_page(rows, limit, cursor_key):
+    # service
+    has_more = len(rows) > limit
+    # If it was possible to fetch the extra item, there are more rows.
+    rows = rows[:limit]
     return {
         'product_ids':  [clean_uuid(r.product_id) for r in rows],
-        'last_product': rows[-1].product_id if rows else None,
-        'has_more': has_more, }
+        'last_product': clean_uuid(rows[-1].product_id) if rows else None,
+        'has_more': has_more,
+        'next': cursor_key(rows[-1]) if has_more else None, }
 
 
 def set_default_product_schema(domain_id):
@@ -183,37 +283,159 @@ def set_default_product_schema(domain_id):
         raise err.FormatError('Could not create product schema')
     return ps
 
-def get_products(domain, lang, last_product_id, search_query=None):
+def get_products(domain, lang, cursor=None, search_query=None):
     # service
     args = (search_query,) if search_query else ()
     _get_products = search_products if search_query else recent_products
-    return _get_products(domain, lang, last_product_id, *args)
+    return _get_products(domain, lang, cursor, *args)
+
+def product_resource_options():
+    # service
+    """
+    Loader options for rendering product resources: relationships traversed
+    while rendering are loaded in batches, one query each, whatever the number
+    of products.
+    """
+    return (
+        selectinload(Product.group_options),
+        selectinload(Product.images).selectinload(ProductImage.image),)
 
 def get_product_by_ids(product_ids, domain_id, lang):
     # service
     q = Product.query.filter_by(domain_id=domain_id)
     if product_ids:
         q = q.filter(Product.product_id.in_(product_ids))
-    return q.all()
+    return q.options(*product_resource_options()).all()
+
+def document_version(updated_ts, render_version):
+    # service
+    """
+    Version of a product's rendered documents, the version part of their
+    cache key: changes with the product's `updated_ts`, with its
+    `render_version`, and with the Thumbor key its image URLs are signed with.
+    """
+    # service.images imports this module
+    from .images import thumbor_key_version
+    return f'{updated_ts.isoformat()}/{render_version}/{thumbor_key_version()}'
+
+def get_product_versions(product_ids, domain_id):
+    # service
+    """
+    (product_id, document version) pairs of products, the version of their
+    cached documents and of their ETags. Same selection as
+    `get_product_by_ids`.
+    """
+    q = (db.session.query(
+            Product.product_id, Product.updated_ts, Product.render_version)
+         .filter(Product.domain_id==domain_id))
+    if product_ids:
+        q = q.filter(Product.product_id.in_(product_ids))
+    return [(row.product_id, document_version(row.updated_ts, row.render_version))
+            for row in q]
+
+def get_product_version(product_id, domain_id):
+    # service
+    """
+    A product's document version, or None if it doesn't exist.
+    """
+    product_id = clean_uuid(product_id)
+    if product_id is None:
+        return None
+    row = (db.session.query(Product.updated_ts, Product.render_version)
+           .filter_by(product_id=product_id, domain_id=domain_id)
+           .first())
+    return document_version(row.updated_ts, row.render_version) if row else None
 
-def get_products_filtered_by_group(domain_id, groups=None):
+def touch_products(product_ids, domain_id):
+    # service
+    """
+    Bump the render version of products after changes to their relations
+    (groups, images), so that documents rendered from their previous state are
+    no longer served. Their `updated_ts`, and so their listing order, is left
+    alone.
+    """
+    product_ids = tuple(set(clean_uuid(pid) for pid in product_ids))
+    if not product_ids:
+        return
+    db.session.execute(db.text(
+        'update products set render_version=render_version+1 '
+        'where domain_id=:domain_id and product_id in :product_ids'), {
+            'domain_id': domain_id, 'product_ids': product_ids})
+    render_cache.invalidate_many(domain_id, product_ids)
+
+def touch_product(product_id, domain_id):
+    # service
+    touch_products([product_id], domain_id)
+
+def touch_image_products(domain_id, base_image_ids):
+    # service
+    """
+    Bump the render version of the products showing any of the images, after
+    changes to the images' records (copies, rendered variants).
+    """
+    if not base_image_ids:
+        return
+    rows = db.session.execute(db.text(
+        'update products p set render_version=p.render_version+1 '
+        'from product_images pi '
+        'where pi.domain_id=p.domain_id and pi.product_id=p.product_id '
+        'and p.domain_id=:domain_id and pi.base_image_id=any(:base_image_ids) '
+        'returning p.product_id'), {
+            'domain_id': domain_id,
+            'base_image_ids': list(base_image_ids)}).fetchall()
+    render_cache.invalidate_many(domain_id, [row.product_id for row in rows])
+
+def _facet_groups(groups):
     # service
-    q = Product.query.filter(Product.domain_id==domain_id)
     groups = groups or []
     try:
         for g in groups:
-            subq = (ProductGroupOption
-                    .filter(ProductGroupOption.domain_id==domain_id,
-                            ProductGroupOption.group_id.in_(g['options']),)
-                    .subquery())
-            q = q.join(subq, Product.product_id==subq.c.product_id)
-        #subq = qrs[1].subquery()
-        #q = qrs[0].join(subq, Product.product_id==subq.c.product_id)
-        return q.all()
+            g['options'] = [clean_uuid(o) for o in g['options']]
     except KeyError:
         raise err.FormatError('Missing "options" key for group')
+    except TypeError:
+        raise err.FormatError('Invalid group format')
+    return groups
+
+def get_products_filtered_by_group(domain_id, groups=None, cursor=None):
+    # service
+    groups = _facet_groups(groups)
+    priority = db.func.coalesce(Product.priority, LAST_PRIORITY)
+    q = (db.session.query(Product.product_id, priority.label('priority'),
+                          Product.updated_ts)
+         .filter(Product.domain_id==domain_id))
+    seek = _listing_seek(cursor) if cursor else None
+    if groups:
+        # Resolve the matching products, and pick the page, from the in-memory
+        # facet index rather than joining products_group_options once per
+        # group: only the page's rows are queried.
+        index = facets.get_index(domain_id)
+        product_ids = index.page(index.match(groups), PAGE_SIZE + 1, after=seek)
+        if not product_ids:
+            return product_page([], PAGE_SIZE, _listing_cursor)
+        q = q.filter(Product.product_id.in_([uuid.UUID(p) for p in product_ids]))
+    elif seek:
+        seek_priority, updated_ts, product_id = seek
+        q = q.filter(
+            db.tuple_(-priority, Product.updated_ts, Product.product_id) <
+            db.tuple_(-seek_priority, updated_ts, uuid.UUID(product_id)))
+    q = q.order_by(
+        (-priority).desc(), Product.updated_ts.desc(), Product.product_id.desc())
+    try:
+        rows = q.limit(PAGE_SIZE + 1).all()
     except:
+        db.session.rollback()
         raise err.FormatError('Could not collect products')
+    return product_page(rows, PAGE_SIZE, _listing_cursor)
+
+def get_group_option_counts(domain_id, groups=None):
+    # service
+    """
+    Number of products remaining for each group option, given the current
+    selection of options.
+    """
+    groups = _facet_groups(groups)
+    return facets.get_index(domain_id).counts(groups)
 
 def set_product_fields(product_id, domain_id, data):
     # service
@@ -303,6 +525,8 @@ def create_product(data, lang):
     populate_product(p, data, lang)
     db.session.add(p)
     db_flush()
+    facets.queue_update(p.domain_id, 'add_product', p.product_id,
+                        p.priority, p.updated_ts)
     return p
 
 def update_product(product_id, data, domain_id, lang):
@@ -312,6 +536,9 @@ def update_product(product_id, data, domain_id, lang):
     p.updated_ts = dtm.utcnow()
     populate_product(p, data, lang)
     db_flush()
+    render_cache.invalidate(domain_id, p.product_id)
+    facets.queue_update(domain_id, 'set_sort_key', p.product_id,
+                        p.priority, p.updated_ts)
     return p
 
 def update_product_groups(product_id, groups, domain_id):
@@ -322,14 +549,7 @@ def update_product_groups(product_id, groups, domain_id):
     except:
         db.session.rollback()
         raise err.FormatError('Could not update product groups')
-
-def product_details(domain, params):
-    # service
-    product_ids = params.getlist('pid')
-    products = Product.query.filter(
-        Product.product_id.in_(product_ids),
-        Product.domain_id==domain.domain_id,).all()
-    return products
+    touch_product(product_id, domain_id)
 
 def update_group_options(product_id, groups, domain_id):
     # service
@@ -342,6 +562,7 @@ def update_group_options(product_id, groups, domain_id):
         db.session.rollback()
         raise err.FormatError('Could not delete products group options')
     if not groups:
+        facets.queue_update(domain_id, 'set_product_options', product_id, {})
         return
     options = []
     for group_id,group_options in groups.items():
@@ -364,6 +585,8 @@ def update_group_options(product_id, groups, domain_id):
     except:
         db.session.rollback()
         raise err.FormatError('Could not update products group options')
+    facets.queue_update(domain_id, 'set_product_options', product_id, {
+        o.group_option_id: o.group_id for o in options})
 
 def patch_product(product_id, domain_id, data, lang):
     # service
@@ -381,7 +604,11 @@ def patch_product(product_id, domain_id, data, lang):
     except Mismatch as e:
         db.session.rollback()
         raise err.FormatError('Could not patch product data')
+    p.updated_ts = dtm.utcnow()
     db_flush()
+    render_cache.invalidate(domain_id, p.product_id)
+    facets.queue_update(domain_id, 'set_sort_key', p.product_id,
+                        p.priority, p.updated_ts)
     return p
 
 def delete_product(product_id):
@@ -390,6 +617,7 @@ def delete_product(product_id):
         p = get_product(product_id)
         db.session.delete(p)
         db.session.flush()
+        facets.queue_update(p.domain_id, 'remove_product', p.product_id)
         #.products.delete().where(
         #    (products.c.domain_id==g.domain['domain_id'])&
         #    (products.c.product_id==product_id)))
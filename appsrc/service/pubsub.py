@@ -0,0 +1,80 @@
+"""
+Broadcast of cache invalidations between workers, over Redis pub/sub.
+
+Modules register a handler for a channel with `subscribe(channel, handler)`,
+handlers are called with the message (a str) from a single listener thread
+per process. `publish(channel, message)` reaches every worker, the publisher
+included.
+
+Redis being unavailable only disables the broadcast: per-worker caches must
+bound their staleness on their own (e.g. with a TTL).
+"""
+import os
+import threading
+import time
+
+import redis
+from flask import current_app as app
+
+from .utils import redis_client
+
+# seconds between attempts to (re)subscribe when Redis is unavailable
+RETRY_DELAY = 30
+
+_handlers = {}
+_listener = None
+_listener_pid = None
+_retry_at = 0
+_lock = threading.Lock()
+
+def subscribe(channel, handler):
+    with _lock:
+        _handlers.setdefault(channel, []).append(handler)
+
+def _on_message(message):
+    channel, data = message['channel'], message['data']
+    if isinstance(channel, bytes):
+        channel = channel.decode('utf-8')
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    for handler in _handlers.get(channel, []):
+        handler(data)
+
+def _on_error(e, pubsub, thread):
+    thread.stop()
+
+def _listening():
+    return (_listener is not None and _listener.is_alive()
+            and _listener_pid==os.getpid())
+
+def ensure_listening():
+    """
+    Start this process's listener thread (threads don't survive a fork).
+    Cheap enough to be called on every request.
+    """
+    global _listener, _listener_pid, _retry_at
+    if _listening() or time.monotonic() < _retry_at or not _handlers:
+        return
+    with _lock:
+        if _listening() or time.monotonic() < _retry_at:
+            return
+        _retry_at = time.monotonic() + RETRY_DELAY
+        try:
+            pubsub = redis_client().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{channel: _on_message for channel in _handlers})
+            _listener = pubsub.run_in_thread(
+                sleep_time=1, daemon=True, exception_handler=_on_error)
+            _listener_pid = os.getpid()
+        except redis.RedisError as e:
+            app.logger.warning(f'Cache invalidations unavailable: {e}')
+
+def publish(channel, message):
+    """
+    Send `message` to every worker. Return False if Redis is unavailable.
+    """
+    try:
+        redis_client().publish(channel, message)
+        return True
+    except redis.RedisError as e:
+        app.logger.warning(f'Could not publish to {channel}: {e}')
+        return False
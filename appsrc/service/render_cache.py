@@ -0,0 +1,161 @@
+"""
+Cache of rendered product documents.
+
+Documents are keyed by `(domain_id, product_id, version, lang, audience)`,
+audience being either 'public' or 'admin', and version being the product's
+document version (see `service.products.document_version`): its `updated_ts`,
+its `render_version`, bumped by changes to its groups and images, and the
+version of the Thumbor key its image URLs are signed with. Since the version is
+part of the key, a change to any of them makes every cached version of the
+product unreachable, in every worker. Writes also invalidate the products
+explicitly, to free the space right away.
+
+Two tiers:
+    - an in-process LRU, checked first;
+    - Redis, shared by all workers. A product's documents are kept in a single
+      hash, `render:<domain_id>:<product_id>`, with one field per
+      `<version>:<lang>:<audience>` variant, so that invalidating a product
+      is one DEL.
+
+Redis being unavailable only disables its tier.
+"""
+import simplejson as json
+import redis
+from flask import current_app as app
+
+from .utils import redis_client
+from ..utils.cache import LRUCache
+from ..utils.jsontools import json_serialize
+from ..utils.uuid import clean_uuid
+
+PUBLIC = 'public'
+ADMIN = 'admin'
+
+# number of products kept in the in-process tier
+LRU_SIZE = 2048
+# lifetime of a product's documents in Redis, in seconds
+REDIS_TTL = 24 * 3600
+
+_local = LRUCache(maxsize=LRU_SIZE)
+
+def _enabled():
+    return app.config.get('RENDER_CACHE', True)
+
+def _redis_call(fnc):
+    try:
+        return fnc(redis_client())
+    except redis.RedisError as e:
+        app.logger.warning(f'Render cache unavailable: {e}')
+
+def _product_key(domain_id, product_id):
+    return (domain_id, clean_uuid(product_id))
+
+def _redis_key(domain_id, product_id):
+    return 'render:{}:{}'.format(*_product_key(domain_id, product_id))
+
+def _field(version, lang, audience):
+    return f'{version}:{lang}:{audience}'
+
+def _field_version(field):
+    # versions contain colons, langs and audiences don't
+    return field.rsplit(':', 2)[0]
+
+def get_many(domain_id, versions, lang, audience):
+    """
+    Return the cached documents of the products in `versions`, a list of
+    (product_id, version) pairs, as a dict keyed by (clean) product_id.
+    """
+    rv = {}
+    if not _enabled():
+        return rv
+    remote = []
+    for product_id, version in versions:
+        field = _field(version, lang, audience)
+        document = (_local.get(_product_key(domain_id, product_id)) or {}).get(field)
+        if document is not None:
+            rv[clean_uuid(product_id)] = document
+        else:
+            remote.append((product_id, field))
+    if not remote:
+        return rv
+    def fetch(client):
+        pipe = client.pipeline(transaction=False)
+        for product_id, field in remote:
+            pipe.hget(_redis_key(domain_id, product_id), field)
+        return pipe.execute()
+    for (product_id, field), document in zip(remote, _redis_call(fetch) or []):
+        if document is None:
+            continue
+        document = json.loads(document)
+        _set_local(domain_id, product_id, field, document)
+        rv[clean_uuid(product_id)] = document
+    return rv
+
+def get(domain_id, product_id, version, lang, audience):
+    return get_many(
+        domain_id, [(product_id, version)], lang, audience).get(clean_uuid(product_id))
+
+def _set_local(domain_id, product_id, field, document):
+    key = _product_key(domain_id, product_id)
+    variants = dict(_local.get(key) or {})
+    # drop variants of older versions of the product
+    version = _field_version(field)
+    variants = {f:d for f,d in variants.items() if _field_version(f)==version}
+    variants[field] = document
+    _local.set(key, variants)
+
+def set(domain_id, product_id, version, lang, audience, document):
+    """
+    Cache a document and return it as the cache serves it, i.e. as the API
+    would send it, so that responses don't depend on the cache's state.
+    """
+    data = json.dumps(document, use_decimal=True, default=json_serialize)
+    document = json.loads(data)
+    if not _enabled():
+        return document
+    field = _field(version, lang, audience)
+    _set_local(domain_id, product_id, field, document)
+    def store(client):
+        key = _redis_key(domain_id, product_id)
+        pipe = client.pipeline(transaction=False)
+        pipe.hset(key, field, data)
+        pipe.expire(key, REDIS_TTL)
+        pipe.execute()
+    _redis_call(store)
+    return document
+
+def invalidate(domain_id, product_id):
+    invalidate_many(domain_id, [product_id])
+
+def invalidate_many(domain_id, product_ids):
+    """
+    Drop every cached document of the products, with a single round trip to
+    Redis.
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    for product_id in product_ids:
+        _local.delete(_product_key(domain_id, product_id))
+    if _enabled():
+        _redis_call(lambda client: client.delete(
+            *[_redis_key(domain_id, product_id) for product_id in product_ids]))
+
+def cached_resources(domain_id, versions, lang, audience, load, render):
+    """
+    Return the documents of the products in `versions`, a list of
+    (product_id, version), in that order. Only products missing from the
+    cache are loaded, with `load(product_ids)`, and rendered, with
+    `render(product)`.
+    """
+    documents = get_many(domain_id, versions, lang, audience)
+    missing = {clean_uuid(product_id): version for product_id, version in versions
+               if clean_uuid(product_id) not in documents}
+    if missing:
+        for product in load(list(missing)):
+            product_id = clean_uuid(product.product_id)
+            documents[product_id] = set(
+                domain_id, product_id, missing[product_id], lang, audience,
+                render(product))
+    return [documents[clean_uuid(product_id)] for product_id, version in versions
+            if clean_uuid(product_id) in documents]
@@ -0,0 +1,44 @@
+"""
+Dramatiq messages sent once the current transaction commits, so that actors
+never look for rows that aren't committed yet, nor for rows that were rolled
+back.
+
+    tasks.enqueue_after_commit('send_signin', clean_uuid(signin_id))
+
+The actors live in `appsrc.scheduled`, which builds its own app, so they are
+addressed by name, on the broker set up by `config`. If the broker can't be
+reached the message is dropped and logged: the periodic jobs of the
+scheduler pick up whatever wasn't sent (e.g. `send_passcode`,
+`sweep_derivatives`).
+"""
+import logging
+
+import dramatiq
+from sqlalchemy import event
+
+from ..db import db
+
+logger = logging.getLogger(__name__)
+
+def message(actor_name, *args, queue_name='default', **kwargs):
+    return dramatiq.Message(
+        queue_name=queue_name, actor_name=actor_name, args=args,
+        kwargs=kwargs, options={})
+
+def enqueue_after_commit(actor_name, *args, queue_name='default', **kwargs):
+    # service
+    db.session.info.setdefault('dramatiq_messages', []).append(
+        message(actor_name, *args, queue_name=queue_name, **kwargs))
+
+@event.listens_for(db.session, 'after_commit')
+def _enqueue_messages(session):
+    for msg in session.info.pop('dramatiq_messages', ()):
+        try:
+            dramatiq.get_broker().enqueue(msg)
+        except Exception:
+            logger.exception('Could not enqueue %s', msg.actor_name)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_messages(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('dramatiq_messages', None)
@@ -65,6 +65,7 @@ My advice is to keep things as flat and simple as reasonably possible.
 from copy import deepcopy
 
 from flask import url_for, current_app as app
+import redis
 import stripe
 
 from . import errors as err
@@ -324,6 +325,20 @@ def delocalize_data(data, fields, lang):
     return rv
 
 
+_redis = None
+
+def redis_client():
+    """
+    Redis client (REDIS_HOST) shared by the service caches. Short timeouts:
+    callers treat Redis as optional and fall back when it's unavailable.
+    """
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis(
+            host=app.config['REDIS_HOST'], socket_timeout=0.5,
+            socket_connect_timeout=0.5)
+    return _redis
+
 class StripeContext:
 
     def __init__(self):
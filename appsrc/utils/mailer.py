@@ -1,9 +1,14 @@
 import smtplib
+import threading
+import time
+from collections import deque
 from email.message import EmailMessage
 from contextlib import contextmanager
 from functools import partial
 
 class Mailer:
+    TIMEOUT = 30
+
     def __init__(self, login, password, sender=None, to=None, subject=None, content=None,
                  html_content=None,):
         self.login = login
@@ -25,27 +30,40 @@ class Mailer:
             if isinstance(to, str):
                 to = [to]
             message['To'] = ', '.join(to)
+        self.to = to or []
         self.message = message
 
     def send(self, debug=False):
         with self.connection(debug=debug) as conn:
-            conn.sendmail(
-                self.message['From'],
-                self.message['To'],
-                self.message.as_string())
+            self.send_with(conn)
 
-    @contextmanager
-    def connection(self, debug=False):
-        conn = self.Connection(self.SERVER, self.PORT)
+    def send_with(self, conn):
+        """
+        Send the message over an open, authenticated connection.
+        """
+        conn.sendmail(self.message['From'], self.to, self.message.as_string())
+
+    def open(self, debug=False):
+        conn = self.Connection(self.SERVER, self.PORT, timeout=self.TIMEOUT)
         conn.set_debuglevel(debug)
         # give a chance to subclass to customize connection
         self.customize(conn)
-        conn.login(self.login, self.password)
-        yield conn
-        conn.quit()
+        self.authenticate(conn)
+        return conn
+
+    @contextmanager
+    def connection(self, debug=False):
+        conn = self.open(debug=debug)
+        try:
+            yield conn
+        finally:
+            close(conn)
 
     def customize(self, conn): pass
 
+    def authenticate(self, conn):
+        conn.login(self.login, self.password)
+
 
 class Gmail(Mailer):
     SERVER = 'smtp.gmail.com'
@@ -74,6 +92,16 @@ class Zoho(Mailer):
     PORT = 465
     Connection = smtplib.SMTP_SSL
 
+class Local(Mailer):
+    """
+    Plain, unauthenticated SMTP on localhost, e.g. a development sink.
+    """
+    SERVER = 'localhost'
+    PORT = 1025
+    Connection = smtplib.SMTP
+
+    def authenticate(self, conn): pass
+
 
 def select(mailer):
     if mailer.lower()=='zoho':
@@ -82,3 +110,148 @@ def select(mailer):
         return Gmail
     if mailer.lower()=='fastmail':
         return Fastmail
+    if mailer.lower()=='local':
+        return Local
+
+
+def close(conn):
+    try:
+        conn.quit()
+    except (smtplib.SMTPException, OSError):
+        conn.close()
+
+# errors after which a connection can't be trusted anymore
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, OSError)
+
+class PooledConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.opened = self.used = time.monotonic()
+        self.sent = 0
+
+
+class SMTPPool:
+    """
+    Authenticated SMTP connections kept open and reused across messages, so
+    that the TCP, TLS and login handshakes are paid once per connection
+    instead of once per message.
+
+        pool = SMTPPool(Gmail, login, password)
+        with pool.session() as session:
+            for mailer in mailers:
+                session.send(mailer)
+
+    At most `size` connections are open at once. A connection idle for more
+    than `keepalive` seconds is checked with NOOP before it is reused; one
+    older than `max_age` seconds or that sent `max_messages` messages is
+    closed, since providers drop long-lived sessions.
+    """
+
+    def __init__(self, mailer, login, password, size=4, keepalive=30,
+                 max_age=300, max_messages=100, debug=False):
+        self.mailer = mailer(login, password)
+        self.keepalive = keepalive
+        self.max_age = max_age
+        self.max_messages = max_messages
+        self.debug = debug
+        self.idle = deque()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def _open(self):
+        return PooledConnection(self.mailer.open(debug=self.debug))
+
+    def _expired(self, pooled, now):
+        return (now - pooled.opened > self.max_age
+                or pooled.sent >= self.max_messages)
+
+    def _alive(self, pooled):
+        try:
+            return pooled.conn.noop()[0]==250
+        except CONNECTION_ERRORS + (smtplib.SMTPException,):
+            return False
+
+    def acquire(self):
+        """
+        An open connection, reused when possible. Blocks while `size`
+        connections are in use.
+        """
+        self.slots.acquire()
+        try:
+            while True:
+                with self.lock:
+                    pooled = self.idle.pop() if self.idle else None
+                if pooled is None:
+                    return self._open()
+                now = time.monotonic()
+                if self._expired(pooled, now) or (
+                        now - pooled.used > self.keepalive and not self._alive(pooled)):
+                    close(pooled.conn)
+                    continue
+                return pooled
+        except:
+            self.slots.release()
+            raise
+
+    def release(self, pooled, reusable=True):
+        if reusable and not self._expired(pooled, time.monotonic()):
+            pooled.used = time.monotonic()
+            with self.lock:
+                self.idle.append(pooled)
+        else:
+            close(pooled.conn)
+        self.slots.release()
+
+    @contextmanager
+    def session(self):
+        session = PooledSession(self)
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def send(self, *mailers):
+        with self.session() as session:
+            for mailer in mailers:
+                session.send(mailer)
+
+    def clear(self):
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+        for pooled in idle:
+            close(pooled.conn)
+
+
+class PooledSession:
+    """
+    Messages sent over one pooled connection. If the connection fails, it is
+    replaced and the message is sent again, once.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.pooled = None
+
+    def send(self, mailer):
+        if self.pooled is not None and self.pool._expired(self.pooled, time.monotonic()):
+            self._release()
+        for attempt in (1, 2):
+            if self.pooled is None:
+                self.pooled = self.pool.acquire()
+            try:
+                mailer.send_with(self.pooled.conn)
+            except CONNECTION_ERRORS:
+                self._release(reusable=False)
+                if attempt==2:
+                    raise
+            else:
+                self.pooled.sent += 1
+                return
+
+    def _release(self, reusable=True):
+        pooled, self.pooled = self.pooled, None
+        self.pool.release(pooled, reusable)
+
+    def close(self):
+        if self.pooled is not None:
+            self._release()
@@ -0,0 +1,108 @@
+"""
+Counters and histograms aggregated in Redis, across processes and hosts.
+
+    store = MetricsStore(redis_client)
+    store.observe('dramatiq_execution_seconds', 0.42, actor='send_inquiries')
+    store.inc('dramatiq_messages_total', actor='send_inquiries', outcome='ok')
+    print(render(store.collect()))
+
+Each series is one Redis hash: one field per histogram bucket, plus `sum`
+and `count`, updated with HINCRBY/HINCRBYFLOAT. Buckets are cumulative and
+`render` writes the Prometheus text format.
+
+Recording never raises: metrics being unavailable mustn't fail the work
+they measure.
+"""
+import logging
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 120, 300, 600)
+
+def series_key(prefix, name, labels):
+    pairs = ','.join(f'{k}={v}' for k, v in sorted(labels.items()))
+    return f'{prefix}:{name}:{pairs}'
+
+def parse_key(prefix, key):
+    name, pairs = key[len(prefix) + 1:].split(':', 1)
+    labels = dict(p.split('=', 1) for p in pairs.split(',') if p)
+    return name, labels
+
+def bucket_label(bound):
+    return '+Inf' if bound==float('inf') else repr(float(bound))
+
+class MetricsStore:
+
+    def __init__(self, client, prefix='metrics', buckets=DEFAULT_BUCKETS):
+        self.client = client
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def _execute(self, commands):
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            commands(pipe)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning('Could not record metrics: %s', e)
+
+    def observe(self, name, value, **labels):
+        key = series_key(self.prefix, name, labels)
+        def commands(pipe):
+            for bound in self.buckets:
+                if value <= bound:
+                    pipe.hincrby(key, bucket_label(bound), 1)
+            pipe.hincrbyfloat(key, 'sum', value)
+            pipe.hincrby(key, 'count', 1)
+        self._execute(commands)
+
+    def inc(self, name, amount=1, **labels):
+        key = series_key(self.prefix, name, labels)
+        self._execute(lambda pipe: pipe.hincrby(key, 'count', amount))
+
+    def collect(self):
+        """
+        {(name, labels as a sorted tuple of pairs): {field: number}}
+        """
+        rv = {}
+        for key in self.client.scan_iter(f'{self.prefix}:*'):
+            key = key.decode('utf-8') if isinstance(key, bytes) else key
+            name, labels = parse_key(self.prefix, key)
+            fields = {k.decode('utf-8') if isinstance(k, bytes) else k: float(v)
+                      for k, v in self.client.hgetall(key).items()}
+            rv[(name, tuple(sorted(labels.items())))] = fields
+        return rv
+
+    def reset(self):
+        keys = list(self.client.scan_iter(f'{self.prefix}:*'))
+        if keys:
+            self.client.delete(*keys)
+
+def _labels(pairs, **extra):
+    pairs = list(pairs) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+def render(collected):
+    """
+    Prometheus text format of `MetricsStore.collect()`.
+    """
+    lines = []
+    for (name, pairs), fields in sorted(collected.items()):
+        buckets = [(k, v) for k, v in fields.items() if k not in ('sum', 'count')]
+        if not buckets:
+            lines.append(f'{name}{_labels(pairs)} {_number(fields.get("count", 0))}')
+            continue
+        for bound, count in sorted(buckets, key=lambda b: float(b[0])):
+            lines.append(f'{name}_bucket{_labels(pairs, le=bound)} {_number(count)}')
+        lines.append(f'{name}_sum{_labels(pairs)} {_number(fields.get("sum", 0))}')
+        lines.append(f'{name}_count{_labels(pairs)} {_number(fields.get("count", 0))}')
+    return '\n'.join(lines) + '\n'
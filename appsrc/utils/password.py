@@ -1,16 +1,67 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+import simplejson as json
+from flask import current_app as app
 from vino import errors as vno_err
-from sqlalchemy.orm import exc as orm_exc
 
-def dictionary_match(data, state):
-    from ..db.models.security import CommonWord as Word
-    try:
-        q = Word.query.filter_by(word=data)
-        q.one()
-    except orm_exc.NoResultFound as e:
-        # we didn't find it in the dict, it may be secure
-        return data
-    raise vno_err.ValidationError('Password is too common.')
+# bcrypt cost factor (log2 of the number of rounds)
+BCRYPT_ROUNDS = 12
+# maximum number of passwords hashed at once, per process
+BCRYPT_THREADS = 4
+
+"""
+Common passwords (COMMON_WORDS_FILE) are kept in memory, in a frozenset
+loaded once per process. A password is rejected if any of its normalized
+variants is in the set: case-folded, without trailing digits and symbols
+(e.g. 'Password2024!'), and with leetspeak undone (e.g. 'p4$$w0rd').
+"""
+COMMON_WORDS_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), 'data', 'common_words.json')
+
+# '1', '!' and '|' stand for either 'i' or 'l'
+LEET = [str.maketrans('0134578@$!|+', 'oieastbasiit'),
+        str.maketrans('0134578@$!|+', 'oleastbasllt')]
+TRAILING = re.compile(r'[\d\W_]+$')
+
+_common_words = None
+_common_words_lock = threading.Lock()
+
+def password_variants(password):
+    folded = password.casefold()
+    rv = {folded}
+    stripped = TRAILING.sub('', folded)
+    if stripped:
+        rv.add(stripped)
+    for table in LEET:
+        for variant in (folded, stripped):
+            unleeted = variant.translate(table)
+            rv.add(unleeted)
+            rv.add(TRAILING.sub('', unleeted) or unleeted)
+    rv.discard('')
+    return rv
+
+def common_words():
+    global _common_words
+    if _common_words is None:
+        with _common_words_lock:
+            if _common_words is None:
+                filename = _config('COMMON_WORDS_FILE', COMMON_WORDS_FILE)
+                with open(filename) as f:
+                    _common_words = frozenset(w.casefold() for w in json.load(f))
+    return _common_words
+
+def is_common_password(password):
+    return not common_words().isdisjoint(password_variants(password))
 
+def dictionary_match(data, state):
+    if is_common_password(data):
+        raise vno_err.ValidationError('Password is too common.')
+    # we didn't find it in the dict, it may be secure
+    return data
 
 def max_size(size):
     def validate(data, state):
@@ -105,11 +156,55 @@ def repeated_char(minlength=None):
         return data
     return validate
 
-def encrypt_password(password):
+"""
+bcrypt runs in a bounded pool of threads: it releases the GIL, so threaded
+workers keep serving other requests meanwhile, and a burst of logins can only
+keep BCRYPT_THREADS cores busy per process.
+"""
+_pool = None
+_pool_lock = threading.Lock()
+
+def _config(key, default):
+    try:
+        return app.config.get(key) or default
+    except RuntimeError: # outside of an app context
+        return default
+
+def _hashing_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=_config('BCRYPT_THREADS', BCRYPT_THREADS),
+                    thread_name_prefix='bcrypt')
+    return _pool
+
+def _run(fnc, *a):
+    return _hashing_pool().submit(fnc, *a).result()
+
+def bcrypt_rounds():
+    return _config('BCRYPT_ROUNDS', BCRYPT_ROUNDS)
+
+def password_rounds(encrypted_password):
+    # $2b$<rounds>$<salt+hash>
+    try:
+        return int(encrypted_password.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def needs_rehash(encrypted_password):
+    """
+    Whether a password was hashed with another cost factor than the current
+    one, and should be hashed again on the next successful login.
+    """
+    return password_rounds(encrypted_password)!=bcrypt_rounds()
+
+def encrypt_password(password, rounds=None):
     password = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds or bcrypt_rounds())
     # returns a binary string within the ascii range
-    pwhash = bcrypt.hashpw(password, salt)
+    pwhash = _run(bcrypt.hashpw, password, salt)
     # return as unicode
     return pwhash.decode('utf-8')
 
@@ -117,5 +212,4 @@ def match_passwords(encrypted_password, plain_password):
     #TODO: figure out what to do if user sends us a string outside of unicode
     # plan password arrives in unicode
     plain_password = plain_password.encode('utf-8')
-    return encrypted_password==bcrypt.hashpw(
-        plain_password, encrypted_password.encode('utf-8')).decode('utf-8')
+    return _run(bcrypt.checkpw, plain_password, encrypted_password.encode('utf-8'))
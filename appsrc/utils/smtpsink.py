@@ -0,0 +1,74 @@
+"""
+Minimal SMTP server that accepts and counts every message, standing in for a
+provider in benchmarks and tests.
+
+    with SMTPSink(handshake=0.05) as sink:
+        pool = SMTPPool(mailer.Local, None, None)
+        ...
+        sink.messages, sink.connections
+
+`handshake` delays the greeting of each new connection, to account for the
+TLS and login round trips of a real provider.
+"""
+import socketserver
+import threading
+import time
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        sink = self.server.sink
+        with sink.lock:
+            sink.connections += 1
+        time.sleep(sink.handshake)
+        self.reply('220 sink ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().split(' ', 1)[0].upper()
+            if command=='EHLO':
+                self.reply('250-sink')
+                self.reply('250 8BITMIME')
+            elif command=='DATA':
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                with sink.lock:
+                    sink.messages += 1
+                self.reply('250 queued')
+            elif command=='QUIT':
+                self.reply('221 bye')
+                return
+            elif command in ('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply('250 ok')
+            else:
+                self.reply('502 not implemented')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+
+    def __init__(self, host='localhost', port=0, handshake=0):
+        self.handshake = handshake
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        self.server = _Server((host, port), _Handler)
+        self.server.sink = self
+        self.host, self.port = self.server.server_address[:2]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,87 @@
+"""
+Variants of an image (aspect ratio × size) rendered ahead of time with
+Pillow, as an alternative to rendering them on the fly with Thumbor.
+
+Variants are stored by the signature of the image they are made from:
+
+    <root>/<ab>/<cd>/<signature>/<aspect ratio>_<size>.<extension>
+
+so that a web server can serve them as static files, and so that an image
+re-rendered with the same content lands on the same paths.
+
+The options of a variant are those passed to Thumbor: `crop`, as
+((A, B), (C, D)), and `width` or `height`, the length of the largest side.
+"""
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image as pilimage
+
+JPEG_QUALITY = 85
+
+def variant_path(signature, aspect_ratio, size, extension):
+    """
+    Path of a variant, relative to the variant root.
+    """
+    name = f"{aspect_ratio.replace(':', 'x')}_{size}.{extension}"
+    return os.path.join(signature[:2], signature[2:4], signature, name)
+
+def render_variant(source_path, destination, crop=None, width=None, height=None):
+    """
+    Render a variant of the image at `source_path` into `destination`,
+    atomically.
+    """
+    with pilimage.open(source_path) as source:
+        image_format = source.format
+        image = source.crop((*crop[0], *crop[1])) if crop else source.copy()
+    if width and width < image.width:
+        image = image.resize((width, max(round(image.height * width / image.width), 1)),
+                             pilimage.LANCZOS)
+    elif height and height < image.height:
+        image = image.resize((max(round(image.width * height / image.height), 1), height),
+                             pilimage.LANCZOS)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(destination), prefix='.variant-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            options = {'quality': JPEG_QUALITY} if image_format=='JPEG' else {}
+            image.save(f, format=image_format, **options)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, destination)
+    except:
+        os.unlink(tmp)
+        raise
+    return destination
+
+_pool = None
+_pool_pid = None
+
+def _get_pool(processes):
+    global _pool, _pool_pid
+    # not inherited across forks. Spawned rather than forked: the dramatiq
+    # worker calling this already runs threads.
+    if _pool is None or _pool_pid!=os.getpid():
+        _pool = ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+        _pool_pid = os.getpid()
+    return _pool
+
+def render_variants(source_path, root, jobs, processes=1):
+    """
+    Render `jobs`, [(relative path, options)], under `root`. Variants
+    already rendered are skipped. With more than one process, in parallel,
+    in that many processes.
+    """
+    jobs = [(os.path.join(root, path), options) for path, options in jobs
+            if not os.path.exists(os.path.join(root, path))]
+    if processes <= 1:
+        for destination, options in jobs:
+            render_variant(source_path, destination, **options)
+        return
+    pool = _get_pool(processes)
+    futures = [pool.submit(render_variant, source_path, destination, **options)
+               for destination, options in jobs]
+    for future in futures:
+        future.result()
@@ -0,0 +1,128 @@
+"""
+Matching of names against word lists with wildcard rules.
+
+A list mixes exact words and rules, `*` standing for any text:
+
+    'admin'      exact
+    'admin-*'    prefix
+    '*-api'      suffix
+    '*porn*'     substring
+
+Exact words go in a set. The fixed parts of the rules go in one Aho-Corasick
+automaton, so that a name is matched against every rule in a single pass,
+whatever the number of rules.
+"""
+from collections import deque
+
+EXACT = 'exact'
+PREFIX = 'prefix'
+SUFFIX = 'suffix'
+SUBSTRING = 'substring'
+
+def parse_rule(word):
+    """
+    Return the (kind, pattern) of a word of the list.
+    """
+    word = word.strip().casefold()
+    starts, ends = word.startswith('*'), word.endswith('*')
+    pattern = word.strip('*')
+    if starts and ends:
+        return SUBSTRING, pattern
+    if ends:
+        return PREFIX, pattern
+    if starts:
+        return SUFFIX, pattern
+    return EXACT, word
+
+class Automaton:
+    """
+    Aho-Corasick automaton: `search(text)` yields (end, pattern) for every
+    occurrence of the patterns in `text`, `end` being the index of the last
+    character of the occurrence.
+    """
+
+    def __init__(self, patterns):
+        # trie: one dict of transitions per state, state 0 is the root
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for pattern in patterns:
+            self._add(pattern)
+        self._link()
+
+    def _add(self, pattern):
+        state = 0
+        for char in pattern:
+            nxt = self.goto[state].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][char] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = nxt
+        self.output[state].append(pattern)
+
+    def _link(self):
+        # breadth-first, so that failure links point to shallower states
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[nxt] = self.goto[fail].get(char, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def search(self, text):
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern in self.output[state]:
+                yield end, pattern
+
+class WordMatcher:
+
+    def __init__(self, words):
+        self.words = sorted(set(w.strip() for w in words if w.strip()))
+        self.exact = set()
+        # pattern -> kinds of rules using it
+        self.rules = {}
+        for word in self.words:
+            kind, pattern = parse_rule(word)
+            if kind==EXACT:
+                self.exact.add(pattern)
+            elif pattern:
+                self.rules.setdefault(pattern, set()).add(kind)
+        self.automaton = Automaton(self.rules)
+
+    def match(self, name):
+        """
+        The word or rule of the list that `name` matches, or None.
+        """
+        name = (name or '').strip().casefold()
+        if name in self.exact:
+            return name
+        for end, pattern in self.automaton.search(name):
+            start = end - len(pattern) + 1
+            for kind in self.rules[pattern]:
+                if kind==SUBSTRING:
+                    return f'*{pattern}*'
+                if kind==PREFIX and start==0:
+                    return f'{pattern}*'
+                if kind==SUFFIX and end==len(name) - 1:
+                    return f'*{pattern}'
+        return None
+
+    def __contains__(self, name):
+        return self.match(name) is not None
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __len__(self):
+        return len(self.words)
@@ -1,8 +1,17 @@
 from appsrc import make_app
 from appsrc.config import config
-from appsrc.db import db
+from appsrc.db import db, init as db_init
 from appsrc.db.models.accounts import Account
+from appsrc.service import (
+    products as prod_srv, domains as dom_srv, images as img_srv, outbox,
+    errors as srv_err)
+from appsrc.config.dramatiq import PRIORITIES
+from appsrc.service.utils import redis_client
+from appsrc.utils import mailer, metrics, password as pwd
+from appsrc.utils.smtpsink import SMTPSink
 import click
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 app = make_app(config)
 
@@ -13,3 +22,155 @@ def create_user(email, password):
     account = Account.query.filter_by(email=email).one()
     account.password = password
     db.session.commit()
+
+@app.cli.command("reindex-products")
+@click.argument("domain_name")
+@click.option("--chunk-size", default=500, show_default=True,
+              help="Number of products indexed per statement.")
+def reindex_products(domain_name, chunk_size):
+    try:
+        domain = dom_srv.get_domain_by_name(domain_name)
+    except srv_err.NotFound as e:
+        raise click.ClickException(e.message)
+    total = 0
+    for count in prod_srv.reindex_products(domain, chunk_size=chunk_size):
+        # commit each chunk so that a long reindex does not hold one huge
+        # transaction open.
+        db.session.commit()
+        total += count
+        click.echo(f"{total} products indexed")
+    click.echo(f"Reindexed {total} products of {domain_name}")
+
+@app.cli.command("sign-images")
+@click.option("--chunk-size", default=500, show_default=True,
+              help="Number of images signed per transaction.")
+@click.option("--force", is_flag=True,
+              help="Sign every image, not only those with stale URLs.")
+def sign_images(chunk_size, force):
+    """
+    Sign again the Thumbor URLs stored with images, after rotating
+    THUMBOR_SECURITY_KEY or changing the size presets.
+    """
+    total = 0
+    for count in img_srv.sign_all_images(chunk_size=chunk_size, force=force):
+        db.session.commit()
+        total += count
+        click.echo(f"{total} images signed")
+    click.echo(f"Signed {total} images, key version {img_srv.thumbor_key_version()}")
+
+@app.cli.command("upgrade-db")
+def upgrade_db():
+    """
+    Add the columns of the current models to an existing database.
+    """
+    db_init.upgrade_schema(app)
+    db.session.commit()
+    click.echo("Upgraded the database schema")
+
+@app.cli.command("backfill-outbox")
+def backfill_outbox():
+    """
+    Queue the emails of inquiries and signins left unsent by the sweepers
+    the outbox replaced. Run once, when deploying the outbox.
+    """
+    inquiries, signins = outbox.backfill()
+    db.session.commit()
+    click.echo(f"Queued {inquiries} inquiry and {signins} signin emails")
+
+@app.cli.command("setup-search-index")
+def setup_search_index():
+    """
+    Install the trigger maintaining the product search index, and the
+    languages it indexes, on an existing database.
+    """
+    db_init.setup_search_index(app)
+    db.session.commit()
+    click.echo("Installed the product search trigger")
+
+@app.cli.command("benchmark-passwords")
+@click.option("--rounds", type=int, default=None,
+              help="bcrypt cost factor. Defaults to BCRYPT_ROUNDS.")
+@click.option("--threads", default=8, show_default=True,
+              help="Concurrent callers, e.g. request threads of a worker.")
+@click.option("--seconds", default=5.0, show_default=True)
+def benchmark_passwords(rounds, threads, seconds):
+    """
+    Hashes per second of this process, through the bounded hashing pool.
+    """
+    rounds = rounds or pwd.bcrypt_rounds()
+    deadline = time.monotonic() + seconds
+    def hash_until_deadline():
+        count = 0
+        while time.monotonic() < deadline:
+            pwd.encrypt_password('correct horse battery staple', rounds=rounds)
+            count += 1
+        return count
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=threads) as callers:
+        counts = [f.result() for f in
+                  [callers.submit(hash_until_deadline) for i in range(threads)]]
+    elapsed = time.monotonic() - started
+    click.echo(f"cost {rounds}, {threads} callers, "
+               f"pool of {app.config.get('BCRYPT_THREADS', pwd.BCRYPT_THREADS)}: "
+               f"{sum(counts) / elapsed:.1f} hashes/sec")
+
+@app.cli.command("benchmark-mail")
+@click.option("--messages", default=500, show_default=True)
+@click.option("--threads", default=4, show_default=True,
+              help="Concurrent senders, e.g. dramatiq worker threads.")
+@click.option("--handshake", default=0.05, show_default=True,
+              help="Seconds the local sink takes to greet a new connection, "
+                   "standing in for the TLS and login round trips.")
+def benchmark_mail(messages, threads, handshake):
+    """
+    Messages per second to a local SMTP sink, one connection per message
+    versus pooled connections.
+    """
+    with SMTPSink(handshake=handshake) as sink:
+        Sink = type('Sink', (mailer.Local,), {'SERVER': sink.host, 'PORT': sink.port})
+        def message(i):
+            return Sink('bench@localhost', None, to='admin@localhost',
+                        subject=f'Inquiry {i}', html_content='<p>New inquiry</p>')
+        pool = mailer.SMTPPool(Sink, 'bench@localhost', None, size=threads)
+        def pooled(i):
+            with pool.session() as session:
+                session.send(message(i))
+        for name, send in (('per message', lambda i: message(i).send()),
+                           ('pooled', pooled)):
+            sink.connections = sink.messages = 0
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=threads) as senders:
+                list(senders.map(send, range(messages)))
+            elapsed = time.monotonic() - started
+            click.echo(f"{name}: {sink.messages} messages over {sink.connections} "
+                       f"connections, {sink.messages / elapsed:.1f} messages/sec")
+        pool.clear()
+
+@app.cli.command("metrics")
+@click.option("--reset", is_flag=True, help="Clear the metrics once printed.")
+def print_metrics(reset):
+    """
+    Metrics of the dramatiq workers, in the Prometheus text format.
+    """
+    store = metrics.MetricsStore(redis_client())
+    click.echo(metrics.render(store.collect()), nl=False)
+    if reset:
+        store.reset()
+
+@app.cli.command("queue-depth")
+@click.option("--namespace", default="dramatiq", show_default=True)
+def queue_depth(namespace):
+    """
+    Messages waiting in each queue of the Redis broker: ready to run,
+    delayed (retries), in flight, and dead.
+    """
+    client = redis_client()
+    click.echo(f"{'queue':<14}{'ready':>8}{'delayed':>9}{'in flight':>11}{'dead':>7}")
+    for queue in PRIORITIES:
+        name = f"{namespace}:{queue}"
+        ready = client.llen(name)
+        delayed = client.llen(f"{name}.DQ")
+        # .msgs holds every message not acked yet, ready ones included
+        in_flight = max(client.hlen(f"{name}.msgs") - ready, 0)
+        dead = client.zcard(f"{name}.XQ")
+        click.echo(f"{queue:<14}{ready:>8}{delayed:>9}{in_flight:>11}{dead:>7}")
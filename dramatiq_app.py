@@ -1,3 +1,4 @@
 from appsrc.scheduled.emails import dramatiq
+from appsrc.scheduled import images
 
 app = dramatiq.flask_app
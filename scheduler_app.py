@@ -1,9 +1,19 @@
-from appsrc.scheduled import scheduler, emails
+import redis
+
+from appsrc.scheduled import scheduler, emails, images, leader
 
 if __name__=='__main__':
-    c = scheduler.Cron()
-    c.crontab(job=emails.send_passcode.send)
+    config = emails.dramatiq.flask_app.config
+    # one replica out of many runs the jobs, the others stand by
+    lease = leader.LeaderLease(
+        redis.Redis(host=config['REDIS_HOST'], socket_timeout=2,
+                    socket_connect_timeout=2),
+        'scheduler', ttl=config['SCHEDULER_LEASE_TTL'])
+    c = scheduler.Cron(lease=lease)
+    # passcodes are sent as signins are created, this only sweeps stragglers
+    c.crontab(job=emails.send_passcode.send, crontab='*/10 * * * *')
     c.crontab(job=emails.send_inquiries.send)
+    c.crontab(job=images.sweep_derivatives.send, crontab='*/5 * * * *')
     #c.crontab(job=emails.send_password_reset_email.send)
     #c.crontab(job=emails.delete_expired_tokens.send)
     #c.crontab(job=emails.send_activation_email.send)
@@ -2,5 +2,9 @@
 
 set -a; source <(echo -n "$ENV_FILE" ); set +a;
 #set -a; source <(printf "$ENV_FILE" ); set +a;
-dramatiq dramatiq_app &
+# passcodes get their own worker, so that logins don't wait behind bulk emails
+dramatiq dramatiq_app --queues passcodes --processes 1 --threads ${PASSCODE_THREADS:-4} &
+# image derivatives are CPU bound: processes rather than threads
+dramatiq dramatiq_app --queues images --processes ${IMAGE_PROCESSES:-2} --threads 1 &
+dramatiq dramatiq_app --queues inquiries maintenance --processes 1 --threads ${BULK_THREADS:-2} &
 python -m scheduler_app
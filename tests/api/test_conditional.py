@@ -0,0 +1,52 @@
+import pytest
+from flask import g
+from werkzeug import exceptions as werk_exc
+
+from appsrc.api.routes.routing import conditional_wrapper
+
+@pytest.fixture
+def view():
+    def view(**kw):
+        view.calls += 1
+        return {'name': 'carrot'}, 200, []
+    view.calls = 0
+    return view
+
+version = lambda domain, params, **kw: 'v1'
+
+def test_body_etag(app, view):
+    fnc = conditional_wrapper(view, cacheable=True, if_none_match=True)
+    with app.test_request_context('/products'):
+        response = fnc()
+    etag, weak = response.get_etag()
+    assert response.status_code==200 and not weak
+    assert response.headers['Cache-Control']=='private, no-cache'
+    assert 'Authorization' in response.vary
+    with app.test_request_context('/products', headers={'If-None-Match': f'"{etag}"'}):
+        response = fnc()
+    assert response.status_code==304
+    assert response.get_data()==b''
+
+def test_version_etag_skips_view(app, view):
+    fnc = conditional_wrapper(view, if_none_match=version)
+    with app.test_request_context('/products/1'):
+        etag, _ = fnc().get_etag()
+    with app.test_request_context('/products/1', headers={'If-None-Match': f'"{etag}"'}):
+        assert fnc().status_code==304
+    assert view.calls==1
+    # another representation of the same version
+    with app.test_request_context('/products/1?lang=fr',
+                                  headers={'If-None-Match': f'"{etag}"'}):
+        g.lang = 'fr'
+        assert fnc().status_code==200
+
+def test_if_match(app, view):
+    fnc = conditional_wrapper(view, if_match=version)
+    with app.test_request_context('/products/1', method='PUT',
+                                  headers={'If-Match': '"stale"'}):
+        with pytest.raises(werk_exc.HTTPException) as e:
+            fnc()
+    assert e.value.response.status_code==412
+    assert view.calls==0
+    with app.test_request_context('/products/1', method='PUT'):
+        assert fnc().status_code==200
@@ -0,0 +1,39 @@
+import pytest
+from werkzeug.exceptions import HTTPException
+from werkzeug.datastructures import MultiDict
+from appsrc.api import images as img_api
+from appsrc.db.models.domains import Domain
+from appsrc.db.models.images import SourceImage, BaseImage
+from appsrc.service import images as img_srv
+
+@pytest.fixture
+def domain(load_domains, nested_session):
+    load_domains(nested_session.connection())
+    return nested_session.query(Domain).first()
+
+def source_status(app, domain, params=None):
+    with app.test_request_context():
+        document, status, _ = img_api.get_source_image_status(
+            'src', domain, MultiDict(params or {}))
+    assert status==200
+    return document
+
+def test_source_image_status(app, domain, nested_session):
+    source = SourceImage(domain_id=domain.domain_id, source_image_id='src', meta={})
+    img_srv.set_derivatives_status(source, img_srv.PENDING)
+    nested_session.add(source)
+    nested_session.flush()
+    document = source_status(app, domain, {'wait': '0'})
+    assert document['status']==img_srv.PENDING
+    assert 'image_id' not in document
+    nested_session.add(BaseImage(
+        domain_id=domain.domain_id, base_image_id='img', source=source,
+        meta={'filename': 'img.jpg', 'width': 10, 'height': 10}))
+    nested_session.flush()
+    document = source_status(app, domain)
+    assert (document['status'], document['image_id'])==(img_srv.READY, 'img')
+
+def test_unknown_source_image_status(app, domain):
+    with pytest.raises(HTTPException) as e:
+        source_status(app, domain)
+    assert e.value.response.status_code==404
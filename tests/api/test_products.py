@@ -0,0 +1,157 @@
+"""
+Query budget of the product resource endpoints: rendering N products should
+cost a fixed number of queries, whatever N.
+"""
+import pytest
+from flask import g
+from werkzeug.datastructures import MultiDict
+
+from appsrc.api import products as prd_api
+from appsrc.api.public import products as public_prd_api
+from appsrc.db.models.domains import Domain
+from appsrc.db.models.groups import Group, GroupOption, ProductGroupOption
+from appsrc.db.models.images import SourceImage, BaseImage, ProductImage
+from appsrc.db.models.products import Product
+from appsrc.service import groups as grp_srv, products as prod_srv, render_cache
+
+# versions + products + group options + product images + base images
+QUERY_BUDGET = 5
+
+@pytest.fixture(autouse=True)
+def local_render_cache(monkeypatch):
+    # in-process tier only, starting empty
+    monkeypatch.setattr(render_cache, '_redis_call', lambda fnc: None)
+    render_cache._local.clear()
+
+@pytest.fixture
+def domain(load_domains, nested_session):
+    load_domains(nested_session.connection())
+    return nested_session.query(Domain).first()
+
+@pytest.fixture
+def make_products(nested_session, domain):
+    """
+    Create `count` products, each tagged with a group option and an image.
+    Return the domain, freshly loaded, and the product ids.
+    """
+    def make(count):
+        session = nested_session
+        domain_id, domain_name = domain.domain_id, domain.name
+        group = Group(domain_id=domain_id, data={})
+        option = GroupOption(domain_id=domain_id, data={})
+        group.options.append(option)
+        source = SourceImage(domain_id=domain_id, source_image_id='src', meta={})
+        image = BaseImage(domain_id=domain_id, base_image_id='img', source=source,
+                          meta={'filename': 'img.jpg', 'width': 10, 'height': 10})
+        products = [Product(domain_id=domain_id, fields={'fields': []})
+                    for i in range(count)]
+        session.add_all([group, source, image, *products])
+        session.flush()
+        for p in products:
+            session.add(ProductGroupOption(
+                domain_id=domain_id, product_id=p.product_id,
+                group_option_id=option.group_option_id))
+            session.add(ProductImage(
+                domain_id=domain_id, product_id=p.product_id,
+                base_image_id=image.base_image_id, data={'position': 0}))
+        session.commit()
+        product_ids = [p.product_id.hex for p in products]
+        # start from a clean identity map, as a fresh request would
+        session.expunge_all()
+        return session.query(Domain).filter_by(name=domain_name).one(), product_ids
+    return make
+
+@pytest.mark.parametrize('view', [
+    prd_api.get_product_resources,
+    public_prd_api.get_public_product_resources,])
+@pytest.mark.parametrize('count', [1, 20])
+def test_product_resources_query_budget(
+    app, view, count, domain, make_products, query_counter):
+    domain, product_ids = make_products(count)
+    params = MultiDict([('pid', pid) for pid in product_ids])
+    with app.test_request_context():
+        g.domain = domain
+        with query_counter() as statements:
+            document, status, _ = view(params=params, domain=domain, lang='en')
+    assert status==200
+    assert len(document['_embedded']['products'])==count
+    assert len(statements)<=QUERY_BUDGET
+
+@pytest.mark.parametrize('count', [1, 20])
+def test_product_details_query_budget(
+    app, count, domain, make_products, query_counter):
+    domain, product_ids = make_products(count)
+    params = MultiDict([('pid', pid) for pid in product_ids])
+    with app.test_request_context():
+        g.domain = domain
+        with query_counter() as statements:
+            document, status, _ = prd_api.get_product_details(
+                domain=domain, lang='en', params=params)
+    assert status==200
+    assert len(document['_embedded']['products'])==count
+    assert len(statements)<=QUERY_BUDGET
+
+def test_product_resources_render_cache(app, domain, make_products, query_counter):
+    domain, product_ids = make_products(3)
+    params = MultiDict([('pid', pid) for pid in product_ids])
+    with app.test_request_context():
+        g.domain = domain
+        first, _, _ = prd_api.get_product_resources(params, domain, 'en')
+        with query_counter() as statements:
+            second, _, _ = prd_api.get_product_resources(params, domain, 'en')
+    # only the versions are queried, the documents come from the cache
+    assert len(statements)==1
+    assert second==first
+
+def test_image_changes_bump_cached_documents(
+    app, domain, make_products, nested_session, query_counter):
+    domain, product_ids = make_products(2)
+    params = MultiDict([('pid', pid) for pid in product_ids])
+    with app.test_request_context():
+        g.domain = domain
+        first, _, _ = prd_api.get_product_resources(params, domain, 'en')
+        prod_srv.touch_image_products(domain.domain_id, ['img'])
+        nested_session.commit()
+        with query_counter() as statements:
+            second, _, _ = prd_api.get_product_resources(params, domain, 'en')
+    # rendered again, from the products' new version
+    assert 1 < len(statements) <= QUERY_BUDGET
+    assert second['product_ids']==first['product_ids']
+
+def test_group_changes_bump_cached_documents(
+    app, domain, make_products, nested_session):
+    domain, product_ids = make_products(2)
+    option = nested_session.query(GroupOption).filter_by(
+        domain_id=domain.domain_id).one()
+    params = MultiDict([('pid', pid) for pid in product_ids])
+    with app.test_request_context():
+        g.domain = domain
+        first, _, _ = prd_api.get_product_resources(params, domain, 'en')
+        grp_srv.delete_group_option(
+            option.group_id, option.group_option_id, domain.domain_id)
+        nested_session.commit()
+        second, _, _ = prd_api.get_product_resources(params, domain, 'en')
+    assert [p['groups'] for p in first['_embedded']['products']]!=[{}, {}]
+    assert [p['groups'] for p in second['_embedded']['products']]==[{}, {}]
+    # membership changes leave the listing order alone
+    assert ([p['last_update'] for p in second['_embedded']['products']]==
+            [p['last_update'] for p in first['_embedded']['products']])
+
+def test_group_changes_change_etag_versions(
+    app, domain, make_products, nested_session):
+    domain, product_ids = make_products(2)
+    option = nested_session.query(GroupOption).filter_by(
+        domain_id=domain.domain_id).one()
+    params = MultiDict([('pid', pid) for pid in product_ids])
+    with app.test_request_context():
+        g.domain = domain
+        unlinked = prd_api.product_version(domain, params, product_ids[0])
+        kept = prd_api.product_version(domain, params, product_ids[1])
+        collection = prd_api.product_resources_version(domain, params)
+        grp_srv.update_group_option_products(
+            option.group_id, option.group_option_id, domain.domain_id,
+            {'products': product_ids[1:]})
+        nested_session.commit()
+        assert prd_api.product_version(domain, params, product_ids[0])!=unlinked
+        assert prd_api.product_version(domain, params, product_ids[1])==kept
+        assert prd_api.product_resources_version(domain, params)!=collection
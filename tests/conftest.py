@@ -207,6 +207,29 @@ def nested_session(app, db):
     wrapper_trans.rollback()
     conn.close()
 
+@pytest.fixture
+def query_counter(db):
+    """
+    Context manager collecting the SQL statements sent to the database while
+    it's open.
+
+        with query_counter() as statements:
+            ...
+        assert len(statements) <= 3
+    """
+    from sqlalchemy import event
+    @contextlib.contextmanager
+    def counter():
+        statements = []
+        def before_cursor_execute(conn, cursor, statement, *a):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return counter
+
 @pytest.fixture('session')
 def is_uuid():
     def wrapper(to_test, version=None):
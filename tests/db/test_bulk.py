@@ -0,0 +1,17 @@
+from appsrc.db import bulk
+from appsrc.db.models.security import CommonWord
+
+def words(session):
+    return {w.word for w in session.query(CommonWord)}
+
+def test_sync_values(nested_session):
+    assert bulk.sync_values(CommonWord.word, ['alpha', 'beta', 'beta'])==(0, 2)
+    assert words(nested_session)=={'alpha', 'beta'}
+    # tabs, newlines and backslashes go through COPY untouched
+    odd = 'tab\there\nnew\\line'
+    assert bulk.sync_values(CommonWord.word, ['beta', 'gamma', odd])==(1, 2)
+    assert words(nested_session)=={'beta', 'gamma', odd}
+    assert bulk.sync_values(CommonWord.word, [])==(3, 0)
+
+def test_copy_format():
+    assert bulk._copy_line('a\tb\\c')=='a\\tb\\\\c\n'
@@ -0,0 +1,110 @@
+import hashlib
+import io
+import os
+import pytest
+from PIL import Image as pilimage
+from appsrc.db.models import images as img
+
+@pytest.fixture
+def config(tmp_path):
+    return {
+        'DUMP': str(tmp_path),
+        'SUPPORTED_FORMATS': {'JPEG': 'jpg', 'PNG': 'png'},
+        'ASPECT_RATIO': (1/3, 3),
+        'MAX_FILESIZE': 10 * 1024 * 1024,
+        'WEB_MAX_LENGTH': 400,}
+
+def jpeg(size=(300, 200), **options):
+    # noise, so that the file isn't trivially small
+    image = pilimage.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+    f = io.BytesIO()
+    image.save(f, format='JPEG', **options)
+    return f.getvalue()
+
+def files(config, context='source'):
+    rv = []
+    for path, dirs, names in os.walk(os.path.join(config['DUMP'], context)):
+        rv.extend(os.path.relpath(os.path.join(path, n), config['DUMP']) for n in names)
+    return rv
+
+def test_ingest_hashes_what_it_writes(config):
+    data = jpeg()
+    with img.ImageUtil.load_from_file(io.BytesIO(data), config, context='source') as image:
+        assert image.blob_signature==hashlib.sha1(data).hexdigest()
+        assert image.filesize==len(data)
+        with open(image.path, 'rb') as f:
+            assert f.read()==data
+    # not saved: discarded
+    assert files(config)==[]
+
+def test_oversize_uploads_leave_nothing_behind(config):
+    data = jpeg((600, 400))
+    config['MAX_FILESIZE'] = len(data) - 1
+    with pytest.raises(img.ImageFormatError):
+        img.ImageUtil.load_from_file(io.BytesIO(data), config, context='source')
+    assert not any(os.path.basename(f).startswith('.ingest-') for f in files(config))
+
+def test_save_to_content_addressed_path(config):
+    data = jpeg()
+    signature = hashlib.sha1(data).hexdigest()
+    with img.ImageUtil.load_from_file(io.BytesIO(data), config, context='source') as image:
+        image.save()
+    expected = os.path.join('source', signature[:2], signature[2:4], f'{signature}.jpg')
+    assert files(config)==[expected]
+    assert image.filepath==os.path.join(config['DUMP'], expected)
+    with open(image.filepath, 'rb') as f:
+        assert f.read()==data
+
+def exif(orientation=1, description=None):
+    rv = pilimage.Exif()
+    rv[img.ORIENTATION] = orientation
+    if description:
+        # ImageDescription
+        rv[0x010e] = description
+    return rv
+
+def test_non_images_are_rejected_before_staging(config):
+    with pytest.raises(img.ImageFormatError):
+        img.ImageUtil.load_from_file(
+            io.BytesIO(b'not an image' * 10000), config, context='source')
+    assert not os.path.exists(os.path.join(config['DUMP'], 'source'))
+
+def test_aspect_ratio_of_the_rotated_image(config):
+    # 1:2 as stored, 2:1 once rotated
+    data = jpeg((100, 200), exif=exif(orientation=6))
+    config['ASPECT_RATIO'] = (1/3, 1)
+    with pytest.raises(img.ImageFormatError):
+        img.ImageUtil.load_from_file(io.BytesIO(data), config, context='source')
+    assert not os.path.exists(os.path.join(config['DUMP'], 'source'))
+    config['ASPECT_RATIO'] = (1, 3)
+    with img.ImageUtil.load_from_file(io.BytesIO(data), config, context='source') as image:
+        assert image.probe.size==(200, 100)
+
+def test_probe_grows_past_large_exif_blocks():
+    data = jpeg(exif=exif(orientation=6, description='x' * 65400))
+    # the frame header comes after the first PROBE_SIZE bytes
+    assert data.find(b'\xff\xc0') > img.PROBE_SIZE
+    stream = io.BytesIO(data)
+    probe, head = img.probe_image(stream)
+    assert (probe.format, probe.width, probe.height, probe.orientation)==(
+        'JPEG', 300, 200, 6)
+    assert img.PROBE_SIZE < len(head)==stream.tell() <= img.MAX_PROBE_SIZE
+
+def test_web_copy_is_upright_and_sized(config):
+    # left half red, right half blue, displayed rotated a quarter turn
+    # clockwise: red on top
+    stored = pilimage.new('RGB', (1600, 800), 'blue')
+    stored.paste('red', (0, 0, 800, 800))
+    f = io.BytesIO()
+    stored.save(f, format='JPEG', exif=exif(orientation=6))
+    data = io.BytesIO(f.getvalue())
+    with img.ImageUtil.load_from_file(data, config, context='source') as source:
+        with source.thumbnail(context='web') as web:
+            assert (web.image.format, web.image.size)==('JPEG', (200, 400))
+            top, bottom = web.image.getpixel((100, 50)), web.image.getpixel((100, 350))
+            assert top[0] > top[2] and bottom[2] > bottom[0]
+            web.save()
+    with pilimage.open(web.filepath) as saved:
+        assert saved.size==(200, 400)
+        # upright: no orientation left to apply
+        assert saved.getexif().get(img.ORIENTATION, 1)==1
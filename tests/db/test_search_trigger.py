@@ -0,0 +1,36 @@
+import pytest
+from appsrc.db import db, init
+from appsrc.db.models.domains import Domain
+from appsrc.db.models.products import Product
+from appsrc.service import products as prod_srv
+
+def product_fields(value):
+    return {'fields': [
+        {'name': 'name', 'searchable': True, 'localized': False, 'value': value}]}
+
+def indexed_langs(session, product, term):
+    return {r.lang for r in session.execute(db.text(
+        "select ps.lang from product_search ps "
+        "join search_languages sl on sl.lang=ps.lang "
+        "where ps.product_id=:product_id "
+        "and ps.search @@ to_tsquery(sl.language::regconfig, :term)"), {
+            'product_id': product.product_id, 'term': term})}
+
+@pytest.fixture
+def domain(app, load_domains, nested_session):
+    load_domains(nested_session.connection())
+    # twice, as on an existing database
+    init.setup_search_index(app)
+    init.setup_search_index(app)
+    return nested_session.query(Domain).first()
+
+def test_writes_fill_product_search(domain, nested_session):
+    langs = set(prod_srv.search_index_languages(domain))
+    product = Product(domain_id=domain.domain_id, fields=product_fields('espresso'))
+    nested_session.add(product)
+    nested_session.flush()
+    assert indexed_langs(nested_session, product, 'espresso')==langs
+    product.fields = product_fields('latte')
+    nested_session.flush()
+    assert indexed_langs(nested_session, product, 'espresso')==set()
+    assert indexed_langs(nested_session, product, 'latte')==langs
@@ -0,0 +1,103 @@
+import contextlib
+from types import SimpleNamespace
+import pytest
+from appsrc.db.models.accounts import Account
+from appsrc.db.models.domains import Domain, DomainAccount
+from appsrc.db.models.inquiries import Inquiry, InquiryProduct
+from appsrc.db.models.products import Product
+from appsrc.scheduled import emails
+from appsrc.service import outbox
+
+def test_rate_limit_units():
+    # dramatiq's windows are in seconds, its ttls in milliseconds
+    assert emails.bulk_mail_rate.window_millis==60 * 1000
+    assert emails.inquiry_concurrency.ttl==10 * 60 * 1000
+
+FIELDS = {'fields': [
+    {'name': 'name', 'localized': True, 'value': {'en': 'Espresso', 'fr': 'Express'}},
+    {'name': 'number', 'localized': False, 'value': 'E-1'},]}
+
+def test_field_map():
+    fields = emails.field_map(FIELDS)
+    assert set(fields)=={'name', 'number'}
+    assert fields['number']['value']=='E-1'
+    assert emails.field_map(None)=={}
+
+def test_field_value():
+    fields = emails.field_map(FIELDS)
+    assert emails.field_value(fields, 'name', 'fr')=='Express'
+    assert emails.field_value(fields, 'name', 'de') is None
+    assert emails.field_value(fields, 'number', 'fr')=='E-1'
+    assert emails.field_value(fields, 'price', 'en') is None
+
+def test_prep_inquiry_data():
+    inquiry = SimpleNamespace(
+        account='account', data={'lang': 'en', 'messages': [{'comments': 'Soon'}]},
+        products=[
+            SimpleNamespace(product_id=1, quantity='2', data={}),
+            SimpleNamespace(product_id=2, quantity='1',
+                            data={'messages': [{'comments': None}]}),])
+    data = emails.prep_inquiry_data(inquiry, {1: emails.field_map(FIELDS)})
+    assert (data['account'], data['comments'])==('account', 'Soon')
+    assert [(p['name'], p['number'], p['quantity'], p['comments'])
+            for p in data['products']]==[
+        ('Espresso', 'E-1', '2', ''), (None, None, '1', '')]
+
+@pytest.fixture
+def domain(app, load_domains, nested_session, monkeypatch):
+    monkeypatch.setattr(emails.dramatiq, 'flask_app', app)
+    load_domains(nested_session.connection())
+    return nested_session.query(Domain).first()
+
+@pytest.fixture
+def make_inquiries(domain, nested_session):
+    """
+    Create `count` inquiries of two products each, with their outbox entries.
+    """
+    account = nested_session.query(Account).first()
+    def make(count, admin=True):
+        if admin:
+            nested_session.add(DomainAccount(
+                domain_id=domain.domain_id, account_id=account.account_id,
+                role='admin', active=True))
+        entries = []
+        for i in range(count):
+            products = [Product(domain_id=domain.domain_id, fields=FIELDS)
+                        for j in range(2)]
+            inquiry = Inquiry(domain_id=domain.domain_id,
+                              account_id=account.account_id,
+                              data={'lang': 'en', 'messages': [{'comments': 'Soon'}]})
+            nested_session.add_all([inquiry, *products])
+            nested_session.flush()
+            inquiry.products.extend(InquiryProduct(
+                domain_id=domain.domain_id, product_id=p.product_id,
+                quantity='1', data={}) for p in products)
+            entries.append(outbox.queue_email(
+                'inquiry', inquiry.inquiry_id, domain.domain_id))
+        nested_session.commit()
+        return entries
+    return make
+
+@pytest.mark.parametrize('count', [1, 10])
+def test_inquiry_renderer_query_budget(count, make_inquiries, query_counter):
+    entries = make_inquiries(count)
+    # reloaded after the commit, before counting
+    assert all(e.ref_id for e in entries)
+    with query_counter() as statements:
+        render = emails.inquiry_renderer(entries)
+        messages = [render(e) for e in entries]
+    assert None not in messages
+    # inquiries + their products + their accounts + admins + product fields
+    assert len(statements)<=5
+
+def test_inquiries_wait_for_an_admin(make_inquiries, monkeypatch):
+    sent = []
+    class Pool:
+        @contextlib.contextmanager
+        def session(self):
+            yield SimpleNamespace(send=sent.append)
+    monkeypatch.setattr(emails, 'mail_pool', Pool)
+    entry, = make_inquiries(1, admin=False)
+    emails.deliver([entry], emails.inquiry_renderer([entry]))
+    assert sent==[]
+    assert (entry.status, entry.attempts, entry.last_error)==('pending', 1, 'no admin')
@@ -0,0 +1,53 @@
+import time
+import jwt
+import pytest
+from appsrc.service import auth_cache
+
+@pytest.fixture
+def token(app, monkeypatch):
+    monkeypatch.setattr(auth_cache.pubsub, 'publish', lambda *a: True)
+    auth_cache._tokens.clear()
+    auth_cache._revoked.clear()
+    auth_cache._checked.clear()
+    def make(**claims):
+        claims.setdefault('exp', int(time.time()) + 60)
+        return jwt.encode(claims, app.config['SECRET_KEY'], 'HS256')
+    with app.app_context():
+        yield make
+
+def test_tokens_are_verified_once(token, monkeypatch):
+    decode = jwt.decode
+    calls = []
+    monkeypatch.setattr(jwt, 'decode', lambda *a, **kw: calls.append(1) or decode(*a, **kw))
+    t = token(domain='acme', role='admin', account_id='a1')
+    for i in range(3):
+        rv = auth_cache.verify_access_token(t)
+    assert len(calls)==1
+    assert (rv.domain, rv.role)==('acme', 'admin')
+    # callers get their own copy of the claims
+    rv.claims['role'] = 'user'
+    assert auth_cache.verify_access_token(t).claims['role']=='admin'
+
+def test_invalid_tokens(token):
+    with pytest.raises(jwt.InvalidTokenError):
+        auth_cache.verify_access_token(token(exp=int(time.time()) - 10))
+    with pytest.raises(jwt.InvalidTokenError):
+        auth_cache.verify_access_token(token()[:-2])
+
+def test_revoked_tokens(token):
+    t = token(account_id='a1')
+    claims = auth_cache.verify_access_token(t).claims
+    auth_cache.revoke(auth_cache.token_digest(t), claims['exp'])
+    with pytest.raises(jwt.InvalidTokenError):
+        auth_cache.verify_access_token(t)
+
+def test_revocations_outlive_the_worker_cache(token):
+    t = token(account_id='a1')
+    claims = auth_cache.verify_access_token(t).claims
+    auth_cache.revoke(auth_cache.token_digest(t), claims['exp'])
+    # as in a restarted worker, or once evicted
+    auth_cache._tokens.clear()
+    auth_cache._revoked.clear()
+    auth_cache._checked.clear()
+    with pytest.raises(jwt.InvalidTokenError):
+        auth_cache.verify_access_token(t)
@@ -0,0 +1,83 @@
+import os
+from datetime import datetime, timedelta
+import pytest
+from appsrc.db.models.domains import Domain
+from appsrc.db.models.images import SourceImage
+from appsrc.service import images as img_srv, tasks
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    messages = []
+    monkeypatch.setattr(tasks, 'enqueue_after_commit',
+                        lambda *a, **kw: messages.append(a))
+    return messages
+
+@pytest.fixture
+def source(app, load_domains, nested_session, enqueued):
+    load_domains(nested_session.connection())
+    domain = nested_session.query(Domain).first()
+    record = SourceImage(domain_id=domain.domain_id, source_image_id='src', meta={})
+    nested_session.add(record)
+    img_srv.queue_derivatives(record)
+    # committed, as the worker's rollbacks mustn't take it away
+    nested_session.commit()
+    return record
+
+def age(record, delta):
+    derivatives = record.meta['derivatives']
+    updated = datetime.fromisoformat(derivatives['updated']) - delta
+    record.meta = {**record.meta, 'derivatives': {
+        **derivatives, 'updated': updated.isoformat(timespec='seconds')}}
+
+def status(record):
+    return img_srv.get_derivatives_status(record.source_image_id, record.domain_id)[0]
+
+def test_pending_derivatives(source, enqueued):
+    assert enqueued==[('generate_derivatives', source.domain_id, 'src')]
+    assert status(source)==img_srv.PENDING
+    # not stale yet
+    assert img_srv.sweep_derivatives()==0
+
+def test_stale_derivatives_are_queued_again_then_failed(source, enqueued):
+    for sweep in range(img_srv.MAX_SWEEPS):
+        age(source, img_srv.STALE_AFTER + timedelta(minutes=1))
+        assert img_srv.sweep_derivatives()==1
+        assert status(source)==img_srv.PENDING
+    assert len(enqueued)==1 + img_srv.MAX_SWEEPS
+    age(source, img_srv.STALE_AFTER + timedelta(minutes=1))
+    img_srv.sweep_derivatives()
+    assert status(source)==img_srv.FAILED
+
+@pytest.fixture
+def worker(app, monkeypatch, tmp_path):
+    from appsrc.scheduled import images as img_tasks
+    monkeypatch.setattr(img_tasks.dramatiq, 'flask_app', app)
+    monkeypatch.setitem(app.config['IMAGE'], 'DUMP', str(tmp_path))
+    return img_tasks
+
+def stored_at(record, nested_session, content=None):
+    """
+    Point the source record to a file of the DUMP tree, holding `content`
+    unless None.
+    """
+    path = os.path.join(img_srv.imgcnf()['DUMP'], 'source', 'ab', 'cd', 'abcd.jpg')
+    if content is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+    record.meta = {**record.meta, 'filepath': path}
+    nested_session.commit()
+
+def test_worker_fails_derivatives_on_its_last_attempt(source, worker, nested_session):
+    # e.g. a deploy moving the files: retried, until the last attempt
+    stored_at(source, nested_session)
+    # called outside of a worker, i.e. as its last attempt
+    with pytest.raises(FileNotFoundError):
+        worker.generate_derivatives.fn(source.domain_id, 'src')
+    assert status(source)==img_srv.FAILED
+
+def test_worker_fails_bad_images_at_once(source, worker, nested_session):
+    stored_at(source, nested_session, b'not an image')
+    # not retried
+    worker.generate_derivatives.fn(source.domain_id, 'src')
+    assert status(source)==img_srv.FAILED
@@ -0,0 +1,35 @@
+import pytest
+from appsrc.db.models.domains import Domain
+from appsrc.service import domain_cache, errors as err
+
+@pytest.fixture
+def domain_name(app, load_domains, nested_session, monkeypatch):
+    monkeypatch.setattr(domain_cache.pubsub, 'ensure_listening', lambda: None)
+    domain_cache.invalidate()
+    load_domains(nested_session.connection())
+    return nested_session.query(Domain).first().name
+
+def test_domain_is_queried_once(domain_name, query_counter):
+    with query_counter() as statements:
+        first = domain_cache.get(domain_name)
+        second = domain_cache.get(domain_name)
+    assert len(statements)==1
+    assert first==second and first.name==domain_name
+
+def test_snapshots_cannot_be_altered(domain_name):
+    domain_cache.get(domain_name).meta['privacy'] = 'altered'
+    assert domain_cache.get(domain_name).meta.get('privacy')!='altered'
+
+def test_unknown_domains_are_cached(domain_name, query_counter):
+    with query_counter() as statements:
+        for i in range(2):
+            with pytest.raises(err.NotFound):
+                domain_cache.get('no-such-domain')
+    assert len(statements)==1
+
+def test_invalidation(domain_name, query_counter):
+    domain_cache.get(domain_name)
+    domain_cache.invalidate(domain_name)
+    with query_counter() as statements:
+        domain_cache.get(domain_name)
+    assert len(statements)==1
@@ -0,0 +1,78 @@
+import uuid
+from datetime import datetime
+import pytest
+from appsrc.service.facets import FacetIndex
+
+ids = lambda n: [uuid.uuid4().hex for _ in range(n)]
+
+@pytest.fixture
+def catalog():
+    """
+    color: red, blue
+    size: small, large
+    """
+    products = ids(4)
+    color, size = ids(2)
+    red, blue, small, large = ids(4)
+    index = FacetIndex(domain_id=1)
+    index.set_product_options(products[0], {red: color, small: size})
+    index.set_product_options(products[1], {red: color, large: size})
+    index.set_product_options(products[2], {blue: color, large: size})
+    index.add_product(products[3])
+    return dict(index=index, products=products, red=red, blue=blue,
+                small=small, large=large)
+
+def test_no_filter_matches_all_products(catalog):
+    index = catalog['index']
+    assert index.products(index.match())==catalog['products']
+
+def test_options_of_a_group_are_ored(catalog):
+    index, p = catalog['index'], catalog['products']
+    groups = [{'options': [catalog['red'], catalog['blue']]}]
+    assert index.products(index.match(groups))==p[:3]
+
+def test_groups_are_anded(catalog):
+    index, p = catalog['index'], catalog['products']
+    groups = [{'options': [catalog['red']]}, {'options': [catalog['large']]}]
+    assert index.products(index.match(groups))==[p[1]]
+
+def test_counts_leave_out_the_option_group(catalog):
+    index = catalog['index']
+    counts = index.counts([{'options': [catalog['red']]}])
+    # sibling options of the same group are not narrowed by the selection
+    assert counts[catalog['red']]==2
+    assert counts[catalog['blue']]==1
+    # other groups are
+    assert counts[catalog['small']]==1
+    assert counts[catalog['large']]==1
+
+def test_product_options_are_replaced(catalog):
+    index, p = catalog['index'], catalog['products']
+    index.set_product_options(p[0], {catalog['blue']: None})
+    assert index.products(index.options[catalog['red']])==[p[1]]
+    assert index.products(index.options[catalog['small']])==[]
+
+def test_removed_products_and_options(catalog):
+    index, p = catalog['index'], catalog['products']
+    index.remove_product(p[1])
+    assert p[1] not in index.products(index.match())
+    index.remove_options([catalog['red']])
+    assert catalog['red'] not in index.counts()
+
+def test_ordinals_of_a_bitset():
+    bits = 1 | 1 << 3 | 1 << 200
+    assert list(FacetIndex.ordinals_of(bits))==[0, 3, 200]
+    assert list(FacetIndex.ordinals_of(0))==[]
+
+def test_pages_follow_the_listing_order():
+    index = FacetIndex(domain_id=1)
+    old, new = datetime(2020, 1, 1), datetime(2021, 1, 1)
+    p = sorted(ids(4))
+    index.add_product(p[0], 1, old)
+    index.add_product(p[1], 1, new)
+    index.add_product(p[2], None, new)
+    index.add_product(p[3], 0, old)
+    # priority asc, updated_ts desc, product_id desc; no priority last
+    assert index.page(index.match(), 10)==[p[3], p[1], p[0], p[2]]
+    assert index.page(index.match(), 2)==[p[3], p[1]]
+    assert index.page(index.match(), 2, after=(1, new, p[1]))==[p[0], p[2]]
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+from appsrc.db.models.accounts import Signin
+from appsrc.service import outbox
+
+def test_claim_due_emails(nested_session):
+    due = outbox.queue_email('inquiry', uuid4())
+    later = outbox.queue_email('inquiry', uuid4(), delay=timedelta(minutes=5))
+    outbox.queue_email('signin', uuid4())
+    nested_session.flush()
+    assert outbox.claim('inquiry')==[due]
+    # an email of a record is claimed whether it's due or not
+    assert outbox.claim('inquiry', ref_id=later.ref_id)==[later]
+
+def test_failures_back_off(nested_session):
+    entry = outbox.queue_email('inquiry', uuid4())
+    nested_session.flush()
+    outbox.mark_failed(entry, 'timeout')
+    assert (entry.status, entry.attempts, entry.last_error)==('pending', 1, 'timeout')
+    assert entry.next_attempt > datetime.utcnow()
+    assert outbox.claim('inquiry')==[]
+    for i in range(outbox.MAX_ATTEMPTS - 1):
+        outbox.mark_failed(entry, 'timeout')
+    assert entry.status=='failed'
+
+def test_retry_delay():
+    delays = [outbox.retry_delay(n) for n in range(1, 12)]
+    assert delays[:3]==[timedelta(seconds=30), timedelta(seconds=60), timedelta(seconds=120)]
+    assert max(delays)==outbox.MAX_RETRY_DELAY
+
+def test_backfill_unsent_signins(nested_session):
+    unsent = Signin(email=f'{uuid4().hex}@example.com', passcode='x', sent=False)
+    sent = Signin(email=f'{uuid4().hex}@example.com', passcode='x', sent=True)
+    nested_session.add_all([unsent, sent])
+    nested_session.flush()
+    assert outbox.backfill()[1] >= 1
+    assert outbox.claim('signin', ref_id=unsent.signin_id)!=[]
+    assert outbox.claim('signin', ref_id=sent.signin_id)==[]
+    # already queued
+    assert outbox.backfill()[1]==0
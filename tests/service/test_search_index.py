@@ -0,0 +1,28 @@
+from collections import namedtuple
+from appsrc.service.products import searchable_text, search_rows
+
+Product = namedtuple('Product', 'domain_id product_id fields')
+
+fields = {'fields': [
+    {'name': 'name', 'searchable': True, 'localized': True,
+     'value': {'en': 'Gummy bears', 'fr': 'Oursons'}},
+    {'name': 'number', 'searchable': True, 'value': 'GB-100'},
+    {'name': 'description', 'searchable': False, 'localized': True,
+     'value': {'en': 'Chewy', 'fr': 'Moelleux'}},
+    {'name': 'note', 'searchable': True, 'localized': True, 'value': None},
+]}
+
+def test_searchable_text_uses_searchable_fields_only():
+    assert searchable_text(fields, 'en')=='Gummy bears GB-100 '
+
+def test_searchable_text_is_localized():
+    assert searchable_text(fields, 'fr')=='Oursons GB-100 '
+    # missing translation
+    assert searchable_text(fields, 'es')==' GB-100 '
+
+def test_search_rows_cover_every_product_and_language():
+    products = [Product(1, 'p1', fields), Product(1, 'p2', {})]
+    rows = search_rows(products, ['en', 'fr'])
+    assert [(r['product_id'], r['lang']) for r in rows]==[
+        ('p1', 'en'), ('p1', 'fr'), ('p2', 'en'), ('p2', 'fr')]
+    assert rows[-1]['search']==''
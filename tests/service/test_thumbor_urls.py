@@ -0,0 +1,54 @@
+import pytest
+from appsrc.db.models.images import BaseImage
+from appsrc.service import images as img_srv
+
+@pytest.fixture
+def image(app):
+    image = BaseImage(base_image_id='ab' * 20, meta=dict(
+        filename='ab.jpg', extension='jpg', width=1200, height=800))
+    img_srv.set_aspect_ratios(image)
+    return image
+
+@pytest.fixture
+def signatures(monkeypatch):
+    signed = []
+    crypto_url = img_srv._crypto_url
+    def counted(key):
+        crypto = crypto_url(key)
+        class Counted:
+            def generate(self, **options):
+                signed.append(options)
+                return crypto.generate(**options)
+        return Counted()
+    monkeypatch.setattr(img_srv, '_crypto_url', counted)
+    return signed
+
+def test_stored_urls_are_not_signed_again(image, signatures):
+    unsigned = img_srv.get_aspect_ratios(image)
+    img_srv.sign_thumbor_urls(image)
+    del signatures[:]
+    assert img_srv.get_aspect_ratios(image)==unsigned
+    filtered = img_srv.get_aspect_ratios(image, {'aspect_ratios': ['1:1'], 'sizes': ['thumb']})
+    assert filtered=={'1:1': {'thumb': unsigned['1:1']['thumb']}}
+    assert signatures==[]
+
+def test_stale_urls_are_signed_again(app, image, signatures, monkeypatch):
+    img_srv.sign_thumbor_urls(image)
+    stored = img_srv.get_aspect_ratios(image)
+    monkeypatch.setitem(app.config, 'THUMBOR_SECURITY_KEY', 'rotated')
+    del signatures[:]
+    assert img_srv.get_aspect_ratios(image)!=stored
+    assert len(signatures)==7 * len(img_srv.IMAGE_SIZES)
+
+def test_rendered_variants_are_served_locally(app, image, monkeypatch):
+    thumbor = img_srv.get_aspect_ratios(image)
+    image.meta = {**image.meta, 'variants': {'1:1': {'thumb': 'ab/ab/1x1_thumb.jpg'}}}
+    monkeypatch.setitem(app.config, 'IMAGE_VARIANTS_URL', '/variants/')
+    # rendered variants are only served in 'local' mode
+    monkeypatch.setitem(app.config, 'IMAGE_RENDER_MODE', 'thumbor')
+    assert img_srv.get_aspect_ratios(image)==thumbor
+    monkeypatch.setitem(app.config, 'IMAGE_RENDER_MODE', 'local')
+    local = img_srv.get_aspect_ratios(image)
+    assert local['1:1']['thumb']=='/variants/ab/ab/1x1_thumb.jpg'
+    # the others are still Thumbor's
+    assert local['1:1']['small']==thumbor['1:1']['small']
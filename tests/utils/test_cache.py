@@ -0,0 +1,31 @@
+import time
+from appsrc.utils.cache import LRUCache
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a')==1
+    cache.set('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a')==1
+    assert cache.get('c')==3
+
+def test_entries_expire(monkeypatch):
+    now = time.monotonic()
+    cache = LRUCache(ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=60)
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 30)
+    assert cache.get('a') is None
+    assert cache.get('b')==2
+
+def test_delete_and_clear():
+    cache = LRUCache()
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.delete('a')
+    cache.delete('missing')
+    assert 'a' not in cache and len(cache)==1
+    cache.clear()
+    assert len(cache)==0
@@ -0,0 +1,39 @@
+import pytest
+from appsrc.utils import cursors
+
+SECRET = b'test-secret'
+
+def test_cursor_roundtrip():
+    values = [10, '2020-01-01T10:00:00', 'a'*32]
+    token = cursors.encode(cursors.LISTING, values, SECRET)
+    assert cursors.decode(token, cursors.LISTING, SECRET)==values
+
+def test_cursor_is_opaque():
+    token = cursors.encode(cursors.LISTING, [10, 'x'], SECRET)
+    assert '10' not in token.split('.')[1]
+    assert '[' not in token
+
+def test_tampered_cursor_rejected():
+    token = cursors.encode(cursors.LISTING, [10, 'x'], SECRET)
+    forged = cursors.encode(cursors.LISTING, [1, 'x'], b'other-secret')
+    payload, signature = forged.split('.')[0], token.split('.')[1]
+    with pytest.raises(cursors.InvalidCursor):
+        cursors.decode('.'.join([payload, signature]), cursors.LISTING, SECRET)
+
+def test_cursor_kind_must_match():
+    token = cursors.encode(cursors.SEARCH, [0.5, 'x'], SECRET)
+    with pytest.raises(cursors.InvalidCursor):
+        cursors.decode(token, cursors.LISTING, SECRET)
+
+def test_cursor_scope_must_match():
+    scope = cursors.scope_digest('chocolate')
+    token = cursors.encode(cursors.SEARCH, [0.5, 'x'], SECRET, scope=scope)
+    assert cursors.decode(token, cursors.SEARCH, SECRET, scope=scope)==[0.5, 'x']
+    with pytest.raises(cursors.InvalidCursor):
+        cursors.decode(token, cursors.SEARCH, SECRET,
+                       scope=cursors.scope_digest('candy'))
+
+@pytest.mark.parametrize('token', ['', 'abc', 'a.b.c', None, '!!!.???'])
+def test_malformed_cursor_rejected(token):
+    with pytest.raises(cursors.InvalidCursor):
+        cursors.decode(token, cursors.LISTING, SECRET)
@@ -0,0 +1,44 @@
+import socket
+import pytest
+from appsrc.utils import mailer
+from appsrc.utils.smtpsink import SMTPSink
+
+@pytest.fixture
+def sink():
+    with SMTPSink() as sink:
+        sink.Mailer = type('Sink', (mailer.Local,), {'SERVER': sink.host, 'PORT': sink.port})
+        yield sink
+
+def message(sink, i=0):
+    return sink.Mailer('me@localhost', None, to='you@localhost',
+                       subject=f'Hello {i}', content='hello')
+
+def test_pooled_connections_are_reused(sink):
+    pool = mailer.SMTPPool(sink.Mailer, 'me@localhost', None, size=2)
+    with pool.session() as session:
+        for i in range(5):
+            session.send(message(sink, i))
+    pool.send(message(sink), message(sink))
+    assert (sink.messages, sink.connections)==(7, 1)
+    pool.clear()
+
+def test_reconnect_on_failure(sink):
+    pool = mailer.SMTPPool(sink.Mailer, 'me@localhost', None, keepalive=0,
+                           max_messages=3)
+    pool.send(message(sink))
+    # idle connection is checked before reuse, and replaced when dropped
+    pool.idle[0].conn.sock.shutdown(socket.SHUT_RDWR)
+    pool.send(*[message(sink, i) for i in range(4)])
+    assert sink.messages==5
+    # one dropped, one past max_messages
+    assert sink.connections==3
+    pool.clear()
+
+def test_resend_after_disconnect(sink):
+    pool = mailer.SMTPPool(sink.Mailer, 'me@localhost', None)
+    with pool.session() as session:
+        session.send(message(sink))
+        session.pooled.conn.sock.shutdown(socket.SHUT_RDWR)
+        session.send(message(sink))
+    assert (sink.messages, sink.connections)==(2, 2)
+    pool.clear()
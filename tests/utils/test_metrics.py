@@ -0,0 +1,31 @@
+from appsrc.utils import metrics
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes = {}
+    def pipeline(self, transaction=True):
+        return self
+    def execute(self):
+        pass
+    def hincrby(self, key, field, amount):
+        h = self.hashes.setdefault(key, {})
+        h[field] = h.get(field, 0) + amount
+    hincrbyfloat = hincrby
+    def scan_iter(self, pattern):
+        return list(self.hashes)
+    def hgetall(self, key):
+        return self.hashes[key]
+
+def test_histograms_are_cumulative():
+    store = metrics.MetricsStore(FakeRedis(), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        store.observe('lag_seconds', value, actor='send_signin')
+    store.inc('messages_total', actor='send_signin', outcome='ok')
+    assert metrics.render(store.collect()).splitlines()==[
+        'lag_seconds_bucket{actor="send_signin",le="0.1"} 1',
+        'lag_seconds_bucket{actor="send_signin",le="1.0"} 2',
+        'lag_seconds_bucket{actor="send_signin",le="+Inf"} 3',
+        'lag_seconds_sum{actor="send_signin"} 5.55',
+        'lag_seconds_count{actor="send_signin"} 3',
+        'messages_total{actor="send_signin",outcome="ok"} 1',
+    ]
@@ -0,0 +1,13 @@
+from appsrc.utils import password as pwd
+
+def test_encrypt_and_match():
+    encrypted = pwd.encrypt_password('s3cret phrase', rounds=4)
+    assert pwd.password_rounds(encrypted)==4
+    assert pwd.match_passwords(encrypted, 's3cret phrase')
+    assert not pwd.match_passwords(encrypted, 's3cret phrasE')
+
+def test_needs_rehash():
+    assert pwd.needs_rehash(pwd.encrypt_password('s3cret phrase', rounds=4))
+    current = pwd.encrypt_password('s3cret phrase', rounds=pwd.BCRYPT_ROUNDS)
+    assert not pwd.needs_rehash(current)
+    assert pwd.needs_rehash('not a hash')
@@ -0,0 +1,51 @@
+import os
+import pytest
+from PIL import Image as pilimage
+from appsrc.utils import variants
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / 'source.jpg')
+    pilimage.new('RGB', (400, 200), 'white').save(path, format='JPEG')
+    return path
+
+def rendered(path):
+    with pilimage.open(path) as image:
+        return image.format, image.size
+
+def test_variant_path():
+    assert variants.variant_path('abcdef', '16:9', 'thumb', 'jpg')==os.path.join(
+        'ab', 'cd', 'abcdef', '16x9_thumb.jpg')
+
+def test_crop_and_resize(source, tmp_path):
+    destination = str(tmp_path / 'v' / 'square.jpg')
+    variants.render_variant(source, destination, crop=((100, 0), (300, 200)), width=100)
+    assert rendered(destination)==('JPEG', (100, 100))
+    variants.render_variant(source, destination, height=50)
+    assert rendered(destination)==('JPEG', (100, 50))
+
+def test_no_upscale(source, tmp_path):
+    destination = str(tmp_path / 'large.jpg')
+    variants.render_variant(source, destination, width=800)
+    assert rendered(destination)==('JPEG', (400, 200))
+
+def test_atomic_write(source, tmp_path, monkeypatch):
+    destination = str(tmp_path / 'v' / 'thumb.jpg')
+    variants.render_variant(source, destination, width=100)
+    def broken(self, *a, **kw):
+        raise OSError('disk full')
+    monkeypatch.setattr(pilimage.Image, 'save', broken)
+    with pytest.raises(OSError):
+        variants.render_variant(source, destination, width=50)
+    # the previous variant is left whole, no temporary file behind
+    assert os.listdir(tmp_path / 'v')==['thumb.jpg']
+    monkeypatch.undo()
+    assert rendered(destination)==('JPEG', (100, 50))
+
+def test_rendered_variants_are_skipped(source, tmp_path, monkeypatch):
+    jobs = [('a.jpg', {'width': 100}), ('b.jpg', {'width': 50})]
+    variants.render_variants(source, str(tmp_path), jobs)
+    calls = []
+    monkeypatch.setattr(variants, 'render_variant', lambda *a, **kw: calls.append(a))
+    variants.render_variants(source, str(tmp_path), jobs + [('c.jpg', {})])
+    assert calls==[(source, str(tmp_path / 'c.jpg'))]
@@ -0,0 +1,15 @@
+from appsrc.utils.wordmatch import Automaton, WordMatcher
+
+def test_automaton_finds_overlapping_patterns():
+    automaton = Automaton(['he', 'she', 'his', 'hers'])
+    assert sorted(automaton.search('ushers'))==[(3, 'he'), (3, 'she'), (5, 'hers')]
+
+def test_word_matcher():
+    matcher = WordMatcher(['admin', 'admin-*', '*-api', '*porn*', 'www*'])
+    assert matcher.match('Admin')=='admin'
+    assert matcher.match('admin-shop')=='admin-*'
+    assert matcher.match('my-api')=='*-api'
+    assert matcher.match('bestporn4u')=='*porn*'
+    assert matcher.match('www2')=='www*'
+    for name in ['shop-admin', 'apis', 'adm', 'my-api-shop', 'farmstand']:
+        assert name not in matcher
@@ -50,10 +50,10 @@ def test_empty_value_removed(datachecker):
 
 
 
-#@pytest.mark.skip('requires common_words database table')
-def test_common_words_rejected(datachecker, load_common_words, db_session):
-    load_common_words(db_session.connection())
-    for pw in ['softball', 'password', 'valentin']:
+def test_common_words_rejected(datachecker):
+    for pw in ['softball', 'password', 'valentin',
+               # normalized variants
+               'SoftBall', 'password2024!', 'p4$$w0rd', 'L3tm31n']:
         data = {'password': pw}
         with pytest.raises(vno_err.ValidationErrorStack) as e_info:
             datachecker.validate(data)